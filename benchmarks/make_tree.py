@@ -0,0 +1,85 @@
+import os
+import argparse
+import numpy as np
+import h5py as h5
+from typing import Optional, Tuple
+
+EIGER4M_SHAPE = (2163, 2069)  # (ss, fs) of the single panel in cxls/Eiger4M.geom
+ROLES = ('peaks', 'labels', 'peaks_water_overlay', 'water')
+KEV = ('6', '7', '8')          # photon energies of datasets 01-09, as in assign_params.get_params
+CLEN = ('01', '02', '03')      # clen codes for 0.15, 0.25 and 0.35 m
+
+def dataset_kev_clen(dataset: int) -> Tuple[str, str]:
+    """keV and clen code of dataset 1-9 (clen varies slowest, like get_params)."""
+    return KEV[(dataset - 1) % 3], CLEN[(dataset - 1) // 3]
+
+def water_background(shape: Tuple[int, int], level: float = 20.0) -> np.ndarray:
+    """A smooth water ring around the detector centre, float32."""
+    ss, fs = np.indices(shape, dtype=np.float32)
+    r = np.hypot(ss - shape[0] / 2, fs - shape[1] / 2) / max(shape)
+    return (level * np.exp(-((r - 0.3) / 0.08) ** 2) + 0.1 * level).astype(np.float32)
+
+def _write(path: str, data: np.ndarray):
+    with h5.File(path, 'w') as f:
+        f.create_dataset('entry/data/data', data=data)
+
+def generate_tree(root: str, files_per_dataset: int = 4, shape: Tuple[int, int] = EIGER4M_SHAPE,
+                  peak_density: float = 1e-4, empty_fraction: float = 0.1, water_level: float = 20.0,
+                  seed: Optional[int] = 0) -> dict:
+    """
+    Write a synthetic images/<role>/<01-09>/ tree plus water_background.h5 under `root`.
+
+    Every pattern gets Poisson-distributed peak pixels (about `peak_density` of the
+    detector) with log-normal intensities. For each pattern the tree holds the peak image,
+    its binary label, the peaks on a Poisson-noisy water background, and the water alone.
+    A fraction of patterns are 'empty_' files without peaks. File names follow the
+    img_<keV>keV_clen<NN>_<nnnnn>.h5 convention used by reformat-h5.py.
+
+    Returns:
+        dict: The generation parameters, number of files and bytes written.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(root, exist_ok=True)
+    background = water_background(shape, water_level)
+    _write(os.path.join(root, 'water_background.h5'), background)
+    n_pixels = shape[0] * shape[1]
+    n_files = 0
+    for dataset in range(1, 10):
+        kev, clen = dataset_kev_clen(dataset)
+        dirs = {role: os.path.join(root, 'images', role, f"{dataset:02d}") for role in ROLES}
+        for path in dirs.values():
+            os.makedirs(path, exist_ok=True)
+        for i in range(1, files_per_dataset + 1):
+            empty = rng.random() < empty_fraction
+            stem = f"img_{kev}keV_clen{clen}_{i:05d}.h5"
+            peaks = np.zeros(shape, dtype=np.float32)
+            if not empty:
+                idx = rng.choice(n_pixels, size=rng.poisson(peak_density * n_pixels), replace=False)
+                peaks.flat[idx] = rng.lognormal(mean=5.0, sigma=1.5, size=len(idx))
+            water = rng.poisson(background).astype(np.float32)
+            prefix = 'empty_' if empty else ''
+            _write(os.path.join(dirs['peaks'], prefix + stem), peaks)
+            _write(os.path.join(dirs['labels'], f"{prefix}label_{stem}"), (peaks > 0).astype(np.uint8))
+            _write(os.path.join(dirs['peaks_water_overlay'], f"{prefix}overlay_{stem}"), peaks + water)
+            _write(os.path.join(dirs['water'], f"water_{stem}"), water)
+            n_files += len(ROLES)
+    n_bytes = sum(os.path.getsize(os.path.join(dirpath, name)) for dirpath, _, files in os.walk(root) for name in files)
+    return {'files_per_dataset': files_per_dataset, 'shape': list(shape), 'peak_density': peak_density,
+            'empty_fraction': empty_fraction, 'water_level': water_level, 'seed': seed,
+            'files': n_files, 'bytes': n_bytes}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic 01-09 HDF5 tree of Eiger4M-shaped frames.")
+    parser.add_argument("root", help="Directory to create the tree in")
+    parser.add_argument("--files-per-dataset", type=int, default=4, help="Patterns per dataset directory (default: 4)")
+    parser.add_argument("--shape", type=int, nargs=2, default=EIGER4M_SHAPE, metavar=('SS', 'FS'),
+                        help="Frame shape (default: Eiger4M, 2163 2069)")
+    parser.add_argument("--peak-density", type=float, default=1e-4, help="Fraction of pixels that are peaks")
+    parser.add_argument("--empty-fraction", type=float, default=0.1, help="Fraction of patterns without peaks")
+    parser.add_argument("--water-level", type=float, default=20.0, help="Peak counts of the water ring")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    info = generate_tree(args.root, args.files_per_dataset, tuple(args.shape), args.peak_density,
+                         args.empty_fraction, args.water_level, args.seed)
+    print(f"Wrote {info['files']} files, {info['bytes'] / 1e6:.1f} MB to {args.root}")
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import List, Optional
+from make_tree import generate_tree, EIGER4M_SHAPE
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARSE_SCRIPTS = os.path.join(REPO, 'cxls', 'parse-scripts')
+HITFINDER_SCRIPTS = os.path.join(REPO, 'cxls', 'cxls_hitfinder_scripts')
+DATASETS = [f"{i:02d}" for i in range(1, 10)]
+
+def _call_function(module: str, function: str, *args: str) -> List[str]:
+    """Command running module.function(*args) from the hitfinder scripts in a fresh interpreter."""
+    code = (f"import sys; sys.path.insert(0, {HITFINDER_SCRIPTS!r}); "
+            f"from {module} import {function}; {function}(*sys.argv[1:])")
+    return [sys.executable, '-c', code, *args]
+
+def h5_size(path: str):
+    """Number and total bytes of the .h5 files under `path`."""
+    files = [os.path.join(dirpath, name) for dirpath, _, names in os.walk(path) for name in names if name.endswith('.h5')]
+    return len(files), sum(os.path.getsize(file) for file in files)
+
+def run_benchmark(name: str, cmd: List[str], target: str, cwd: str, stdin: Optional[str] = None) -> dict:
+    """
+    Run one command in a child process and measure wall time and the child's peak RSS.
+
+    os.wait4 returns the resource usage of exactly this child (and the workers it waited
+    for), unlike RUSAGE_CHILDREN which accumulates over every benchmark run so far.
+    """
+    n_files, n_bytes = h5_size(target)
+    env = dict(os.environ, MPLBACKEND='Agg')  # plt.show() must not block
+    log_path = os.path.join(cwd, f"{name}.log")
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                stdin=subprocess.PIPE if stdin else subprocess.DEVNULL, text=True)
+        if stdin:
+            proc.stdin.write(stdin)
+            proc.stdin.close()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        seconds = time.perf_counter() - start
+    returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    result = {'name': name, 'seconds': seconds, 'files': n_files, 'bytes': n_bytes,
+              'files_per_s': n_files / seconds, 'mb_per_s': n_bytes / 1e6 / seconds,
+              'peak_rss_mb': peak_rss / 1e6, 'returncode': returncode}
+    if returncode != 0:
+        with open(log_path) as log:
+            result['error'] = log.read()[-2000:]
+    return result
+
+def run_all(work_dir: str, files_per_dataset: int, shape, peak_density: float,
+            only: Optional[List[str]] = None) -> dict:
+    """Generate a tree in `work_dir` and run every benchmark on it, in an order where
+    the ones that modify the tree (attributes, renames) come last."""
+    tree = os.path.join(work_dir, 'tree')
+    print(f"Generating tree in {tree} ...")
+    tree_info = generate_tree(tree, files_per_dataset, shape, peak_density)
+    images = os.path.join(tree, 'images')
+    peaks = os.path.join(images, 'peaks')
+    water_copy = os.path.join(work_dir, 'water_background_input')
+    shutil.copytree(os.path.join(peaks, '01'), water_copy)
+
+    benchmarks = [
+        ('parse-freq', [sys.executable, os.path.join(PARSE_SCRIPTS, 'parse-freq.py'), *DATASETS, 'bench',
+                        '--base-dir', peaks, '--no-cache'], peaks, None),
+        ('parse-intensities', [sys.executable, os.path.join(PARSE_SCRIPTS, 'parse-intensities.py'), *DATASETS,
+                               'bench', '--base-dir', peaks, '--no-cache'], peaks, None),
+        ('apply_water_background', _call_function('apply_water_background', 'process_directory', water_copy,
+                                                  os.path.join(tree, 'water_background.h5')), water_copy, None),
+        ('assign_params', _call_function('assign_params', 'process_directory', peaks), peaks, 'y\n'),
+        ('reformat-h5', [sys.executable, os.path.join(HITFINDER_SCRIPTS, 'reformat-h5.py'), images], images, None),
+    ]
+    results = []
+    for name, cmd, target, stdin in benchmarks:
+        if only and name not in only:
+            continue
+        result = run_benchmark(name, cmd, target, work_dir, stdin)
+        status = 'ok' if result['returncode'] == 0 else f"FAILED ({result['returncode']}, see {name}.log)"
+        print(f"{name:<24}{result['seconds']:>8.2f} s{result['files_per_s']:>10.1f} files/s"
+              f"{result['mb_per_s']:>10.1f} MB/s{result['peak_rss_mb']:>10.1f} MB RSS  {status}")
+        results.append(result)
+    return {'tree': tree_info, 'results': results}
+
+def compare(report: dict, baseline_path: str):
+    """Print the speedup of every benchmark against an earlier JSON report."""
+    with open(baseline_path) as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+    for result in report['results']:
+        old = baseline.get(result['name'])
+        if old and result['returncode'] == 0 and old['returncode'] == 0:
+            print(f"{result['name']:<24}{old['seconds']:>8.2f} s -> {result['seconds']:>8.2f} s"
+                  f"  ({old['seconds'] / result['seconds']:.2f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the parse and hitfinder scripts on a synthetic tree.")
+    parser.add_argument("--files-per-dataset", type=int, default=4, help="Patterns per dataset directory (default: 4)")
+    parser.add_argument("--shape", type=int, nargs=2, default=EIGER4M_SHAPE, metavar=('SS', 'FS'),
+                        help="Frame shape (default: Eiger4M, 2163 2069)")
+    parser.add_argument("--peak-density", type=float, default=1e-4, help="Fraction of pixels that are peaks")
+    parser.add_argument("--only", nargs='+', default=None, help="Run only these benchmarks")
+    parser.add_argument("--work-dir", default=None, help="Where to build the tree, must be empty or new and is always kept (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary tree and logs after the run")
+    parser.add_argument("--output", default=None, help="JSON report path (default: bench_<time>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    if args.work_dir and os.path.isdir(args.work_dir) and os.listdir(args.work_dir):
+        parser.error(f"--work-dir {args.work_dir} is not empty")
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        report = run_all(work_dir, args.files_per_dataset, tuple(args.shape), args.peak_density, args.only)
+    finally:
+        if not args.work_dir and not args.keep:  # only ever remove the directory made above
+            shutil.rmtree(work_dir, ignore_errors=True)
+    report.update({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': socket.gethostname(),
+                   'python': platform.python_version(), 'cpus': os.cpu_count()})
+
+    output = args.output or f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {output}")
+    if args.compare:
+        compare(report, args.compare)
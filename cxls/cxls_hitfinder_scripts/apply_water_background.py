@@ -1,41 +1,334 @@
 import os
+import sys
+import queue
+import argparse
+import threading
 import h5py
 import numpy as np
 import reborn
 
+# shared HDF5 readers live with the parse scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'parse-scripts'))
+from h5_frames import iter_frames
+import profiler
+from h5_walker import walk_h5
+
 # export PYTHONPATH="/Users/adamkurth/Documents/vscode/CXFEL_Image_Analysis/CXFEL/reborn_dev:$PYTHONPATH"
 
 def load_hdf5_image(file_path):
-    """Load an HDF5 image."""
+    """Load an HDF5 image (used for the single water background frame)."""
     with h5py.File(file_path, 'r') as f:
         return np.array(f['entry/data/data'])
 
-def apply_water_background(image_array, background_array):
-    """Apply the water background to the image. This function is a placeholder
-    and should be replaced with actual logic to apply the background."""
-    # This is a simplified example. Replace it with the actual logic for combining the images.
-    return image_array + background_array
+class WaterBackground:
+    """Applies one water background to many images without per-image allocations.
+
+    The background is converted to float64 once. Each call scales it into a reused
+    scratch buffer, optionally Poisson-samples it, adds the image and writes the result
+    into `out` (which may be the image itself), rounded and clipped to the output dtype.
+    """
+
+    def __init__(self, background, dtype=None, clip=True, poisson=False, rng=None):
+        """
+        Args:
+            background (np.ndarray): (ss, fs) water background.
+            dtype (np.dtype, optional): Output dtype, defaults to the dtype of each image.
+            clip (bool): Saturate at the output dtype's range instead of wrapping.
+            poisson (bool): Draw the background as Poisson counts around its (scaled) mean.
+            rng (np.random.Generator, optional): Source of the noise. Parallel workers should
+                each get their own, e.g. np.random.default_rng([seed, worker_id]).
+        """
+        self.background = np.asarray(background, dtype=np.float64)
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        self.clip = clip
+        self.poisson = poisson
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self._scratch = None
+
+    def _scratch_for(self, shape):
+        if self._scratch is None or self._scratch.size < np.prod(shape):
+            self._scratch = np.empty(int(np.prod(shape)), dtype=np.float64)
+        return self._scratch[:int(np.prod(shape))].reshape(shape)
+
+    def apply(self, image, out=None, scale=1.0):
+        """Add the background to an (ss, fs) image or an (n, ss, fs) batch.
+
+        Args:
+            image (np.ndarray): Image or batch of images.
+            out (np.ndarray, optional): Destination, may be `image` for in-place use.
+                A new array of the output dtype is returned if omitted.
+            scale (float or np.ndarray): Background scale factor, or one per image of a batch.
+
+        Returns:
+            np.ndarray: `out` holding the processed image(s).
+        """
+        dtype = out.dtype if out is not None else (self.dtype or image.dtype)
+        scale = np.asarray(scale, dtype=np.float64)
+        if scale.ndim == 1:
+            scale = scale[:, None, None]
 
-def process_directory(directory_path, background_path):
-    """Process all HDF5 images in a directory by applying a water background."""
+        work = self._scratch_for(image.shape)
+        np.multiply(self.background, scale, out=work)
+        if self.poisson:
+            # Generator.poisson cannot write into a buffer, this is the one temporary
+            np.copyto(work, self.rng.poisson(work))
+        np.add(work, image, out=work)
+        if np.issubdtype(dtype, np.integer):
+            np.rint(work, out=work)
+            if self.clip:
+                info = np.iinfo(dtype)
+                np.clip(work, info.min, info.max, out=work)
+        elif self.clip and np.issubdtype(dtype, np.floating):
+            info = np.finfo(dtype)
+            np.clip(work, info.min, info.max, out=work)
+
+        if out is None:
+            return work.astype(dtype)
+        np.copyto(out, work, casting='unsafe')
+        return out
+
+def apply_water_background(image_array, background_array, out=None, dtype=None, scale=1.0):
+    """Apply the water background to the image.
+
+    The result keeps the image dtype (or `dtype`), saturating instead of wrapping, and is
+    written into `out` when given. Use `WaterBackground` directly to reuse its scratch
+    buffer across many images or to add Poisson noise."""
+    return WaterBackground(background_array, dtype=dtype).apply(image_array, out=out, scale=scale)
+
+def _image_scales(rng, n, scale_range):
+    """Per-image background scale factors, uniform in `scale_range`, or 1."""
+    if scale_range is None:
+        return np.ones(n)
+    return rng.uniform(scale_range[0], scale_range[1], size=n)
+
+def process_directory(directory_path, background_path, dtype=None, scale_range=None, poisson=False, seed=None):
+    """Process all HDF5 images in a directory by applying a water background.
+
+    Output keeps the input dtype unless `dtype` is given. `scale_range` draws a background
+    scale factor per image and `poisson` adds shot noise, both from a generator seeded
+    with `seed` so a training set can be regenerated exactly (pass [seed, worker_id]
+    when several processes share one seed).
+    """
     background = load_hdf5_image(background_path)
+    rng = np.random.default_rng(seed)
+    engine = WaterBackground(background, dtype=dtype, poisson=poisson, rng=rng)
+    out = None
     
-    for filename in os.listdir(directory_path):
-        if filename.endswith('.h5') and filename != 'water_background.h5':
-            full_path = os.path.join(directory_path, filename)
+    with profiler.stage('list'):
+        filenames = [entry.name for entry in walk_h5(directory_path, recursive=False)]
+    skip = {'water_background.h5'} | stack_outputs(directory_path)
+    for filename in filenames:
+        full_path = os.path.join(directory_path, filename)
+        if filename not in skip:
             
             print(f"Processing {filename}...")
-            image = load_hdf5_image(full_path)
-            processed_image = apply_water_background(image, background)
-            
-            # Save the processed image
             save_path = os.path.join(directory_path, f"processed_{filename}")
-            with h5py.File(save_path, 'w') as f:
-                f.create_dataset('entry/data/data', data=processed_image)
+            with profiler.stage('open'):
+                f_in, f_out = h5py.File(full_path, 'r'), h5py.File(save_path, 'w')
+            profiler.count('files_opened')
+            with f_in, f_out:
+                images = f_in['entry/data/data']
+                out_dtype = np.dtype(dtype) if dtype is not None else images.dtype
+                processed = f_out.create_dataset('entry/data/data', shape=images.shape, dtype=out_dtype)
+                n_frames = 1 if images.ndim == 2 else images.shape[0]
+                scales = _image_scales(rng, n_frames, scale_range)
+                # Apply and save frame by frame so multi-event files never sit in memory whole
+                for i, image in enumerate(iter_frames(images)):
+                    if out is None or out.shape != image.shape or out.dtype != out_dtype:
+                        out = np.empty(image.shape, dtype=out_dtype)
+                    with profiler.stage('apply'):
+                        processed_image = engine.apply(image, out=out, scale=scales[i])
+                    with profiler.stage('write'):
+                        if images.ndim == 2:
+                            processed[...] = processed_image
+                        else:
+                            processed[i] = processed_image
+                    profiler.count('bytes_written', processed_image.nbytes)
             
             print(f"Saved processed image to {save_path}")
 
+_DONE = object()  # end-of-stream marker between pipeline stages
+STACKS_FILE = '.water_background_stacks'  # names of the stacks written into a directory, one per line
+
+def _read_batches(paths, batch_size, batches, errors):
+    """Reader stage: gather frames from consecutive files into (batch, ss, fs) arrays."""
+    try:
+        batch, sources = None, []
+        for path in paths:
+            with h5py.File(path, 'r') as f:
+                images = f['entry/data/data']
+                n_frames = 1 if images.ndim == 2 else images.shape[0]
+                for i, image in enumerate(iter_frames(images)):
+                    if batch is None:
+                        batch = np.empty((batch_size,) + image.shape, dtype=image.dtype)
+                    batch[len(sources)] = image
+                    sources.append((path, i, n_frames, images.shape))
+                    if len(sources) == batch_size:
+                        batches.put((batch, sources))
+                        batch, sources = None, []
+        if sources:
+            batches.put((batch[:len(sources)], sources))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        batches.put(_DONE)
+
+def _write_files(results, errors):
+    """Writer stage: one processed_<name>.h5 per input file, like process_directory."""
+    open_files = {}  # input path -> (h5 file, dataset, frames still to write)
+    item = None
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            processed, sources = item
+            for frame, (path, i, n_frames, shape) in zip(processed, sources):
+                if path not in open_files:
+                    save_path = os.path.join(os.path.dirname(path), f"processed_{os.path.basename(path)}")
+                    f = h5py.File(save_path, 'w')
+                    dset = f.create_dataset('entry/data/data', shape=shape, dtype=processed.dtype)
+                    open_files[path] = [f, dset, n_frames]
+                f, dset, remaining = open_files[path]
+                if dset.ndim == 2:
+                    dset[...] = frame
+                else:
+                    dset[i] = frame
+                open_files[path][2] = remaining - 1
+                if remaining == 1:
+                    save_path = f.filename
+                    f.close()
+                    del open_files[path]
+                    print(f"Saved processed image to {save_path}")
+    except Exception as e:
+        errors.append(e)
+    finally:
+        for f, _, _ in open_files.values():
+            f.close()
+        # keep draining so the compute stage never blocks on a dead writer
+        while item is not _DONE:
+            item = results.get()
+
+def _write_stack(results, errors, stack_path, compression):
+    """Writer stage: append every frame to one chunked, compressed (%, ss, fs) stack."""
+    item = None
+    try:
+        with h5py.File(stack_path, 'w') as f:
+            dset, sources, frames = None, None, None
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                processed, batch_sources = item
+                if dset is None:
+                    frame_shape = processed.shape[1:]
+                    dset = f.create_dataset('entry/data/data', shape=(0,) + frame_shape,
+                                            maxshape=(None,) + frame_shape, chunks=(1,) + frame_shape,
+                                            dtype=processed.dtype, compression=compression)
+                    sources = f.create_dataset('entry/data/source_file', shape=(0,), maxshape=(None,),
+                                               dtype=h5py.string_dtype())
+                    frames = f.create_dataset('entry/data/source_frame', shape=(0,), maxshape=(None,),
+                                              dtype=np.int64)
+                start, n = dset.shape[0], len(processed)
+                for d in (dset, sources, frames):
+                    d.resize(start + n, axis=0)
+                dset[start:start + n] = processed
+                sources[start:start + n] = [os.path.basename(path) for path, _, _, _ in batch_sources]
+                frames[start:start + n] = [i for _, i, _, _ in batch_sources]
+        _record_stack(stack_path)
+        print(f"Saved processed stack to {stack_path}")
+    except Exception as e:
+        errors.append(e)
+    finally:
+        while item is not _DONE:
+            item = results.get()
+
+def _record_stack(stack_path):
+    """Add a finished stack to the STACKS_FILE list of its directory."""
+    with open(os.path.join(os.path.dirname(stack_path), STACKS_FILE), 'a') as f:
+        f.write(os.path.basename(stack_path) + '\n')
+
+def stack_outputs(directory_path):
+    """Names of the stacks _write_stack wrote into a directory, which must not be read back as input."""
+    try:
+        with open(os.path.join(directory_path, STACKS_FILE)) as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+def process_directory_pipelined(directory_path, background_path, batch_size=16, prefetch=4,
+                                stack_path=None, compression='gzip', dtype=None, scale_range=None,
+                                poisson=False, seed=None):
+    """Process all HDF5 images in a directory with reading, applying and writing overlapped.
+
+    A reader thread prefetches batches of frames, the main thread applies the one loaded
+    background to a whole batch at once, and a writer thread saves the results, either as
+    processed_<name>.h5 files or, with `stack_path`, as a single chunked and compressed
+    multi-event stack (source file and frame recorded alongside). The queues hold at most
+    `prefetch` batches, which bounds memory. `dtype`, `scale_range`, `poisson` and `seed`
+    behave as in `process_directory`; the background is applied in place in each batch.
+    """
+    background = load_hdf5_image(background_path)
+    rng = np.random.default_rng(seed)
+    engine = WaterBackground(background, dtype=dtype, poisson=poisson, rng=rng)
+    skip = {'water_background.h5', os.path.basename(stack_path) if stack_path else None} | stack_outputs(directory_path)
+    paths = sorted(entry.path for entry in walk_h5(directory_path, recursive=False)
+                   if entry.name not in skip and not entry.name.startswith('processed_'))
+
+    batches, results = queue.Queue(maxsize=prefetch), queue.Queue(maxsize=prefetch)
+    errors = []
+    reader = threading.Thread(target=_read_batches, args=(paths, batch_size, batches, errors), daemon=True)
+    if stack_path:
+        writer = threading.Thread(target=_write_stack, args=(results, errors, stack_path, compression), daemon=True)
+    else:
+        writer = threading.Thread(target=_write_files, args=(results, errors), daemon=True)
+    reader.start()
+    writer.start()
+
+    try:
+        while True:
+            with profiler.stage('wait_for_reader'):
+                item = batches.get()
+            if item is _DONE:
+                break
+            frames, sources = item
+            print(f"Processing {len(frames)} frames from {os.path.basename(sources[0][0])}...")
+            scales = _image_scales(rng, len(frames), scale_range)
+            with profiler.stage('apply'):
+                if dtype is None or np.dtype(dtype) == frames.dtype:
+                    processed = engine.apply(frames, out=frames, scale=scales)
+                else:
+                    processed = engine.apply(frames, scale=scales)
+            # time the compute stage is blocked on a full writer queue
+            with profiler.stage('wait_for_writer'):
+                results.put((processed, sources))
+    finally:
+        results.put(_DONE)
+        # unblock the reader if we stopped early
+        while reader.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        writer.join()
+    if errors:
+        raise errors[0]
+
 def main():
+    parser = argparse.ArgumentParser(description="Apply the water background to all HDF5 images in the water_images directory.")
+    parser.add_argument('--pipeline', action='store_true', help="Overlap reading, applying and writing in batches")
+    parser.add_argument('--batch-size', type=int, default=16, help="Frames per batch in pipeline mode (default: 16)")
+    parser.add_argument('--stack', default=None, help="Pipeline mode: write one compressed stack file with this name instead of processed_*.h5 files")
+    parser.add_argument('--compression', default='gzip', help="HDF5 compression filter for --stack (default: gzip)")
+    parser.add_argument('--dtype', default=None, help="Output dtype, e.g. uint16 or float32 (default: same as the images)")
+    parser.add_argument('--scale-range', type=float, nargs=2, default=None, metavar=('MIN', 'MAX'),
+                        help="Draw a background scale factor per image uniformly from [MIN, MAX]")
+    parser.add_argument('--poisson', action='store_true', help="Add Poisson noise to the background")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for scale factors and noise")
+    profiler.add_profile_args(parser)
+    args = parser.parse_args()
+    options = dict(dtype=args.dtype, scale_range=args.scale_range, poisson=args.poisson, seed=args.seed)
+
     base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     processed_images_path = os.path.join(base_path, 'sim', 'water_images')
     print(processed_images_path)
@@ -61,7 +354,13 @@ def main():
     confirmation = input(f"Process all HDF5 files in {temp_path} \n\n ... and apply the water background from {water_background_path} \n\n ... while outputting processes images in {processed_images_path}? \n\n (yes/no): ")
     
     if confirmation.lower() == 'yes':
-        process_directory(processed_images_path, water_background_path)
+        with profiler.profiled(args.profile, args.cprofile):
+            if args.pipeline:
+                stack_path = os.path.join(processed_images_path, args.stack) if args.stack else None
+                process_directory_pipelined(processed_images_path, water_background_path, batch_size=args.batch_size,
+                                            stack_path=stack_path, compression=args.compression, **options)
+            else:
+                process_directory(processed_images_path, water_background_path, **options)
     else:
         print("Operation canceled.")
 
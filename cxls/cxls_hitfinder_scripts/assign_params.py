@@ -1,12 +1,24 @@
 import os
+import sys
 import h5py as h5
-from typing import Any, Dict
+import numpy as np
+from collections import Counter
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Tuple
+from h5_walker import walk_h5
+
+# shared instrumentation and the CPU count helper live with the parse scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'parse-scripts'))
+import profiler
+from file_scheduler import available_cpus
 
 def assign_attributes(file_path: str, **kwargs: Any):
     """Assigns arbitrary attributes to an HDF5 file without individual confirmation."""
-    with h5.File(file_path, 'a') as f:
-        for key, value in kwargs.items():
-            f.attrs[key] = value
+    with profiler.stage('write_attrs'):
+        with h5.File(file_path, 'a') as f:
+            for key, value in kwargs.items():
+                f.attrs[key] = value
+    profiler.count('files_opened')
     print(f"Attributes {list(kwargs.keys())} assigned to {file_path}.")
 
 def get_params() -> Dict[str, Dict[str, Any]]:
@@ -26,6 +38,16 @@ def get_params() -> Dict[str, Dict[str, Any]]:
     }
     return dataset_params
 
+def list_dataset_files(directory: str) -> Dict[str, List[str]]:
+    """File names per dataset directory (01, 02, ...) directly under `directory`, from one parallel scan."""
+    files = {}
+    with profiler.stage('list'):
+        entries = list(walk_h5(directory, max_depth=1))
+    for entry in entries:
+        if os.path.dirname(os.path.normpath(entry.directory)) == os.path.normpath(directory):
+            files.setdefault(os.path.basename(entry.directory), []).append(entry.name)
+    return files
+
 def process_directory(directory: str):
     """Goes through the specified directory, confirms attribute assignment once per dataset directory."""
     dataset_params = get_params()
@@ -37,10 +59,11 @@ def process_directory(directory: str):
         print("Attribute assignment canceled.")
         return
 
+    dataset_files = list_dataset_files(directory)
     for dataset, params in dataset_params.items():
         dataset_dir = os.path.join(directory, dataset)
         if os.path.exists(dataset_dir):
-            files = [f for f in os.listdir(dataset_dir) if f.endswith('.h5')]
+            files = dataset_files.get(dataset, [])
             
             # Ensure there are files to process
             if not files:
@@ -59,11 +82,100 @@ def process_directory(directory: str):
             print(f"Dataset directory {dataset} not found in {directory}.")
  
 
+def _needs_update(f: h5.File, attributes: Dict[str, Any]) -> bool:
+    """True if any attribute is missing or differs from the wanted value."""
+    for key, value in attributes.items():
+        if key not in f.attrs or not np.array_equal(f.attrs[key], value):
+            return True
+    return False
+
+def check_and_assign(task: Tuple[str, Dict[str, Any], bool]) -> Tuple[str, str]:
+    """Reads a file's attributes and rewrites them only if they differ.
+
+    Returns the file path and one of 'unchanged', 'updated', 'would update' (dry run)
+    or an error message starting with 'failed'."""
+    file_path, attributes, dry_run = task
+    try:
+        with h5.File(file_path, 'r') as f:
+            if not _needs_update(f, attributes):
+                return file_path, 'unchanged'
+        if dry_run:
+            return file_path, 'would update'
+        with h5.File(file_path, 'a') as f:
+            for key, value in attributes.items():
+                f.attrs[key] = value
+        return file_path, 'updated'
+    except Exception as e:
+        return file_path, f'failed: {str(e)}'
+
+def _check_and_assign_profiled(task: Tuple[str, Dict[str, Any], bool, bool]) -> Tuple[Tuple[str, str], Optional[dict]]:
+    """Worker entry point: `check_and_assign` plus this task's timings when profiling."""
+    *task, profile = task
+    profiler.PROFILER.enabled = profile
+    with profiler.stage('check_and_assign'):
+        result = check_and_assign(tuple(task))
+    profiler.count('files_processed')
+    return result, profiler.PROFILER.snapshot(reset=True)
+
+def bulk_process_directory(directory: str, workers: Optional[int] = None, dry_run: bool = False,
+                           assume_yes: bool = False) -> Dict[str, Counter]:
+    """Assigns attributes to every file of every dataset directory with a worker pool.
+
+    Files whose attributes are already correct are only read, never reopened for writing,
+    and progress is summarised per dataset instead of printed per file. With `dry_run`
+    nothing is written and the summary shows what would change."""
+    dataset_params = get_params()
+    if not dry_run and not assume_yes:
+        user_confirmation = input(f"Proceed with assigning attributes for all files in '{directory}'? (y/n): ")
+        if user_confirmation.lower() != 'y':
+            print("Attribute assignment canceled.")
+            return {}
+
+    tasks, task_datasets = [], []
+    dataset_files = list_dataset_files(directory)
+    for dataset, params in dataset_params.items():
+        dataset_dir = os.path.join(directory, dataset)
+        if not os.path.exists(dataset_dir):
+            print(f"Dataset directory {dataset} not found in {directory}.")
+            continue
+        for file in sorted(dataset_files.get(dataset, [])):
+            attributes = dict(params, peak=not file.startswith("empty"))
+            tasks.append((os.path.join(dataset_dir, file), attributes, dry_run, profiler.PROFILER.enabled))
+            task_datasets.append(dataset)
+
+    summary = {dataset: Counter() for dataset in dict.fromkeys(task_datasets)}
+    if tasks:
+        workers = workers or available_cpus()
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with Pool(processes=workers, initializer=profiler.reset_worker) as pool:
+            for dataset, ((file_path, status), worker_profile) in zip(
+                    task_datasets, pool.imap(_check_and_assign_profiled, tasks, chunksize=chunksize)):
+                profiler.PROFILER.merge(worker_profile)
+                if status.startswith('failed'):
+                    print(f"{file_path}: {status}")
+                    status = 'failed'
+                summary[dataset][status] += 1
+
+    for dataset, counts in summary.items():
+        print(f"Dataset {dataset}: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    if dry_run:
+        print("Dry run, no files were modified.")
+    return summary
+
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="Assigns attributes to HDF5 files within specific dataset directories, with directory-level confirmation.")
     parser.add_argument("directory", help="Path to the specific parent directory to process, e.g., images/water")
+    parser.add_argument("--bulk", action="store_true", help="Use a worker pool and only rewrite files whose attributes differ")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --bulk (default: available CPUs)")
+    parser.add_argument("--dry-run", action="store_true", help="With --bulk, only report how many files would change")
+    parser.add_argument("--yes", action="store_true", help="With --bulk, skip the confirmation prompt")
+    profiler.add_profile_args(parser)
     args = parser.parse_args()
 
-    process_directory(args.directory)
\ No newline at end of file
+    with profiler.profiled(args.profile, args.cprofile):
+        if args.bulk:
+            bulk_process_directory(args.directory, workers=args.workers, dry_run=args.dry_run, assume_yes=args.yes)
+        else:
+            process_directory(args.directory)
\ No newline at end of file
@@ -0,0 +1,105 @@
+import os
+import argparse
+import h5py as h5
+import numpy as np
+from itertools import groupby
+from typing import Dict, List, Optional
+from catalog import Catalog
+
+VIEWS_DIR = 'views'
+
+def build_view(view_path: str, rows: List[Dict], data_path: str = 'entry/data/data',
+               absolute: bool = False) -> int:
+    """
+    Write one HDF5 file whose `data_path` is a virtual dataset stacking the frames of `rows`.
+
+    Nothing is copied: every frame is a mapping to `data_path` in its source file, so
+    slicing [i:j] on the view reads straight from the original files through one handle.
+    Source paths are stored relative to the view unless `absolute`, so the tree can be
+    moved as a whole. The clen and photon energy of the set are stored as attributes,
+    and per frame the source file, frame index in that file and peak flag.
+
+    Args:
+        view_path (str): Output .h5 file.
+        rows (list): Catalog rows of one parameter set and role, in frame order.
+        data_path (str): Dataset in the source files, also used in the view.
+        absolute (bool): Store absolute source paths.
+
+    Returns:
+        int: Number of frames in the view.
+    """
+    frame_shape, dtype = rows[0]['shape'][-2:], np.dtype(rows[0]['dtype'])
+    for row in rows:
+        if row['shape'][-2:] != frame_shape or np.dtype(row['dtype']) != dtype:
+            raise ValueError(f"{row['path']} has shape {row['shape']} and dtype {row['dtype']}, "
+                             f"expected frames of {frame_shape} {dtype}")
+    n_frames = [1 if len(row['shape']) == 2 else row['shape'][0] for row in rows]
+
+    layout = h5.VirtualLayout(shape=(sum(n_frames),) + tuple(frame_shape), dtype=dtype)
+    view_dir = os.path.dirname(os.path.abspath(view_path))
+    sources, frames = [], []
+    start = 0
+    for row, n in zip(rows, n_frames):
+        source_path = row['path'] if absolute else os.path.relpath(row['path'], view_dir)
+        source = h5.VirtualSource(source_path, data_path, shape=tuple(row['shape']))
+        if len(row['shape']) == 2:
+            layout[start] = source
+        else:
+            layout[start:start + n] = source
+        sources += [source_path] * n
+        frames += range(n)
+        start += n
+
+    tmp_path = f"{view_path}.part"
+    with h5.File(tmp_path, 'w') as f:
+        f.create_virtual_dataset(data_path, layout, fillvalue=0)
+        group = f[os.path.dirname(data_path)]
+        group.create_dataset('source_file', data=np.array(sources, dtype=h5.string_dtype()))
+        group.create_dataset('source_frame', data=np.array(frames, dtype=np.int64))
+        group.create_dataset('peak', data=np.repeat([row['peak'] for row in rows], n_frames))
+        for key in ('clen', 'photon_energy'):
+            if rows[0][key] is not None:
+                f.attrs[key] = rows[0][key]
+        f.attrs['role'] = rows[0]['role']
+        f.attrs['dataset'] = rows[0]['dataset']
+    os.replace(tmp_path, view_path)
+    return start
+
+def build_views(root: str, out_dir: Optional[str] = None, role: Optional[str] = None,
+                dataset: Optional[str] = None, absolute: bool = False, workers: Optional[int] = None) -> List[str]:
+    """
+    Build a view per (role, dataset) of a 01-09 tree, named <role>_<dataset>.h5.
+
+    Shapes, dtypes and parameters come from the metadata catalog (updated first), so
+    only new or changed images are opened.
+    """
+    out_dir = out_dir or os.path.join(root, VIEWS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    with Catalog(root) as catalog:
+        catalog.update(workers=workers)
+        rows = [row for row in catalog.query(role=role, dataset=dataset) if row['shape']]
+
+    written = []
+    rows.sort(key=lambda row: (row['role'], row['dataset'], row['path']))
+    for (role_name, dataset_id), group in groupby(rows, key=lambda row: (row['role'], row['dataset'])):
+        view_path = os.path.join(out_dir, f"{role_name}_{dataset_id}.h5")
+        try:
+            n_frames = build_view(view_path, list(group), absolute=absolute)
+        except ValueError as e:
+            print(f"Skipping {role_name}/{dataset_id}: {str(e)}")
+            continue
+        print(f"Wrote {view_path} ({n_frames} frames)")
+        written.append(view_path)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build HDF5 virtual datasets stacking each parameter set of a 01-09 tree.")
+    parser.add_argument("root", help="Tree root, e.g. images/ (directories <role>/<01-09>/*.h5)")
+    parser.add_argument("--out", default=None, help=f"Directory for the views (default: <root>/{VIEWS_DIR})")
+    parser.add_argument("--role", default=None, help="Only this role (image, label, peak, overlay or water)")
+    parser.add_argument("--dataset", default=None, help="Only this dataset ID, e.g. 05")
+    parser.add_argument("--absolute", action="store_true", help="Store absolute source paths instead of relative ones")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for the catalog update")
+    args = parser.parse_args()
+
+    build_views(args.root, args.out, args.role, args.dataset, args.absolute, args.workers)
@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import h5py as h5
+import numpy as np
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Tuple
+from assign_params import get_params
+from file_scheduler import available_cpus  # on sys.path via assign_params
+from h5_walker import DATASET_DIR, H5Entry, walk_h5
+
+CATALOG_NAME = '.catalog.sqlite'
+CATALOG_VERSION = 1  # bump when the stored columns change meaning, so old rows are read again
+
+COLUMNS = ('path', 'role', 'dataset', 'clen', 'photon_energy', 'peak', 'shape', 'dtype', 'size', 'mtime_ns')
+
+def _scan(root: str) -> Dict[str, H5Entry]:
+    """Relative path -> walker entry (with size and mtime_ns) for every .h5 file directly inside a parameter directory under root."""
+    return {os.path.relpath(entry.path, root): entry
+            for entry in walk_h5(root, stat=True) if DATASET_DIR.match(os.path.basename(entry.directory))}
+
+def read_metadata(task: Tuple[str, str, str, str]) -> Tuple[str, Dict[str, Any], Optional[str]]:
+    """Reads one file's attributes, shape and dtype.
+
+    Attributes written by assign_params.py take precedence; files that were never tagged
+    fall back to the parameters of their dataset directory and the 'empty' file prefix.
+    Returns the error message as well when the file could not be read."""
+    root, rel_path, dataset, role = task
+    row = {
+        'role': role,
+        'dataset': dataset,
+        'peak': not os.path.basename(rel_path).startswith('empty'),
+        **get_params().get(dataset, {}),
+    }
+    try:
+        with h5.File(os.path.join(root, rel_path), 'r') as f:
+            for key in ('clen', 'photon_energy', 'peak'):
+                if key in f.attrs:
+                    # h5py hands back str/bytes attributes as Python objects, not numpy scalars
+                    value = np.asarray(f.attrs[key]).item()
+                    row[key] = value.decode() if isinstance(value, bytes) else value
+            if 'entry/data/data' in f:
+                dset = f['entry/data/data']
+                row['shape'] = json.dumps(list(dset.shape))
+                row['dtype'] = str(dset.dtype)
+    except Exception as e:
+        return rel_path, row, str(e)
+    return rel_path, row, None
+
+class Catalog:
+    """One row per image of a 01-09 parameter tree, kept in <root>/.catalog.sqlite.
+
+    `update` only opens files that are new or whose size/mtime changed since the last
+    run and drops rows for files that are gone, so queries never touch the HDF5 files.
+    """
+
+    def __init__(self, root: str, db_path: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.conn = sqlite3.connect(db_path or os.path.join(self.root, CATALOG_NAME))
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY, role TEXT, dataset TEXT, clen REAL, photon_energy REAL,
+                peak INTEGER, shape TEXT, dtype TEXT, size INTEGER, mtime_ns INTEGER);
+            CREATE INDEX IF NOT EXISTS images_params ON images (clen, photon_energy, peak);
+            CREATE INDEX IF NOT EXISTS images_dataset ON images (role, dataset);
+        ''')
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] < CATALOG_VERSION:
+            # older catalogs stored the directory name as the role
+            with self.conn:
+                self.conn.execute('DELETE FROM images')
+                self.conn.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, workers: Optional[int] = None) -> Dict[str, int]:
+        """Brings the catalog in line with the tree, returns counts of added/updated/removed rows."""
+        on_disk = _scan(self.root)
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                 self.conn.execute('SELECT path, size, mtime_ns FROM images')}
+        changed = [path for path, entry in on_disk.items() if known.get(path) != (entry.size, entry.mtime_ns)]
+        removed = [path for path in known if path not in on_disk]
+
+        rows, failed = [], 0
+        if changed:
+            workers = min(workers or available_cpus(), len(changed))
+            with Pool(processes=workers) as pool:
+                tasks = [(self.root, p, on_disk[p].dataset, on_disk[p].role) for p in changed]
+                for rel_path, row, error in pool.imap_unordered(read_metadata, tasks,
+                                                                chunksize=max(1, len(changed) // (workers * 4))):
+                    if error:
+                        # left out (and any stale row dropped), so the next update tries it again
+                        print(f"Could not read {rel_path}: {error}")
+                        removed.append(rel_path)
+                        failed += 1
+                        continue
+                    entry = on_disk[rel_path]
+                    rows.append((rel_path, row.get('role'), row.get('dataset'), row.get('clen'),
+                                 row.get('photon_energy'), int(bool(row.get('peak'))), row.get('shape'),
+                                 row.get('dtype'), entry.size, entry.mtime_ns))
+        with self.conn:
+            self.conn.executemany('DELETE FROM images WHERE path = ?', [(p,) for p in removed])
+            self.conn.executemany(f'INSERT OR REPLACE INTO images ({", ".join(COLUMNS)}) '
+                                  f'VALUES ({", ".join("?" * len(COLUMNS))})', rows)
+        stored = {row[0] for row in rows}
+        return {'added': sum(p not in known for p in stored), 'updated': sum(p in known for p in stored),
+                'removed': sum(p not in on_disk for p in removed), 'failed': failed,
+                'total': len(on_disk) - failed}
+
+    def query(self, clen: Optional[float] = None, photon_energy: Optional[float] = None,
+              peak: Optional[bool] = None, dataset: Optional[str] = None, role: Optional[str] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Rows matching all given filters, ordered by path. Paths are absolute."""
+        where, params = self._where(clen, photon_energy, peak, dataset, role)
+        sql = f'SELECT {", ".join(COLUMNS)} FROM images{where} ORDER BY path'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        results = []
+        for values in self.conn.execute(sql, params):
+            row = dict(zip(COLUMNS, values))
+            row['path'] = os.path.join(self.root, row['path'])
+            row['peak'] = bool(row['peak'])
+            row['shape'] = tuple(json.loads(row['shape'])) if row['shape'] else None
+            results.append(row)
+        return results
+
+    def count(self, **filters: Any) -> int:
+        where, params = self._where(**filters)
+        return self.conn.execute(f'SELECT COUNT(*) FROM images{where}', params).fetchone()[0]
+
+    @staticmethod
+    def _where(clen=None, photon_energy=None, peak=None, dataset=None, role=None):
+        clauses, params = [], []
+        # floats are compared with a tolerance, 0.25 may have been written as 0.25000000001
+        for column, value in (('clen', clen), ('photon_energy', photon_energy)):
+            if value is not None:
+                clauses.append(f'ABS({column} - ?) < 1e-6')
+                params.append(value)
+        for column, value in (('peak', None if peak is None else int(peak)), ('dataset', dataset), ('role', role)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+def _bool(value: str) -> bool:
+    if value.lower() in ('1', 'true', 'yes', 'y'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'n'):
+        return False
+    raise argparse.ArgumentTypeError(f"expected true/false, got '{value}'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query a metadata catalog of a 01-09 parameter tree.")
+    parser.add_argument("root", help="Tree root, e.g. images/ (directories .../<role>/<01-09>/*.h5)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for reading new files (default: available CPUs)")
+    parser.add_argument("--no-update", action="store_true", help="Query the catalog as is, without rescanning the tree")
+    parser.add_argument("--clen", type=float, default=None, help="Camera length in m, e.g. 0.25")
+    parser.add_argument("--photon-energy", type=float, default=None, help="Photon energy in eV, e.g. 7000")
+    parser.add_argument("--peak", type=_bool, default=None, help="true or false")
+    parser.add_argument("--dataset", default=None, help="Dataset ID, e.g. 05")
+    parser.add_argument("--role", default=None, help="Role as in h5_walker: image, label, peak, overlay or water")
+    parser.add_argument("--limit", type=int, default=None, help="Print at most this many paths")
+    parser.add_argument("--count", action="store_true", help="Only print the number of matching images")
+    args = parser.parse_args()
+
+    with Catalog(args.root) as catalog:
+        if not args.no_update:
+            counts = catalog.update(workers=args.workers)
+            print(f"Catalog: {counts['total']} images ({counts['added']} added, {counts['updated']} updated, "
+                  f"{counts['removed']} removed, {counts['failed']} unreadable)", file=sys.stderr)
+        filters = dict(clen=args.clen, photon_energy=args.photon_energy, peak=args.peak,
+                       dataset=args.dataset, role=args.role)
+        if args.count:
+            print(catalog.count(**filters))
+        else:
+            for row in catalog.query(limit=args.limit, **filters):
+                print(row['path'])
@@ -0,0 +1,109 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+# keV and clen code as they appear in file names, e.g. img_7keV_clen02_00001.h5
+KEV_CLEN_PATTERNS = (
+    r'master_[0-9]+_([0-9]+)keV_clen([0-9]+)_',
+    r'img_([0-9]+)keV_clen([0-9]+)_',
+    r'processed_img_([0-9]+)keV_clen([0-9]+)_',
+)
+# dataset directories: '05' in images/<role>/05, or '05_0.25m_7keV' in MASTER/
+DATASET_DIR = re.compile(r'^(\d{2})(?:_(0\.\d{2})m_(\d+)keV)?$')
+CLEN_CODES = {"0.15": "01", "0.25": "02", "0.35": "03"}
+ROLE_DIRS = {
+    'labels': 'label',
+    'peaks': 'peak',
+    'peaks_water_overlay': 'overlay',
+    'peak_water_overlay': 'overlay',
+    'water': 'water',
+}
+ROLE_PREFIXES = (('label', 'label'), ('overlay_', 'overlay'), ('processed_', 'overlay'), ('water', 'water'))
+
+class H5Entry(NamedTuple):
+    path: str
+    name: str
+    directory: str
+    dataset: Optional[str]
+    kev: Optional[str]
+    clen: Optional[str]
+    role: str  # 'image', 'label', 'peak', 'overlay' or 'water'
+    size: Optional[int] = None
+    mtime_ns: Optional[int] = None
+
+def kev_clen_from_name(filename: str) -> Tuple[Optional[str], Optional[str]]:
+    """keV and clen code from a file name, or (None, None)."""
+    for pattern in KEV_CLEN_PATTERNS:
+        match = re.search(pattern, filename)
+        if match:
+            return match.groups()
+    return None, None
+
+def describe_directory(directory: str) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
+    """Dataset ID, role, keV and clen code implied by a directory's path, innermost first."""
+    dataset = role = kev = clen = None
+    for part in reversed(os.path.normpath(directory).split(os.sep)):
+        match = DATASET_DIR.match(part)
+        if match and dataset is None:
+            dataset, clen_meter, kev = match.groups()
+            clen = CLEN_CODES.get(clen_meter)
+        elif part in ROLE_DIRS and role is None:
+            role = ROLE_DIRS[part]
+    return dataset, role, kev, clen
+
+def _scan_directory(directory: str, suffix: str, stat: bool) -> Tuple[List[H5Entry], List[str]]:
+    """One os.scandir pass: the matching files of `directory` and its subdirectories."""
+    dataset, dir_role, dir_kev, dir_clen = describe_directory(directory)
+    entries, subdirs = [], []
+    with os.scandir(directory) as it:
+        for entry in it:
+            # is_dir/is_file use the type returned by readdir, no extra stat on most filesystems
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.endswith(suffix) and entry.is_file():
+                kev, clen = kev_clen_from_name(entry.name)
+                role = dir_role or next((r for prefix, r in ROLE_PREFIXES if entry.name.startswith(prefix)), 'image')
+                st = entry.stat() if stat else None
+                entries.append(H5Entry(entry.path, entry.name, directory, dataset, kev or dir_kev, clen or dir_clen,
+                                       role, st.st_size if st else None, st.st_mtime_ns if st else None))
+    return entries, subdirs
+
+def walk_h5(root: str, recursive: bool = True, workers: int = 8, stat: bool = False,
+            suffix: str = '.h5', max_depth: Optional[int] = None) -> Iterator[H5Entry]:
+    """
+    Yield an H5Entry for every `suffix` file under `root`, scanning directories in parallel.
+
+    Each directory is read once with os.scandir on a thread pool, so on network
+    filesystems the listing round trips overlap. Entries come in the order directories
+    finish (sorted within a directory); use `scan_h5` for a stable order.
+
+    Args:
+        root (str): Directory to scan.
+        recursive (bool): Also scan subdirectories.
+        workers (int): Directories listed concurrently.
+        stat (bool): Fill in size and mtime_ns (one stat per file).
+        suffix (str): File name suffix to match.
+        max_depth (int, optional): Levels of subdirectories to scan when recursive, e.g. 1
+            for `root` and its immediate subdirectories only. Unlimited by default.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        depths = {executor.submit(_scan_directory, root, suffix, stat): 0}
+        pending = set(depths)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                entries, subdirs = future.result()
+                depth = depths.pop(future)
+                if recursive and (max_depth is None or depth < max_depth):
+                    for subdir in subdirs:
+                        child = executor.submit(_scan_directory, subdir, suffix, stat)
+                        depths[child] = depth + 1
+                        pending.add(child)
+                yield from sorted(entries, key=lambda entry: entry.name)
+
+def scan_h5(root: str, recursive: bool = True, workers: int = 8, stat: bool = False,
+            suffix: str = '.h5') -> List[H5Entry]:
+    """All entries of `walk_h5`, in sorted top-down order (a directory's files before its subdirectories')."""
+    return sorted(walk_h5(root, recursive, workers, stat, suffix),
+                  key=lambda entry: (os.path.normpath(entry.directory).split(os.sep), entry.name))
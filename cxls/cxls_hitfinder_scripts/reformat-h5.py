@@ -1,21 +1,20 @@
 import os
-import re
-import shutil
 import sys
+import json
+import argparse
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from h5_walker import kev_clen_from_name, scan_h5
+
+# shared instrumentation lives with the parse scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'parse-scripts'))
+import profiler
 
 def extract_kev_clen(filename):
-    patterns = [
-        r'master_[0-9]+_([0-9]+)keV_clen([0-9]+)_',
-        r'img_([0-9]+)keV_clen([0-9]+)_',
-        r'processed_img_([0-9]+)keV_clen([0-9]+)_'
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, filename)
-        if match:
-            kev, clen = match.groups()
-            return kev, clen
-    print(f"Error: Filename '{filename}' does not contain keV and clen values.", file=sys.stderr)
-    return None, None
+    kev, clen = kev_clen_from_name(filename)
+    if kev is None:
+        print(f"Error: Filename '{filename}' does not contain keV and clen values.", file=sys.stderr)
+    return kev, clen
 
 def get_prefix(subdir, file):
     if subdir.endswith('/labels'):
@@ -26,15 +25,18 @@ def get_prefix(subdir, file):
         return ""
     return "img_"  # Default prefix for other directories
 
-def process_directory(subdir, files, img_count):
+JOURNAL_NAME = '.reformat-journal.json'
+STAGED_SUFFIX = '.reformat-tmp'
+
+def process_directory(subdir, files, img_count, plan):
+    """Append the renames for one directory to `plan`, returns the next image number."""
     for file in files:
         # Pass 'empty' files as is
         if file.startswith("empty"):
             continue
-        
-        filepath = os.path.join(subdir, file)
+
         prefix = get_prefix(subdir, file)
-        
+
         if prefix != "":  # If specific prefix is assigned, it means we need to process the file
             kev, clen = extract_kev_clen(file)
             if kev is None or clen is None:
@@ -42,35 +44,165 @@ def process_directory(subdir, files, img_count):
                 continue
 
             new_filename_format = f"{prefix}{kev}keV_clen{clen}_{img_count:05d}.h5"
-            new_filepath = os.path.join(subdir, new_filename_format)
-            shutil.move(filepath, new_filepath)
-            print(f"Renamed '{file}' to '{new_filename_format}'")
+            if new_filename_format != file:
+                plan.append((os.path.join(subdir, file), os.path.join(subdir, new_filename_format)))
             img_count += 1
     return img_count
 
-def reformat_filenames(directory):
+def plan_renames(directory):
+    """
+    Phase one: compute every rename without touching the tree.
+
+    Directories and files are visited in sorted order, so the same tree always gets the
+    same numbering. Raises ValueError if two files would get the same name, or a new name
+    is already taken by a file that is not itself being renamed.
+
+    Returns:
+        list: (old path, new path) pairs.
+    """
+    plan = []
     img_count = 1
     water_directory = os.path.join(directory, 'water')
 
-    for subdir, dirs, files in os.walk(directory):
+    with profiler.stage('list'):
+        entries = scan_h5(directory)
+    for subdir, dir_entries in groupby(entries, key=lambda entry: entry.directory):
         if subdir == water_directory:
             print(f"Skipping water directory: {subdir}", file=sys.stderr)
             continue
 
-        filtered_files = [file for file in files if file.endswith('.h5')]
-        img_count = process_directory(subdir, filtered_files, img_count)
+        img_count = process_directory(subdir, [entry.name for entry in dir_entries], img_count, plan)
+
+    sources = {src for src, dst in plan}
+    seen = set()
+    for src, dst in plan:
+        if dst in seen:
+            raise ValueError(f"Two files would be renamed to '{dst}'")
+        if dst not in sources and os.path.exists(dst):
+            raise ValueError(f"'{src}' would overwrite existing file '{dst}'")
+        seen.add(dst)
+    return plan
+
+def _staged_path(dst):
+    return os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}{STAGED_SUFFIX}")
+
+def _write_journal(journal_path, state, plan):
+    tmp_path = f"{journal_path}.part"
+    with open(tmp_path, 'w') as journal:
+        json.dump({'state': state, 'renames': plan}, journal)
+    os.replace(tmp_path, journal_path)
+
+def _read_journal(journal_path):
+    with open(journal_path) as journal:
+        data = json.load(journal)
+    return data['state'], [tuple(entry) for entry in data['renames']]
+
+def _rename_all(moves, workers):
+    """Run (src, dst) renames concurrently, skipping those already done. Returns the failures."""
+    def move(pair):
+        src, dst = pair
+        if os.path.exists(src):
+            os.rename(src, dst)
+        elif not os.path.exists(dst):
+            raise FileNotFoundError(f"Neither '{src}' nor '{dst}' exists")
 
-def main(directory):
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(move, pair): pair for pair in moves}
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                failures.append((futures[future], future.exception()))
+    return failures
+
+def _run_phase(journal_path, state, next_state, plan, moves, workers):
+    with profiler.stage(f'rename_{state}'):
+        failures = _rename_all(moves, workers)
+    profiler.count('renames', len(moves))
+    if failures:
+        for (src, dst), error in failures[:10]:
+            print(f"Error: could not rename '{src}' to '{dst}': {error}", file=sys.stderr)
+        raise RuntimeError(f"{len(failures)} renames failed in the '{state}' phase, "
+                           f"fix the cause and run again to resume")
+    _write_journal(journal_path, next_state, plan)
+    return next_state
+
+def execute_plan(directory, plan, workers=16, state='staging'):
+    """
+    Phase two: apply a rename plan, journaled so an interrupted run can be resumed.
+
+    Every file is first moved to a hidden staging name next to its target, then all staged
+    files are moved to their final names, so plans where one file takes another's old name
+    are safe. The journal in `directory` records the plan and the phase; each rename is
+    skipped if it already happened, so running again after a crash picks up where it stopped.
+    """
+    journal_path = os.path.join(directory, JOURNAL_NAME)
+    if state == 'staging':
+        _write_journal(journal_path, state, plan)
+        state = _run_phase(journal_path, state, 'committing', plan,
+                           [(src, _staged_path(dst)) for src, dst in plan], workers)
+    if state == 'committing':
+        _run_phase(journal_path, state, 'done', plan,
+                   [(_staged_path(dst), dst) for src, dst in plan], workers)
+
+def rollback(directory, workers=16):
+    """Undo the last journaled run, complete or interrupted, and remove its journal."""
+    journal_path = os.path.join(directory, JOURNAL_NAME)
+    state, plan = _read_journal(journal_path)
+    if state in ('committing', 'done'):
+        state = _run_phase(journal_path, state, 'rolling_back', plan,
+                           [(dst, _staged_path(dst)) for src, dst in plan if not os.path.exists(_staged_path(dst))],
+                           workers)
+    # while staging, only files that were actually staged have to go back
+    _run_phase(journal_path, state, 'rolled_back', plan,
+               [(_staged_path(dst), src) for src, dst in plan
+                if state == 'rolling_back' or os.path.exists(_staged_path(dst))], workers)
+    os.remove(journal_path)
+    print(f"Rolled back {len(plan)} renames in '{directory}'")
+
+def reformat_filenames(directory, workers=16, dry_run=False, verbose=False):
+    journal_path = os.path.join(directory, JOURNAL_NAME)
+    state, plan = _read_journal(journal_path) if os.path.exists(journal_path) else ('done', [])
+    if state in ('staging', 'committing'):
+        print(f"Resuming interrupted run ({len(plan)} renames, phase '{state}')")
+    elif state in ('rolling_back', 'rolled_back'):
+        raise RuntimeError("An interrupted rollback is pending, run with --rollback to finish it")
+    else:
+        with profiler.stage('plan'):
+            state, plan = 'staging', plan_renames(directory)
+
+    if verbose or dry_run:
+        for src, dst in plan:
+            print(f"Renamed '{os.path.basename(src)}' to '{os.path.basename(dst)}'")
+    if dry_run:
+        print(f"Dry run: {len(plan)} files would be renamed")
+        return
+    execute_plan(directory, plan, workers, state)
+    print(f"Renamed {len(plan)} files (journal: {journal_path})")
+
+def main(directory, workers=16, dry_run=False, verbose=False, undo=False):
     if not directory:
         print("Error: No directory provided.\nUsage: script.py <directory>", file=sys.stderr)
         return 1
 
-    reformat_filenames(directory)
+    try:
+        if undo:
+            rollback(directory, workers)
+        else:
+            reformat_filenames(directory, workers, dry_run, verbose)
+    except (ValueError, RuntimeError, FileNotFoundError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Error: No directory provided.\nUsage: script.py <directory>", file=sys.stderr)
-        sys.exit(1)
-    
-    target_directory = sys.argv[1]
-    main(target_directory)
+    parser = argparse.ArgumentParser(description="Rename .h5 files to <prefix><keV>keV_clen<clen>_<n>.h5.")
+    parser.add_argument("directory", help="Directory to reformat")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent renames (default: 16)")
+    parser.add_argument("--dry-run", action="store_true", help="Print the rename plan without renaming anything")
+    parser.add_argument("--verbose", action="store_true", help="Print every rename")
+    parser.add_argument("--rollback", action="store_true", help="Undo the last run in this directory")
+    profiler.add_profile_args(parser)
+    args = parser.parse_args()
+
+    with profiler.profiled(args.profile, args.cprofile):
+        status = main(args.directory, args.workers, args.dry_run, args.verbose, args.rollback)
+    sys.exit(status)
@@ -1,47 +1,55 @@
 import os
 import re
+from collections import defaultdict
+from h5_walker import describe_directory, walk_h5
 
 def parse_directory_name(dir_name):
     """
-    Parses the directory name to extract keV and clen values.
-    Assumes directory name format: '01_0.15m_6keV'
+    keV and clen code of a parameter directory such as '01_0.15m_6keV' (see
+    h5_walker.DATASET_DIR and CLEN_CODES), or None for any other name.
     """
-    match = re.match(r"(\d{2})_(0\.\d{2})m_(\d+)keV", dir_name)
-    if not match:
-        return None
+    _, _, keV, clen = describe_directory(dir_name)
+    return (keV, clen) if keV and clen else None
 
-    dataset, clen_meter, keV = match.groups()
-    # Map clen_meter to clen value
-    clen_map = {"0.15": "01", "0.25": "02", "0.35": "03"}
-    clen = clen_map[clen_meter]
-    return keV, clen
-
-def rename_files_in_dir(path, keV, clen):
+def rename_files_in_dir(path, keV, clen, filenames=None):
     """
     Renames all .h5 files in the given path according to the keV and clen values.
+    `filenames` can be passed when the directory has already been listed.
     """
-    for filename in os.listdir(path):
-        if filename.endswith('.h5'):
-            # Extract the index from the original filename
-            match = re.search(r"(\d+)\.h5$", filename)
-            if match:
-                index = match.group(1).zfill(5)  # Ensure the index is 5 digits
-                new_filename = f"img_{keV}keV_clen{clen}_{index}.h5"
-                os.rename(os.path.join(path, filename), os.path.join(path, new_filename))
-                print(f"Renamed {filename} to {new_filename}")
+    if filenames is None:
+        filenames = [entry.name for entry in walk_h5(path, recursive=False)]
+    for filename in filenames:
+        # Extract the index from the original filename
+        match = re.search(r"(\d+)\.h5$", filename)
+        if match:
+            index = match.group(1).zfill(5)  # Ensure the index is 5 digits
+            new_filename = f"img_{keV}keV_clen{clen}_{index}.h5"
+            os.rename(os.path.join(path, filename), os.path.join(path, new_filename))
+            print(f"Renamed {filename} to {new_filename}")
+
+def list_parameter_dirs(base_path):
+    """.h5 names of each directory directly under `base_path`, from one parallel scan that does not descend further."""
+    files_by_dir = defaultdict(list)
+    base = os.path.normpath(base_path)
+    for entry in walk_h5(base_path, max_depth=1):
+        if os.path.normpath(entry.directory) != base:
+            files_by_dir[os.path.basename(entry.directory)].append(entry.name)
+    return files_by_dir
 
 def main():
     base_path = "../../MASTER/"
-    for dir_name in os.listdir(base_path):
+    with os.scandir(base_path) as entries:
+        dir_names = sorted(entry.name for entry in entries if entry.is_dir())
+    files_by_dir = list_parameter_dirs(base_path)
+    for dir_name in dir_names:
         full_path = os.path.join(base_path, dir_name)
-        if os.path.isdir(full_path):  # Ensure it's a directory
-            parsed = parse_directory_name(dir_name)
-            if parsed:
-                keV, clen = parsed
-                print(f"Processing {dir_name} -> keV: {keV}, clen: {clen}")
-                rename_files_in_dir(full_path, keV, clen)
-            else:
-                print(f"Skipping unrecognized directory format: {dir_name}")
+        parsed = parse_directory_name(dir_name)
+        if parsed:
+            keV, clen = parsed
+            print(f"Processing {dir_name} -> keV: {keV}, clen: {clen}")
+            rename_files_in_dir(full_path, keV, clen, files_by_dir[dir_name])
+        else:
+            print(f"Skipping unrecognized directory format: {dir_name}")
 
 if __name__ == "__main__":
     main()
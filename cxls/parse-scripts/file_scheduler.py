@@ -0,0 +1,140 @@
+import os
+import pickle
+import sqlite3
+from multiprocessing import Pool
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+from stats_cache import StatsCache
+import profiler
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on (respects SLURM/cgroup affinity where available)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def list_h5_files(h5_dir: str) -> List[str]:
+    """Sorted full paths of the .h5 files directly inside `h5_dir`."""
+    return sorted(os.path.join(h5_dir, f) for f in os.listdir(h5_dir) if f.endswith('.h5'))
+
+def balanced_chunksize(n_tasks: int, workers: int, chunks_per_worker: int = 4) -> int:
+    """
+    Chunk size that amortises IPC overhead while leaving enough chunks in the queue
+    for fast workers to pick up the slack from slow ones.
+    """
+    return max(1, n_tasks // (workers * chunks_per_worker))
+
+def _call(args: Tuple[Callable, str, bool]) -> Tuple[Any, Optional[str], Optional[dict]]:
+    process_file, file_path, profile = args
+    # the flag travels with the task, so profiling also reaches spawned (not forked) workers
+    profiler.PROFILER.enabled = profile
+    try:
+        result, error = process_file(file_path), None
+    except Exception as e:
+        result, error = None, f'{file_path}: {str(e)}'
+    if profile:
+        # multiprocessing pickles the result after we return; measure that cost separately
+        with profiler.stage('pickle_result'):
+            profiler.count('result_bytes', len(pickle.dumps(result)))
+        profiler.count('files_processed')
+    return result, error, profiler.PROFILER.snapshot(reset=True)
+
+def _open_cache(h5_dir: str, cache_kind: Optional[str], cache_dir: Optional[str]) -> Optional[StatsCache]:
+    if not cache_kind:
+        return None
+    try:
+        return StatsCache.for_dataset(h5_dir, cache_kind, cache_dir=cache_dir)
+    except sqlite3.Error as e:
+        print(f'Cache unavailable for {h5_dir}, processing all files: {str(e)}')
+        return None
+
+def iter_file_results(process_file: Callable[[str], Any], h5_dirs: List[str],
+                      workers: Optional[int] = None,
+                      chunksize: Optional[int] = None,
+                      cache_kind: Optional[str] = None,
+                      cache_dir: Optional[str] = None) -> Iterator[Tuple[int, str, Any, Optional[str]]]:
+    """
+    Run `process_file` on every .h5 file of every directory, spread over a worker pool.
+
+    All files from all datasets go into one shared queue, so throughput scales with the
+    number of workers rather than with the number of datasets. Results come back in a
+    deterministic order (dataset order, then sorted file name), which lets the caller
+    reduce them per dataset as they stream in.
+
+    With `cache_kind` set, results are looked up in each dataset's `StatsCache` first and
+    only new or modified files are sent to the pool; fresh results are written back.
+    Cached results are loaded one at a time as they are yielded, so memory does not grow
+    with the number of files. Files removed before they could be looked up are skipped.
+
+    Args:
+        process_file (Callable[[str], Any]): Picklable function taking a file path.
+        h5_dirs (List[str]): Dataset directories to scan for .h5 files.
+        workers (int, optional): Worker processes. Defaults to the available CPUs.
+        chunksize (int, optional): Files handed to a worker at a time. Defaults to
+            `balanced_chunksize`.
+        cache_kind (str, optional): Cache namespace for this kind of result. Must change
+            whenever `process_file` would produce a different result for the same file.
+        cache_dir (str, optional): Keep cache files here instead of inside the datasets.
+
+    Yields:
+        tuple: (dataset index, file path or directory, result, error message or None).
+               Directories that cannot be listed yield a single error entry.
+    """
+    caches = [None] * len(h5_dirs)
+    tasks = []  # (dataset index, path, stat, cache hit)
+    try:
+        for idx, h5_dir in enumerate(h5_dirs):
+            try:
+                with profiler.stage('list'):
+                    paths = list_h5_files(h5_dir)
+            except OSError as e:
+                yield idx, h5_dir, None, str(e)
+                continue
+            cache = caches[idx] = _open_cache(h5_dir, cache_kind, cache_dir)
+            for path in paths:
+                if cache is None:
+                    tasks.append((idx, path, None, False))
+                    continue
+                with profiler.stage('cache_lookup'):
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue  # removed since the directory was listed
+                    tasks.append((idx, path, st, cache.is_fresh(path, st)))
+
+        misses = [path for _, path, _, hit in tasks if not hit]
+        if not tasks:
+            return
+
+        results = iter(())
+        pool = None
+        if misses:
+            workers = min(workers or available_cpus(), len(misses))
+            chunksize = chunksize or balanced_chunksize(len(misses), workers)
+            pool = Pool(processes=workers, initializer=profiler.reset_worker)
+            profile = profiler.PROFILER.enabled
+            results = pool.imap(_call, ((process_file, path, profile) for path in misses), chunksize=chunksize)
+        try:
+            for idx, path, st, hit in tasks:
+                if hit:
+                    profiler.count('cache_hits')
+                    with profiler.stage('cache_load'):
+                        cached = caches[idx].get(path, st)
+                    yield idx, path, cached, None
+                    continue
+                # time the parent spends waiting for workers, including unpickling their results
+                with profiler.stage('wait_for_workers'):
+                    result, error, worker_profile = next(results)
+                profiler.PROFILER.merge(worker_profile)
+                if error is None and caches[idx] is not None:
+                    with profiler.stage('cache_write'):
+                        caches[idx].put(path, result, st)
+                yield idx, path, result, error
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    finally:
+        for cache in caches:
+            if cache is not None:
+                cache.close()
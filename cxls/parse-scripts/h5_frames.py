@@ -0,0 +1,74 @@
+import numpy as np
+import h5py as h5
+from typing import Iterator, Optional
+import profiler
+
+DATA_PATH = 'entry/data/data'
+BLOCK_BYTES = 64 * 1024 * 1024  # read budget per block, keeps memory bounded on multi-event files
+
+def frame_count(dset: h5.Dataset) -> int:
+    """Number of frames in a dataset: 1 for a single (ss, fs) image, dim0 for (%, ss, fs) stacks."""
+    return 1 if dset.ndim == 2 else dset.shape[0]
+
+def frames_per_block(dset: h5.Dataset, max_bytes: int = BLOCK_BYTES) -> int:
+    """
+    Number of frames to read at once: whole HDF5 chunks along dim0 where possible, so each
+    chunk is decompressed exactly once, and otherwise as many frames as fit in `max_bytes`.
+    """
+    if dset.ndim == 2:
+        return 1
+    frame_bytes = dset.dtype.itemsize * dset.shape[1] * dset.shape[2]
+    n = max(1, max_bytes // frame_bytes)
+    if dset.chunks:
+        chunk = dset.chunks[0]
+        n = max(chunk, n // chunk * chunk)
+    return min(n, dset.shape[0])
+
+def iter_frame_blocks(dset: h5.Dataset, block: Optional[int] = None,
+                      out: Optional[np.ndarray] = None) -> Iterator[np.ndarray]:
+    """
+    Lazily read a dataset as (n, ss, fs) blocks of frames into one reused buffer.
+
+    The yielded array is a view that is overwritten by the next block, copy it if it has
+    to outlive the iteration.
+
+    Args:
+        dset (h5.Dataset): 2D single-frame or 3D multi-event dataset.
+        block (int, optional): Frames per block, defaults to `frames_per_block`.
+        out (np.ndarray, optional): Buffer of shape (>= block, ss, fs) and the dataset dtype.
+
+    Yields:
+        np.ndarray: The next block of frames.
+    """
+    if dset.ndim == 2:
+        buf = out if out is not None else np.empty((1,) + dset.shape, dtype=dset.dtype)
+        with profiler.stage('read'):
+            dset.read_direct(buf[0])
+        profiler.count('bytes_read', buf[0].nbytes)
+        profiler.count('frames', 1)
+        yield buf[:1]
+        return
+
+    n_frames = dset.shape[0]
+    block = block or frames_per_block(dset)
+    buf = out if out is not None else np.empty((block,) + dset.shape[1:], dtype=dset.dtype)
+    for start in range(0, n_frames, block):
+        n = min(block, n_frames - start)
+        with profiler.stage('read'):
+            dset.read_direct(buf, source_sel=np.s_[start:start + n], dest_sel=np.s_[0:n])
+        profiler.count('bytes_read', buf[:n].nbytes)
+        profiler.count('frames', n)
+        yield buf[:n]
+
+def iter_frames(dset: h5.Dataset, block: Optional[int] = None) -> Iterator[np.ndarray]:
+    """
+    Lazily yield the 2D frames of a dataset, one at a time, from a reused block buffer.
+    Works the same for single-frame and multi-event (dim0 = %) files.
+    """
+    for frames in iter_frame_blocks(dset, block=block):
+        yield from frames
+
+def iter_file_frames(file_path: str, data_path: str = DATA_PATH) -> Iterator[np.ndarray]:
+    """Open `file_path` and lazily yield the frames of `data_path`; the file stays open while iterating."""
+    with h5.File(file_path, 'r') as f:
+        yield from iter_frames(f[data_path])
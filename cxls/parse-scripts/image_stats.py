@@ -0,0 +1,132 @@
+import numpy as np
+import h5py as h5
+from typing import Optional, Sequence, Tuple
+from h5_frames import DATA_PATH, iter_frame_blocks, frames_per_block
+from log_histogram import LogHistogram
+import profiler
+from sparse_frames import SPARSE_PATH, iter_sparse_blocks, sparse_frame_count
+
+THRESHOLDS = (10, 100, 1000)  # intensities for the above-threshold pixel counts
+GATHER_FRACTION = 1 / 16      # sparser frames copy out their non-zero pixels, denser ones are binned in place
+
+def stats_dtype(n_thresholds: int = len(THRESHOLDS)) -> np.dtype:
+    """Row layout of the per-image stats table."""
+    return np.dtype([
+        ('frame', np.int64),
+        ('nonzero', np.int64),
+        ('sum', np.float64),
+        ('max', np.float64),
+        ('above', np.int64, (n_thresholds,)),
+    ])
+
+# Results built with different thresholds or binning must not be mixed in the stats cache
+_BINS = LogHistogram()
+CACHE_KIND = (f'image-stats:{",".join(f"{t:g}" for t in THRESHOLDS)}:'
+              f'{_BINS.edges[0]:g}:{_BINS.edges[-1]:g}:{_BINS.n_bins}')
+
+def block_stats(frames: np.ndarray, out: np.ndarray, mask: np.ndarray,
+                thresholds: Sequence[float] = THRESHOLDS):
+    """
+    Compute non-zero count, sum, max and above-threshold counts for a block of frames.
+
+    Every statistic is a reduction over the frame axes written straight into `out`, and
+    the comparisons reuse the boolean buffer `mask`, so no image-sized temporaries are
+    allocated per frame.
+
+    Args:
+        frames (np.ndarray): (n, ss, fs) block of frames.
+        out (np.ndarray): Stats table rows to fill, length n, dtype from `stats_dtype`.
+        mask (np.ndarray): Boolean scratch buffer with the same shape as `frames`, holds
+            the non-zero mask on return.
+        thresholds (Sequence[float]): Thresholds for the `above` columns.
+    """
+    axes = (1, 2)
+    out['sum'] = frames.sum(axis=axes, dtype=np.float64)
+    out['max'] = frames.max(axis=axes)
+    for i, threshold in enumerate(thresholds):
+        np.greater(frames, threshold, out=mask)
+        out['above'][:, i] = np.count_nonzero(mask, axis=axes)
+    # done last so the caller can reuse the non-zero mask
+    np.not_equal(frames, 0, out=mask)
+    out['nonzero'] = np.count_nonzero(mask, axis=axes)
+
+def sparse_stats(group: h5.Group, hist: LogHistogram,
+                 thresholds: Sequence[float] = THRESHOLDS) -> np.ndarray:
+    """
+    Same stats table as `block_stats` for a file in the sparse form of sparse_frames.py.
+
+    Only the stored non-zero pixels are read, so the cost grows with the number of peaks
+    rather than the detector size. Thresholds are assumed non-negative, as zeros are never
+    above them.
+    """
+    n_frames = sparse_frame_count(group)
+    n_pixels = int(np.prod(group.attrs['shape']))
+    table = np.zeros(n_frames, dtype=stats_dtype(len(thresholds)))
+    table['frame'] = np.arange(n_frames)
+    start = 0
+    for offsets, _, values in iter_sparse_blocks(group):
+        n = len(offsets) - 1
+        counts = np.diff(offsets)
+        frame_ids = np.repeat(np.arange(n), counts)
+        out = table[start:start + n]
+        out['nonzero'] = counts
+        out['sum'] = np.bincount(frame_ids, weights=values, minlength=n)
+        # frames with a zero pixel have a max of at least 0
+        frame_max = np.where(counts < n_pixels, 0.0, -np.inf)
+        np.maximum.at(frame_max, frame_ids, values)
+        out['max'] = frame_max
+        for i, threshold in enumerate(thresholds):
+            out['above'][:, i] = np.bincount(frame_ids[values > threshold], minlength=n)
+        hist.update(values)
+        start += n
+    return table
+
+def file_stats(file_path: str, data_path: str = DATA_PATH,
+               hist: Optional[LogHistogram] = None) -> Tuple[np.ndarray, LogHistogram]:
+    """
+    Read a .h5 file once and compute both the per-image stats table and the histogram of
+    non-zero intensities, so the freq and intensity analyses share a single decode. Peak
+    images copy out their few non-zero pixels for the histogram; frames denser than
+    `GATHER_FRACTION` are binned in place from the mask (`LogHistogram.update_masked`),
+    so no image-sized copy is made.
+
+    Args:
+        file_path (str): Path to the .h5 file, single-frame or multi-event, dense or sparse.
+        data_path (str): Dataset to read.
+        hist (LogHistogram, optional): Histogram to accumulate into, a new one by default.
+
+    Returns:
+        tuple: The stats table (one row per frame) and the intensity histogram.
+    """
+    hist = hist if hist is not None else LogHistogram()
+    with profiler.stage('open'):
+        f = h5.File(file_path, 'r')
+    profiler.count('files_opened')
+    with f:
+        # files converted with --in-place keep the dense data as well; the sparse form is faster
+        if SPARSE_PATH in f and (data_path not in f or f[SPARSE_PATH].attrs.get('source_path') == data_path):
+            with profiler.stage('compute'):
+                return sparse_stats(f[SPARSE_PATH], hist), hist
+        dset = f[data_path]
+        n_frames = 1 if dset.ndim == 2 else dset.shape[0]
+        table = np.zeros(n_frames, dtype=stats_dtype())
+        table['frame'] = np.arange(n_frames)
+        mask = None
+        start = 0
+        for frames in iter_frame_blocks(dset):
+            n = len(frames)
+            if mask is None:
+                mask = np.empty((frames_per_block(dset),) + frames.shape[1:], dtype=bool)
+                # one frame of scratch for update_masked
+                bins = np.empty(frames.shape[1:], dtype=np.intp)
+                work = np.empty(frames.shape[1:], dtype=np.float64)
+                flag = np.empty(frames.shape[1:], dtype=bool)
+            with profiler.stage('compute'):
+                block_stats(frames, table[start:start + n], mask[:n])
+                for frame, frame_mask, nonzero in zip(frames, mask[:n], table['nonzero'][start:start + n]):
+                    if nonzero <= GATHER_FRACTION * frame.size:
+                        hist.update(frame[frame_mask])  # a small copy, cheaper than binning every pixel
+                    else:
+                        hist.update_masked(frame, frame_mask, bins, work, flag)
+            start += n
+    return table, hist
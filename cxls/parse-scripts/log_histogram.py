@@ -0,0 +1,122 @@
+import numpy as np
+
+class LogHistogram:
+    """
+    Streaming histogram over fixed log-spaced bins.
+
+    Only the bin counts and a few running totals are kept, so memory stays constant
+    no matter how many values are pushed through `update`. Partials built in worker
+    processes are combined in the parent with `merge`.
+    """
+
+    def __init__(self, low: float = 1e-2, high: float = 1e8, n_bins: int = 200):
+        """
+        Args:
+            low (float): Lower edge of the first bin, must be > 0.
+            high (float): Upper edge of the last bin.
+            n_bins (int): Number of log-spaced bins between `low` and `high`.
+        """
+        self.edges = np.logspace(np.log10(low), np.log10(high), n_bins + 1)
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.underflow = 0  # values below low (including negatives)
+        self.overflow = 0   # values at or above high
+        self.count = 0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def n_bins(self) -> int:
+        return len(self.counts)
+
+    def update(self, values: np.ndarray):
+        """
+        Add a batch of values (e.g. the non-zero pixels of one image) to the histogram.
+
+        Args:
+            values (np.ndarray): Values to bin, any shape.
+        """
+        values = np.ravel(values)
+        if values.size == 0:
+            return
+        # index 0 is underflow, n_bins + 1 is overflow
+        idx = np.searchsorted(self.edges, values, side='right')
+        binned = np.bincount(idx, minlength=self.n_bins + 2)
+        self.underflow += int(binned[0])
+        self.counts += binned[1:self.n_bins + 1]
+        self.overflow += int(binned[self.n_bins + 1:].sum())
+        self.count += values.size
+        self.sum += float(values.sum(dtype=np.float64))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def update_masked(self, values: np.ndarray, mask: np.ndarray, bins: np.ndarray, work: np.ndarray,
+                      flag: np.ndarray):
+        """
+        Add values[mask] without gathering them into a new array.
+
+        The bin index of every selected pixel is computed in place from its logarithm,
+        corrected against the exact edges so the result matches `update`, and counted with
+        one bincount; unselected pixels go to a spare bin that is dropped. `bins` (intp),
+        `work` (float64) and `flag` (bool) are scratch buffers shaped like `values`,
+        allocated once by the caller and reused.
+        """
+        n = self.n_bins
+        log_low, log_high = np.log10(self.edges[0]), np.log10(self.edges[-1])
+        bins.fill(n + 2)
+        # values below `low` (including negatives) end up in the underflow bin after clipping
+        np.maximum(values, self.edges[0] / 2, out=work, where=mask)
+        np.log10(work, out=work, where=mask)
+        np.subtract(work, log_low, out=work, where=mask)
+        np.multiply(work, n / (log_high - log_low), out=work, where=mask)
+        np.floor(work, out=work, where=mask)
+        np.add(work, 1, out=work, where=mask)
+        np.clip(work, 0, n + 1, out=work, where=mask)
+        np.copyto(bins, work, casting='unsafe', where=mask)
+        # rounding in the logarithm can be one bin off right at an edge
+        lower = np.concatenate(([-np.inf], self.edges, [-np.inf]))
+        upper = np.concatenate((self.edges, [np.inf, np.inf]))
+        np.take(lower, bins, out=work)
+        np.less(values, work, out=flag)
+        np.subtract(bins, 1, out=bins, where=flag)
+        np.take(upper, bins, out=work)
+        np.greater_equal(values, work, out=flag)
+        np.add(bins, 1, out=bins, where=flag)
+
+        binned = np.bincount(bins.ravel(), minlength=n + 3)
+        count = int(binned[:n + 2].sum())
+        if count == 0:
+            return
+        self.underflow += int(binned[0])
+        self.counts += binned[1:n + 1]
+        self.overflow += int(binned[n + 1])
+        self.count += count
+        self.sum += float(np.sum(values, where=mask, dtype=np.float64))
+        self.min = min(self.min, float(np.min(values, where=mask, initial=np.inf)))
+        self.max = max(self.max, float(np.max(values, where=mask, initial=-np.inf)))
+
+    def merge(self, other: 'LogHistogram') -> 'LogHistogram':
+        """
+        Fold another partial histogram with identical bin edges into this one.
+
+        Returns:
+            LogHistogram: self, so partials can be reduced in a single expression.
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge histograms with different bin edges.")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else float('nan')
+
+    def plot(self, ax, **kwargs):
+        """Draw the binned counts on a matplotlib axis as a regular histogram."""
+        return ax.hist(self.edges[:-1], bins=self.edges, weights=self.counts, **kwargs)
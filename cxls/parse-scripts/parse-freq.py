@@ -1,43 +1,56 @@
 from pathlib import Path
 import numpy as np
-import h5py as h5
 import sys
 import matplotlib.pyplot as plt
 import os
-from typing import List
-from multiprocessing import Pool
+import argparse
+from typing import List, Optional
+from file_scheduler import iter_file_results
+from image_stats import CACHE_KIND, file_stats
+import profiler
 
-def process_dataset(name:str) -> tuple:
+def process_datasets(base_dir: str, dataset_names: List[str], workers: Optional[int] = None,
+                     use_cache: bool = True, cache_dir: Optional[str] = None) -> List[tuple]:
     """
-    Process a dataset by calculating the total number of peaks in each file.
+    Process datasets by calculating the total number of peaks (non-zero pixels) in each
+    image, with the files of all datasets scheduled across one worker pool. The per-image
+    stats are cached together with the intensity histograms of parse-intensities.py, so
+    whichever script runs first decodes the files for both.
 
     Args:
-        name (str): The name of the dataset.
+        base_dir (str): The base directory where the datasets are located.
+        dataset_names (List[str]): A list of dataset names.
+        workers (int, optional): Number of worker processes, defaults to the available CPUs.
+        use_cache (bool): Reuse per-file results from the dataset's stats cache.
+        cache_dir (str, optional): Keep cache files here instead of inside the datasets.
 
     Returns:
-        tuple: A tuple containing the name of the dataset, a list of total peaks for each file,
-               the total number of files processed, and an error message if any.
+        List[tuple]: Per dataset, a tuple containing the name of the dataset, a list of total
+                     peaks for each image, the total number of files processed, and an error
+                     message if any.
     """
-    h5_dir = os.path.join(base_dir, name)
-    total_peaks = []
-    file_count = 0
+    h5_dirs = [os.path.join(base_dir, name) for name in dataset_names]
+    total_peaks = [[] for _ in dataset_names]
+    file_counts = [0] * len(dataset_names)
+    errors = [None] * len(dataset_names)
 
-    try:
-        files = [f for f in os.listdir(h5_dir) if f.endswith('.h5')]
-        file_count = len(files)
-        for filename in files:
-            file_path = os.path.join(h5_dir, filename)
-            with h5.File(file_path, 'r') as f:
-                data = np.array(f['entry/data/data'])
-                _, freq = np.unique(data[data != 0], return_counts=True)
-                total_peaks.append(np.sum(freq))
-    except Exception as e:
-        print(f'Failed to process files in {h5_dir}: {str(e)}')
-        return name, total_peaks, file_count, str(e)
+    cache_kind = CACHE_KIND if use_cache else None
+    results = iter_file_results(file_stats, h5_dirs, workers=workers, cache_kind=cache_kind, cache_dir=cache_dir)
+    for idx, _, stats, error in results:
+        if error:
+            if errors[idx] is None:
+                print(f'Failed to process files in {h5_dirs[idx]}: {error}')
+                errors[idx] = error
+            continue
+        table, _ = stats
+        total_peaks[idx].extend(table['nonzero'].tolist())
+        file_counts[idx] += 1
 
-    return name, total_peaks, file_count, None
+    return [(name, peaks if not error else [], file_count, error)
+            for name, peaks, file_count, error in zip(dataset_names, total_peaks, file_counts, errors)]
 
-def plot_combined_hist(base_dir: str, dataset_names: List[str], plot_name: str):
+def plot_combined_hist(base_dir: str, dataset_names: List[str], plot_name: str, workers: Optional[int] = None,
+                       use_cache: bool = True, cache_dir: Optional[str] = None):
     """
     Plot a combined histogram of the frequency of peaks in multiple datasets.
 
@@ -45,6 +58,9 @@ def plot_combined_hist(base_dir: str, dataset_names: List[str], plot_name: str):
         base_dir (str): The base directory where the datasets are located.
         dataset_names (List[str]): A list of dataset names.
         plot_name (str): The name of the plot.
+        workers (int, optional): Number of worker processes, defaults to the available CPUs.
+        use_cache (bool): Reuse per-file results from the dataset's stats cache.
+        cache_dir (str, optional): Keep cache files here instead of inside the datasets.
 
     Returns:
         None
@@ -53,34 +69,40 @@ def plot_combined_hist(base_dir: str, dataset_names: List[str], plot_name: str):
         print("Usage: python parse-freq.py <dataset1> [dataset2 ...] <plot_name>")
         sys.exit(1)
     
-    with Pool(processes=len(dataset_names)) as pool:
-        results = pool.map(process_dataset, dataset_names)
+    results = process_datasets(base_dir, dataset_names, workers=workers, use_cache=use_cache, cache_dir=cache_dir)
     
-    all_results, labels = [], []
-    plt.figure(figsize=(10, 6))
-    colors = plt.cm.viridis(np.linspace(0, 1, len(dataset_names)))
+    # rendering and saving, timed separately from reading the files
+    with profiler.stage('plot'):
+        all_results, labels = [], []
+        plt.figure(figsize=(10, 6))
+        colors = plt.cm.viridis(np.linspace(0, 1, len(dataset_names)))
 
-    for result, color in zip(results, colors):
-        name, total_peaks, file_count, error = result
-        if error:
-            continue
-        all_results.append(total_peaks)
-        labels.append(f"{Path(name).stem} (Files: {file_count})")
-        plt.hist(total_peaks, bins=10, color=color, alpha=0.5, label=Path(name).stem + f" (Files: {file_count})")
+        for result, color in zip(results, colors):
+            name, total_peaks, file_count, error = result
+            if error:
+                continue
+            all_results.append(total_peaks)
+            labels.append(f"{Path(name).stem} (Files: {file_count})")
+            plt.hist(total_peaks, bins=10, color=color, alpha=0.5, label=Path(name).stem + f" (Files: {file_count})")
 
-    plt.legend()
-    plt.xlabel("Frequency of Peaks")
-    plt.ylabel("Frequency of Images")
-    plt.title(plot_name)
-    plt.savefig(f"{plot_name}_combined_histogram.png")
-    plt.show()
+        plt.legend()
+        plt.xlabel("Frequency of Peaks")
+        plt.ylabel("Frequency of Images")
+        plt.title(plot_name)
+        plt.savefig(f"{plot_name}_combined_histogram.png")
+        plt.show()
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("Usage: python parse-freq.py <dataset1> [dataset2 ...] <plot_name>")
-        sys.exit(1)
-    base_dir = '/bioxfel/user/amkurth/'
-    dataset_names = sys.argv[1:-1]
-    plot_name = sys.argv[-1]
+    parser = argparse.ArgumentParser(description="Plot a combined histogram of the number of peaks per image.")
+    parser.add_argument('dataset_names', nargs='+', help="Dataset directories under the base directory")
+    parser.add_argument('plot_name', help="Name of the plot")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: available CPUs)")
+    parser.add_argument('--no-cache', action='store_true', help="Ignore the per-dataset results cache and decode every file")
+    parser.add_argument('--cache-dir', default=None, help="Keep cache files here instead of inside the dataset directories")
+    parser.add_argument('--base-dir', default='/bioxfel/user/amkurth/', help="Directory containing the datasets (default: /bioxfel/user/amkurth/)")
+    profiler.add_profile_args(parser)
+    args = parser.parse_args()
 
-    plot_combined_hist(base_dir=base_dir, dataset_names=dataset_names, plot_name=plot_name)
+    with profiler.profiled(args.profile, args.cprofile):
+        plot_combined_hist(base_dir=args.base_dir, dataset_names=args.dataset_names, plot_name=args.plot_name,
+                           workers=args.workers, use_cache=not args.no_cache, cache_dir=args.cache_dir)
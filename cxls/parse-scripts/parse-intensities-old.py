@@ -3,6 +3,7 @@ import h5py
 import sys
 import matplotlib.pyplot as plt
 import os
+from h5_frames import iter_frames
 
 Names = (sys.argv[1], sys.argv[2] , sys.argv[3])     
 Name_plot = sys.argv[4]
@@ -26,8 +27,8 @@ for Name in Names:
                 dataset = f['entry']
                 data1 = dataset['data']
                 data = data1['data']
-                array_2d = np.array(data)
-                non_zero_values = np.concatenate((non_zero_values, (array_2d[array_2d != 0])))
+                for array_2d in iter_frames(data):
+                    non_zero_values = np.concatenate((non_zero_values, (array_2d[array_2d != 0])))
     all_results.append(non_zero_values)
     first_array = all_results[0]
     print(first_array)
@@ -1,36 +1,44 @@
 from pathlib import Path
-import numpy as np
-import h5py as h5 
 import sys
 import matplotlib.pyplot as plt
 import os
-from typing import List
-from multiprocessing import Pool
+import argparse
+from typing import List, Optional
+from file_scheduler import iter_file_results
+from image_stats import CACHE_KIND, file_stats
+import profiler
+from log_histogram import LogHistogram
 
-def process_dataset(name: str) -> tuple:
+def process_datasets(base_dir: str, dataset_names: List[str], workers: Optional[int] = None,
+                     use_cache: bool = True, cache_dir: Optional[str] = None) -> List[tuple]:
     """
-    Process a dataset by accumulating non-zero intensity values from each .h5 file.
+    Process datasets by merging the per-file histograms of non-zero intensities, with the
+    files of all datasets scheduled across one worker pool. Memory does not grow with the
+    number of images.
     """
-    h5_dir = os.path.join(base_dir, name)
-    non_zero_intensities = []
-    file_count = 0
+    h5_dirs = [os.path.join(base_dir, name) for name in dataset_names]
+    hists = [LogHistogram() for _ in dataset_names]
+    file_counts = [0] * len(dataset_names)
+    errors = [None] * len(dataset_names)
+
+    cache_kind = CACHE_KIND if use_cache else None
+    results = iter_file_results(file_stats, h5_dirs, workers=workers, cache_kind=cache_kind, cache_dir=cache_dir)
+    for idx, _, stats, error in results:
+        if error:
+            if errors[idx] is None:
+                print(f'Failed to process files in {h5_dirs[idx]}: {error}')
+                errors[idx] = error
+            continue
+        _, hist = stats
+        hists[idx].merge(hist)
+        file_counts[idx] += 1
 
-    try:
-        files = [f for f in os.listdir(h5_dir) if f.endswith('.h5')]
-        file_count = len(files)
-        for filename in files:
-            file_path = os.path.join(h5_dir, filename)
-            with h5.File(file_path, 'r') as f:
-                data = np.array(f['entry/data/data'])
-                non_zeros = data[data != 0]
-                non_zero_intensities.extend(non_zeros) # add to end of list
-    except Exception as e:
-        print(f'Failed to process files in {h5_dir}: {str(e)}')
-        return name, [], file_count, str(e)
     # return tuple anyways when processing successful
-    return name, non_zero_intensities, file_count, None
+    return [(name, hist if not error else LogHistogram(), file_count, error)
+            for name, hist, file_count, error in zip(dataset_names, hists, file_counts, errors)]
 
-def plot_combined_hist(base_dir: str, dataset_names: List[str], plot_name: str):
+def plot_combined_hist(base_dir: str, dataset_names: List[str], plot_name: str, workers: Optional[int] = None,
+                       use_cache: bool = True, cache_dir: Optional[str] = None):
     """
     Plot individual and combined histograms of non-zero intensities from multiple datasets.
     """
@@ -38,63 +46,68 @@ def plot_combined_hist(base_dir: str, dataset_names: List[str], plot_name: str):
         print("Usage: python parse-intensities.py <dataset1> [dataset2 ...] <plot_name>")
         sys.exit(1)
     
-    with Pool(processes=len(dataset_names)) as pool:
-        results = pool.map(process_dataset, dataset_names)
+    results = process_datasets(base_dir, dataset_names, workers=workers, use_cache=use_cache, cache_dir=cache_dir)
     
-    # Initialize figure for subplots with shared axis scales
-    fig, axes = plt.subplots(nrows=len(dataset_names)+1, ncols=1, figsize=(10, 6*len(dataset_names)),
-                             sharex=True, sharey=True)
+    # rendering and saving, timed separately from reading the files
+    with profiler.stage('plot'):
+        # Initialize figure for subplots with shared axis scales
+        fig, axes = plt.subplots(nrows=len(dataset_names)+1, ncols=1, figsize=(10, 6*len(dataset_names)),
+                                 sharex=True, sharey=True)
 
-    # Create a color map that is consistent across all plots
-    color_map = {name: plt.cm.viridis(i / len(dataset_names)) for i, name in enumerate(dataset_names)}
+        # Create a color map that is consistent across all plots
+        color_map = {name: plt.cm.viridis(i / len(dataset_names)) for i, name in enumerate(dataset_names)}
 
-    # Determine global min and max non-zero intensities
-    global_min = min(min(intensities) for _, intensities, _, _ in results if intensities)
-    global_max = max(max(intensities) for _, intensities, _, _ in results if intensities)
+        # Determine global min and max non-zero intensities
+        global_min = min(hist.min for _, hist, _, _ in results if hist.count)
+        global_max = max(hist.max for _, hist, _, _ in results if hist.count)
     
-    # Plot individual histograms
-    for (name, intensities, file_count, error), ax in zip(results, axes[:-1]):
-        if error:
-            print(f"Error processing {name}: {error}")
-            continue
-        color = color_map[name]
-        label = f"{Path(name).stem} (Files: {file_count})"
-        ax.hist(intensities, bins=100, color=color, alpha=0.5, log=True, label=label)
-        ax.legend()
-        ax.set_xlim(left=global_min, right=global_max)
-        ax.set_xscale('log')
-        ax.set_yscale('log')
-        ax.set_xlabel("Intensity of Peaks")
-        ax.set_ylabel("Occurrences Across Images")
+        # Plot individual histograms
+        for (name, hist, file_count, error), ax in zip(results, axes[:-1]):
+            if error:
+                print(f"Error processing {name}: {error}")
+                continue
+            color = color_map[name]
+            label = f"{Path(name).stem} (Files: {file_count})"
+            hist.plot(ax, color=color, alpha=0.5, log=True, label=label)
+            ax.legend()
+            ax.set_xlim(left=global_min, right=global_max)
+            ax.set_xscale('log')
+            ax.set_yscale('log')
+            ax.set_xlabel("Intensity of Peaks")
+            ax.set_ylabel("Occurrences Across Images")
 
-    # Plot combined histogram
-    combined_ax = axes[-1]
-    for name, intensities, file_count, error in results:
-        if error:
-            continue
-        color = color_map[name]
-        label = f"{Path(name).stem} (Files: {file_count})"
-        combined_ax.hist(intensities, bins=100, color=color, alpha=0.5, log=True, label=label)
+        # Plot combined histogram
+        combined_ax = axes[-1]
+        for name, hist, file_count, error in results:
+            if error:
+                continue
+            color = color_map[name]
+            label = f"{Path(name).stem} (Files: {file_count})"
+            hist.plot(combined_ax, color=color, alpha=0.5, log=True, label=label)
 
-    combined_ax.legend()
-    combined_ax.set_xlim(left=global_min, right=global_max)
-    combined_ax.set_xscale('log')
-    combined_ax.set_yscale('log')
-    combined_ax.set_xlabel("Intensity of Peaks")
-    combined_ax.set_ylabel("Occurrences Across Images")
-    combined_ax.set_title("Combined " + plot_name)
+        combined_ax.legend()
+        combined_ax.set_xlim(left=global_min, right=global_max)
+        combined_ax.set_xscale('log')
+        combined_ax.set_yscale('log')
+        combined_ax.set_xlabel("Intensity of Peaks")
+        combined_ax.set_ylabel("Occurrences Across Images")
+        combined_ax.set_title("Combined " + plot_name)
 
-    plt.tight_layout()
-    plt.savefig(f"{plot_name}_intensities_combined.png")
-    plt.show()
+        plt.tight_layout()
+        plt.savefig(f"{plot_name}_intensities_combined.png")
+        plt.show()
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("Usage: python parse-intensities.py <dataset1> [dataset2 ...] <plot_name>")
-        sys.exit(1)
-
-    base_dir = '/bioxfel/user/amkurth/'
-    dataset_names = sys.argv[1:-1]
-    plot_name = sys.argv[-1]
+    parser = argparse.ArgumentParser(description="Plot individual and combined histograms of non-zero intensities.")
+    parser.add_argument('dataset_names', nargs='+', help="Dataset directories under the base directory")
+    parser.add_argument('plot_name', help="Name of the plot")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: available CPUs)")
+    parser.add_argument('--no-cache', action='store_true', help="Ignore the per-dataset results cache and decode every file")
+    parser.add_argument('--cache-dir', default=None, help="Keep cache files here instead of inside the dataset directories")
+    parser.add_argument('--base-dir', default='/bioxfel/user/amkurth/', help="Directory containing the datasets (default: /bioxfel/user/amkurth/)")
+    profiler.add_profile_args(parser)
+    args = parser.parse_args()
 
-    plot_combined_hist(base_dir=base_dir, dataset_names=dataset_names, plot_name=plot_name)
+    with profiler.profiled(args.profile, args.cprofile):
+        plot_combined_hist(base_dir=args.base_dir, dataset_names=args.dataset_names, plot_name=args.plot_name,
+                           workers=args.workers, use_cache=not args.no_cache, cache_dir=args.cache_dir)
@@ -3,6 +3,8 @@ import h5py
 import sys
 import matplotlib.pyplot as plt
 import os
+from stats_cache import StatsCache
+from h5_frames import iter_frames
 
 Names = (sys.argv[1], sys.argv[2] , sys.argv[3])     
 Name_for_plot = sys.argv[4]
@@ -14,24 +16,39 @@ for Name in Names:
     counter = 0
     total_peaks=[]
 
+    # per frame (peaks, value_counts), enough to rebuild result_array on a cache hit
+    cache = StatsCache.for_dataset(h5_dir, 'peak-value-counts')
     for filename in os.listdir(h5_dir):
         #print(filename)
         if filename.endswith('.h5'):
             filepath = os.path.join(h5_dir, filename)
-            with h5py.File(filepath, 'r') as f:
-                value_counts = []
-                array = np.array(f['entry/data/data'])
-                non_zero_values, occurences = np.unique(array[array != 0], return_counts=True)
-                value_counts = np.column_stack((non_zero_values, occurences))
-                print(non_zero_values, occurences)
-                peaks = np.sum(occurences, axis=0)
-                total_peaks.append(peaks)
-                print(total_peaks)
-                print(value_counts)
-                result = (result, value_counts)
-                print(np.shape(result))
+            file_frames = cache.get(filepath)
+            if file_frames is not None:
+                # unchanged since the last run, skip decoding
+                for peaks, value_counts in file_frames:
+                    total_peaks.append(peaks)
+                    result = (result, value_counts)
+                    counter += 1
                 result_array = np.array(result, dtype=object)
-                counter +=1
+                continue
+            file_frames = []
+            with h5py.File(filepath, 'r') as f:
+                for array in iter_frames(f['entry/data/data']):
+                    value_counts = []
+                    non_zero_values, occurences = np.unique(array[array != 0], return_counts=True)
+                    value_counts = np.column_stack((non_zero_values, occurences))
+                    print(non_zero_values, occurences)
+                    peaks = int(np.sum(occurences, axis=0))
+                    file_frames.append((peaks, value_counts))
+                    total_peaks.append(peaks)
+                    print(total_peaks)
+                    print(value_counts)
+                    result = (result, value_counts)
+                    print(np.shape(result))
+                    result_array = np.array(result, dtype=object)
+                    counter +=1
+            cache.put(filepath, file_frames)
+    cache.close()
     if counter == 10:
         print(result_array)
         check = int(np.size(total_peaks))
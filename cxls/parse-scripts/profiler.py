@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import cProfile
+import argparse
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+class _NullStage:
+    """Shared do-nothing context manager returned while profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler, self.name = profiler, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.seconds[self.name] += time.perf_counter() - self.start
+        self.profiler.calls[self.name] += 1
+        return False
+
+class Profiler:
+    """
+    Per-stage wall times and named counters for one process.
+
+    While disabled, `stage` returns a shared no-op context manager and `count` returns
+    immediately, so instrumented code pays one attribute check per call. Stage times are
+    inclusive; nested stages are also counted in their parent.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    def stage(self, name: str):
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def snapshot(self, reset: bool = False) -> Optional[Dict[str, dict]]:
+        """Plain-dict copy of the timings (picklable, to send from a worker), None if disabled."""
+        if not self.enabled:
+            return None
+        snap = {'seconds': dict(self.seconds), 'calls': dict(self.calls), 'counters': dict(self.counters)}
+        if reset:
+            self.reset()
+        return snap
+
+    def merge(self, snap: Optional[Dict[str, dict]]):
+        """Add a worker's snapshot into this profiler."""
+        if not snap:
+            return
+        for name, seconds in snap['seconds'].items():
+            self.seconds[name] += seconds
+        for name, calls in snap['calls'].items():
+            self.calls[name] += calls
+        for name, n in snap['counters'].items():
+            self.counters[name] += n
+
+    def report(self, wall_seconds: float) -> dict:
+        return {
+            'wall_seconds': wall_seconds,
+            'pid': os.getpid(),
+            'stages': {name: {'seconds': self.seconds[name], 'calls': self.calls[name]}
+                       for name in sorted(self.seconds, key=self.seconds.get, reverse=True)},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+PROFILER = Profiler()
+stage = PROFILER.stage
+count = PROFILER.count
+
+def reset_worker():
+    """Pool initializer: forked workers start with a copy of the parent's totals, which
+    would otherwise be counted twice when their snapshots are merged back."""
+    PROFILER.reset()
+
+def add_profile_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--profile', nargs='?', const='profile.json', default=None, metavar='REPORT',
+                        help="Time each stage (summed over workers) and write a JSON report (default: profile.json)")
+    parser.add_argument('--cprofile', default=None, metavar='OUT',
+                        help="Also dump cProfile stats of the main process to this file (implies --profile)")
+
+@contextmanager
+def profiled(report_path: Optional[str] = None, cprofile_path: Optional[str] = None):
+    """
+    Enable profiling for the duration of the block, then write the JSON report to
+    `report_path` and, if given, cProfile stats to `cprofile_path`. Does nothing when
+    both are None.
+    """
+    if report_path is None and cprofile_path is None:
+        yield
+        return
+    report_path = report_path or 'profile.json'
+    PROFILER.enabled = True
+    profile = cProfile.Profile() if cprofile_path else None
+    start = time.perf_counter()
+    if profile:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(cprofile_path)
+        report = PROFILER.report(time.perf_counter() - start)
+        PROFILER.enabled = False
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Profile written to {report_path}" + (f", cProfile stats to {cprofile_path}" if profile else ""))
+        for name, timing in report['stages'].items():
+            print(f"  {name:<20}{timing['seconds']:>10.3f} s{timing['calls']:>10} calls")
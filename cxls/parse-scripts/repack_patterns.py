@@ -0,0 +1,198 @@
+import os
+import re
+import time
+import argparse
+import tempfile
+import numpy as np
+import h5py as h5
+from typing import Dict, List, Optional
+from h5_frames import DATA_PATH, frame_count, iter_frame_blocks
+
+try:
+    import hdf5plugin  # optional, adds the bitshuffle/blosc/zstd filters
+except ImportError:
+    hdf5plugin = None
+
+FRAMES_PER_STACK = 1000
+
+def _plugin_codecs() -> Dict[str, dict]:
+    if hdf5plugin is None:
+        return {}
+    return {
+        'bitshuffle-lz4': dict(hdf5plugin.Bitshuffle(cname='lz4')),
+        'blosc-lz4': dict(hdf5plugin.Blosc(cname='lz4', clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE)),
+        'blosc-zstd': dict(hdf5plugin.Blosc(cname='zstd', clevel=5, shuffle=hdf5plugin.Blosc.BITSHUFFLE)),
+        'zstd': dict(hdf5plugin.Zstd(clevel=3)),
+    }
+
+def codecs() -> Dict[str, dict]:
+    """create_dataset keyword arguments per codec name; the hdf5plugin ones only if it is installed."""
+    return {
+        'none': {},
+        'gzip': dict(compression='gzip', compression_opts=4, shuffle=True),
+        'lzf': dict(compression='lzf', shuffle=True),
+        **_plugin_codecs(),
+    }
+
+def codec_kwargs(codec: str) -> dict:
+    available = codecs()
+    if codec not in available:
+        hint = "" if hdf5plugin is not None else " (install hdf5plugin for bitshuffle, blosc and zstd)"
+        raise ValueError(f"Unknown codec '{codec}', available: {', '.join(available)}{hint}")
+    return available[codec]
+
+def natural_key(path: str):
+    """Sort 'sim-2.h5' before 'sim-10.h5', as pattern_sim numbers its output."""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', os.path.basename(path))]
+
+class StackWriter:
+    """
+    Streams the frames of whole input files into one (%, ss, fs) stack at `data_path`.
+
+    The dataset is chunked one frame per chunk, so any frame can be read by decompressing
+    exactly one chunk, and compressed with `codec`. The source file name and frame of every
+    event are stored in entry/data/source_file and entry/data/source_frame. The stack is
+    written under a temporary name and renamed into place by close().
+    """
+
+    def __init__(self, stack_path: str, codec: str = 'gzip', data_path: str = DATA_PATH):
+        self.stack_path, self.codec, self.data_path = stack_path, codec, data_path
+        self.tmp_path = f"{stack_path}.part"
+        self.f = h5.File(self.tmp_path, 'w')
+        self.dset, self.sources, self.frames = None, None, None
+        self.n_frames = 0
+
+    def add(self, path: str) -> int:
+        """Append every frame of `path`, returns the number of frames it had."""
+        with h5.File(path, 'r') as f_in:
+            source = f_in[self.data_path]
+            if self.dset is None:
+                frame_shape = source.shape[-2:]
+                self.dset = self.f.create_dataset(self.data_path, shape=(0,) + frame_shape, maxshape=(None,) + frame_shape,
+                                                  chunks=(1,) + frame_shape, dtype=source.dtype, **codec_kwargs(self.codec))
+                group = os.path.dirname(self.data_path)
+                self.sources = self.f.create_dataset(f'{group}/source_file', shape=(0,), maxshape=(None,),
+                                                     dtype=h5.string_dtype())
+                self.frames = self.f.create_dataset(f'{group}/source_frame', shape=(0,), maxshape=(None,), dtype=np.int64)
+            start, n = self.n_frames, frame_count(source)
+            for d in (self.dset, self.sources, self.frames):
+                d.resize(start + n, axis=0)
+            self.sources[start:start + n] = [os.path.basename(path)] * n
+            self.frames[start:start + n] = np.arange(n)
+            for block in iter_frame_blocks(source):
+                self.dset[start:start + len(block)] = block
+                start += len(block)
+        self.n_frames += n
+        return n
+
+    def close(self) -> int:
+        """Finish the stack and rename it into place, returns the number of frames written."""
+        self.f.close()
+        if os.path.exists(self.stack_path):
+            os.remove(self.tmp_path)
+            raise FileExistsError(f"{self.stack_path} already exists, not overwriting it")
+        os.replace(self.tmp_path, self.stack_path)
+        return self.n_frames
+
+def write_stack(paths: List[str], stack_path: str, codec: str = 'gzip', data_path: str = DATA_PATH) -> int:
+    """
+    Stream the frames of `paths` into one stack at `stack_path` (see StackWriter).
+
+    Returns:
+        int: Number of frames written.
+    """
+    writer = StackWriter(stack_path, codec, data_path)
+    for path in paths:
+        writer.add(path)
+    return writer.close()
+
+def next_stack_index(out_dir: str, prefix: str) -> int:
+    """Number after the highest existing <prefix>_<nnnn>.h5 in `out_dir`, so a rerun never reuses a name."""
+    pattern = re.compile(rf'{re.escape(prefix)}_(\d+)\.h5$')
+    indices = [int(m.group(1)) for m in map(pattern.match, os.listdir(out_dir)) if m]
+    return max(indices) + 1 if indices else 0
+
+def repack(paths: List[str], out_dir: str, prefix: str, codec: str = 'gzip', frames_per_stack: int = FRAMES_PER_STACK,
+           data_path: str = DATA_PATH, delete_sources: bool = False) -> List[str]:
+    """
+    Repack single-pattern files into <prefix>_<nnnn>.h5 stacks of about `frames_per_stack` events.
+
+    Files are taken in pattern_sim's numbering order. Numbering continues after the stacks
+    already in `out_dir`, so an interrupted run can be restarted on the remaining files.
+    With `delete_sources`, the inputs of a stack are removed only after that stack has
+    been written and renamed into place.
+    """
+    codec_kwargs(codec)  # fail before writing anything if the codec is unavailable
+    os.makedirs(out_dir, exist_ok=True)
+    paths = sorted(paths, key=natural_key)
+    index = next_stack_index(out_dir, prefix)
+    stacks, batch, writer = [], [], None
+    for i, path in enumerate(paths):
+        if writer is None:
+            writer = StackWriter(os.path.join(out_dir, f"{prefix}_{index + len(stacks):04d}.h5"), codec, data_path)
+        writer.add(path)
+        batch.append(path)
+        if writer.n_frames >= frames_per_stack or i == len(paths) - 1:
+            n_frames = writer.close()
+            print(f"Wrote {writer.stack_path} ({n_frames} frames from {len(batch)} files)")
+            if delete_sources:
+                for source in batch:
+                    os.remove(source)
+            stacks.append(writer.stack_path)
+            batch, writer = [], None
+    return stacks
+
+def benchmark(paths: List[str], codec_names: Optional[List[str]] = None, n_files: int = 50,
+              data_path: str = DATA_PATH) -> Dict[str, dict]:
+    """
+    Compare codecs on the first `n_files` inputs: stack size, write time and the time to
+    decode every frame sequentially. Prints a table and returns the numbers per codec.
+    """
+    paths = sorted(paths, key=natural_key)[:n_files]
+    raw_bytes = sum(os.path.getsize(path) for path in paths)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for codec in codec_names or list(codecs()):
+            stack_path = os.path.join(tmp_dir, f"{codec}.h5")
+            start = time.perf_counter()
+            n_frames = write_stack(paths, stack_path, codec, data_path)
+            write_s = time.perf_counter() - start
+            start = time.perf_counter()
+            with h5.File(stack_path, 'r') as f:
+                for _ in iter_frame_blocks(f[data_path]):
+                    pass
+            read_s = time.perf_counter() - start
+            size = os.path.getsize(stack_path)
+            results[codec] = {'frames': n_frames, 'bytes': size, 'ratio': raw_bytes / size,
+                              'write_s': write_s, 'read_s': read_s, 'read_fps': n_frames / read_s}
+
+    print(f"{len(paths)} files, {raw_bytes / 1e6:.1f} MB as single files")
+    print(f"{'codec':<16}{'MB':>10}{'ratio':>8}{'write s':>10}{'read s':>10}{'frames/s':>10}")
+    for codec, r in results.items():
+        print(f"{codec:<16}{r['bytes'] / 1e6:>10.1f}{r['ratio']:>8.1f}{r['write_s']:>10.2f}"
+              f"{r['read_s']:>10.2f}{r['read_fps']:>10.0f}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Repack single-pattern .h5 files into chunked, compressed multi-event stacks.")
+    parser.add_argument("input_dir", help="Directory with pattern_sim output files")
+    parser.add_argument("--out-dir", default=None, help="Directory for the stacks (default: <input_dir>/stacks)")
+    parser.add_argument("--prefix", default=None, help="Stack file prefix (default: name of input_dir)")
+    parser.add_argument("--codec", default='gzip', help=f"Compression, one of: {', '.join(codecs())}")
+    parser.add_argument("--frames-per-stack", type=int, default=FRAMES_PER_STACK, help="Events per stack file")
+    parser.add_argument("--data-path", default=DATA_PATH, help="Dataset in the input files (geometry 'data =' line)")
+    parser.add_argument("--delete-sources", action="store_true", help="Remove input files once their stack is written")
+    parser.add_argument("--benchmark", action="store_true", help="Compare all available codecs instead of repacking")
+    parser.add_argument("--benchmark-files", type=int, default=50, help="Input files used by --benchmark")
+    args = parser.parse_args()
+
+    if args.codec not in codecs():
+        parser.error(f"codec '{args.codec}' is not available, choose from: {', '.join(codecs())}"
+                     + ("" if hdf5plugin is not None else " (install hdf5plugin for bitshuffle, blosc and zstd)"))
+    input_dir = os.path.normpath(args.input_dir)
+    paths = [os.path.join(input_dir, name) for name in os.listdir(input_dir) if name.endswith('.h5')]
+    if args.benchmark:
+        benchmark(paths, n_files=args.benchmark_files, data_path=args.data_path)
+    else:
+        repack(paths, args.out_dir or os.path.join(input_dir, 'stacks'), args.prefix or os.path.basename(input_dir),
+               args.codec, args.frames_per_stack, args.data_path, args.delete_sources)
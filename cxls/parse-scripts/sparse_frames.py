@@ -0,0 +1,116 @@
+import os
+import argparse
+import numpy as np
+import h5py as h5
+from multiprocessing import Pool
+from typing import Iterator, Optional, Tuple
+from h5_frames import DATA_PATH, frame_count, iter_frames
+from file_scheduler import available_cpus, balanced_chunksize, list_h5_files
+import profiler
+
+SPARSE_PATH = 'entry/sparse'
+BLOCK_FRAMES = 1024  # frames whose indices and values are read at once
+
+def is_sparse(f: h5.File, sparse_path: str = SPARSE_PATH) -> bool:
+    return sparse_path in f
+
+def write_sparse(group: h5.Group, frames: Iterator[np.ndarray]):
+    """
+    Store frames as flat pixel indices plus values of their non-zero pixels.
+
+    Frame i owns index[offset[i]:offset[i + 1]] and value[offset[i]:offset[i + 1]];
+    the frame shape and dtype are kept as attributes so frames can be made dense again.
+    """
+    indices, values, offsets = [], [], [0]
+    shape, dtype = None, None
+    for frame in frames:
+        shape, dtype = frame.shape, frame.dtype
+        flat = np.flatnonzero(frame)
+        indices.append(flat.astype(np.uint32))
+        values.append(frame.ravel()[flat])
+        offsets.append(offsets[-1] + len(flat))
+    if shape is None:
+        raise ValueError("No frames to store")
+    group.create_dataset('index', data=np.concatenate(indices), chunks=True)
+    group.create_dataset('value', data=np.concatenate(values).astype(dtype), chunks=True)
+    group.create_dataset('offset', data=np.array(offsets, dtype=np.int64))
+    group.attrs['shape'] = shape
+    group.attrs['dtype'] = str(dtype)
+
+def iter_sparse_blocks(group: h5.Group, block: int = BLOCK_FRAMES) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Yield (offsets, indices, values) for blocks of up to `block` frames, with offsets
+    relative to the block (length n + 1), so memory scales with the peaks, not the frames.
+    """
+    offset = group['offset'][:]
+    for start in range(0, len(offset) - 1, block):
+        stop = min(start + block, len(offset) - 1)
+        lo, hi = offset[start], offset[stop]
+        with profiler.stage('read'):
+            indices, values = group['index'][lo:hi], group['value'][lo:hi]
+        profiler.count('bytes_read', indices.nbytes + values.nbytes)
+        profiler.count('frames', stop - start)
+        yield offset[start:stop + 1] - lo, indices, values
+
+def sparse_frame_count(group: h5.Group) -> int:
+    return group['offset'].shape[0] - 1
+
+def dense_frame(group: h5.Group, i: int) -> np.ndarray:
+    """Rebuild frame `i` as a dense (ss, fs) array."""
+    lo, hi = group['offset'][i:i + 2]
+    frame = np.zeros(tuple(group.attrs['shape']), dtype=np.dtype(group.attrs['dtype']))
+    frame.ravel()[group['index'][lo:hi]] = group['value'][lo:hi]
+    return frame
+
+def convert_file(task: Tuple[str, str, str]) -> Tuple[str, Optional[str]]:
+    """
+    Write a sparse copy of one dense file to `out_path`.
+
+    File attributes such as clen, photon_energy and peak are copied. When `out_path` is
+    the input path the dense dataset is copied too, so the file gains the sparse form
+    while catalog.py, build_vds.py, assign_params.py and apply_water_background.py, which
+    read the dense data, keep working. Returns the input path and an error message or None.
+    """
+    file_path, out_path, data_path = task
+    tmp_path = f"{out_path}.part"
+    try:
+        with h5.File(file_path, 'r') as f_in, h5.File(tmp_path, 'w') as f_out:
+            f_out.attrs.update(f_in.attrs)
+            if os.path.abspath(out_path) == os.path.abspath(file_path):
+                f_in.copy(f_in[data_path], f_out, name=data_path)
+            sparse = f_out.create_group(SPARSE_PATH)
+            write_sparse(sparse, iter_frames(f_in[data_path]))
+            sparse.attrs['source_path'] = data_path
+            if frame_count(f_in[data_path]) != sparse_frame_count(f_out[SPARSE_PATH]):
+                raise ValueError("frame count mismatch")
+        os.replace(tmp_path, out_path)
+        return file_path, None
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return file_path, str(e)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert dense .h5 peak images to the sparse index/value/offset form.")
+    parser.add_argument("input_dir", help="Directory with dense .h5 files, e.g. images/peaks/01")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--out-dir", help="Directory to write the sparse files to, same names")
+    group.add_argument("--in-place", action="store_true",
+                       help="Add the sparse form to each file, keeping the dense data the other tools read")
+    parser.add_argument("--data-path", default=DATA_PATH, help="Dense dataset to convert")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all CPUs)")
+    args = parser.parse_args()
+
+    paths = list_h5_files(args.input_dir)
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    tasks = [(path, path if args.in_place else os.path.join(args.out_dir, os.path.basename(path)), args.data_path)
+             for path in paths]
+    workers = args.workers or available_cpus()
+    failed = 0
+    with Pool(processes=workers) as pool:
+        for path, error in pool.imap(convert_file, tasks, chunksize=balanced_chunksize(len(tasks), workers)):
+            if error:
+                failed += 1
+                print(f"{path}: {error}")
+    print(f"Converted {len(tasks) - failed} of {len(tasks)} files.")
@@ -0,0 +1,83 @@
+import os
+import pickle
+import sqlite3
+from typing import Any, Optional
+
+CACHE_NAME = '.parse_cache.sqlite'
+
+class StatsCache:
+    """
+    Sidecar SQLite cache of per-file results for one dataset directory.
+
+    Rows are keyed on (file name, kind) and remember the file's size and mtime, so a
+    result is only reused while the file on disk is unchanged. `kind` separates the
+    different per-file results the parse scripts compute (peak counts, histogram
+    partials, ...) so they can share one cache file.
+    """
+
+    def __init__(self, db_path: str, kind: str):
+        self.db_path = db_path
+        self.kind = kind
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' name TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL, value BLOB NOT NULL,'
+            ' PRIMARY KEY (name, kind))'
+        )
+        self.pending = 0
+
+    @classmethod
+    def for_dataset(cls, h5_dir: str, kind: str, cache_dir: Optional[str] = None) -> 'StatsCache':
+        """
+        Open the cache for a dataset directory. By default the cache lives next to the
+        data as `<h5_dir>/.parse_cache.sqlite`; pass `cache_dir` when the data is read-only.
+        """
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            name = os.path.abspath(h5_dir).strip(os.sep).replace(os.sep, '_')
+            return cls(os.path.join(cache_dir, f'{name}.sqlite'), kind)
+        return cls(os.path.join(h5_dir, CACHE_NAME), kind)
+
+    def get(self, file_path: str, st: Optional[os.stat_result] = None) -> Any:
+        """Return the cached result for `file_path`, or None if missing or stale."""
+        st = st or os.stat(file_path)
+        row = self.conn.execute(
+            'SELECT size, mtime_ns, value FROM files WHERE name = ? AND kind = ?',
+            (os.path.basename(file_path), self.kind)).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            return None
+        return pickle.loads(row[2])
+
+    def is_fresh(self, file_path: str, st: Optional[os.stat_result] = None) -> bool:
+        """Whether a result for `file_path` is cached and current, without loading it."""
+        st = st or os.stat(file_path)
+        row = self.conn.execute(
+            'SELECT size, mtime_ns FROM files WHERE name = ? AND kind = ?',
+            (os.path.basename(file_path), self.kind)).fetchone()
+        return row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns
+
+    def put(self, file_path: str, value: Any, st: Optional[os.stat_result] = None):
+        """Store the result for `file_path`; committed in batches and on close."""
+        st = st or os.stat(file_path)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO files (name, kind, size, mtime_ns, value) VALUES (?, ?, ?, ?, ?)',
+            (os.path.basename(file_path), self.kind, st.st_size, st.st_mtime_ns,
+             pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+        self.pending += 1
+        if self.pending >= 1000:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,272 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import matplotlib.pyplot as plt
+from multiprocessing import Pool
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from file_scheduler import available_cpus
+from image_stats import CACHE_KIND, file_stats
+from log_histogram import LogHistogram
+from stats_cache import StatsCache
+
+try:
+    from inotify_simple import INotify, flags  # optional, polling is used without it
+except ImportError:
+    INotify = None
+
+SETTLE_SECONDS = 10.0  # a polled file counts as written once unchanged for this long
+MAX_ATTEMPTS = 3       # files that still fail to read after this many tries are reported
+
+def _stats(file_path: str) -> Tuple[str, object, Optional[str]]:
+    try:
+        return file_path, file_stats(file_path), None
+    except Exception as e:
+        return file_path, None, str(e)
+
+class CompletionTracker:
+    """
+    Decides when .h5 files in a set of directories are completely written.
+
+    With inotify a file is ready as soon as its writer closes it (or it is renamed into
+    place). Compute nodes write over the shared filesystem, where inotify on the login
+    node sees nothing, so directories are also rescanned: a polled file is ready once its
+    size and mtime are unchanged between scans and it is at least `settle` seconds old.
+    """
+
+    def __init__(self, h5_dirs: List[str], settle: float = SETTLE_SECONDS, use_inotify: bool = True):
+        self.settle = settle
+        self.last_stat: Dict[str, Tuple[int, int]] = {}
+        self.done: Dict[str, Tuple[int, int]] = {}
+        self.notify = None
+        if use_inotify and INotify is not None:
+            self.notify = INotify()
+            self.watches = {self.notify.add_watch(h5_dir, flags.CLOSE_WRITE | flags.MOVED_TO): h5_dir
+                            for h5_dir in h5_dirs}
+        self.h5_dirs = h5_dirs
+
+    @staticmethod
+    def _is_candidate(name: str) -> bool:
+        # staged or partial files (".name.reformat-tmp", "name.h5.part") are never picked up
+        return name.endswith('.h5') and not name.startswith('.')
+
+    def wait_events(self, timeout: float) -> List[str]:
+        """Paths closed after writing within `timeout` seconds (just sleeps without inotify)."""
+        if self.notify is None:
+            time.sleep(timeout)
+            return []
+        return [os.path.join(self.watches[event.wd], event.name)
+                for event in self.notify.read(timeout=int(timeout * 1000))
+                if self._is_candidate(event.name)]
+
+    def scan(self) -> List[str]:
+        """Paths that have settled since the previous scan."""
+        ready, now = [], time.time()
+        for h5_dir in self.h5_dirs:
+            with os.scandir(h5_dir) as entries:
+                for entry in entries:
+                    if not self._is_candidate(entry.name):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        self.forget(entry.path)
+                        continue
+                    key = (st.st_size, st.st_mtime_ns)
+                    if self.done.get(entry.path) == key:
+                        continue
+                    if self.last_stat.get(entry.path) == key and now - st.st_mtime >= self.settle:
+                        ready.append(entry.path)
+                    self.last_stat[entry.path] = key
+        return ready
+
+    def mark_done(self, path: str, st: os.stat_result):
+        self.done[path] = (st.st_size, st.st_mtime_ns)
+        self.last_stat.pop(path, None)
+
+    def forget(self, path: str):
+        """Drop a file that disappeared; it is tracked afresh if it shows up again."""
+        self.done.pop(path, None)
+        self.last_stat.pop(path, None)
+
+class LivePlot:
+    """Peaks-per-image and intensity histograms of everything processed so far, redrawn in place."""
+
+    def __init__(self, plot_name: str, show: bool = False):
+        self.plot_name = plot_name
+        self.show = show
+        if show:
+            plt.ion()
+        self.fig, (self.ax_freq, self.ax_int) = plt.subplots(nrows=2, ncols=1, figsize=(10, 10))
+
+    def update(self, peak_counts: Counter, hist: LogHistogram, n_files: int, rate: float):
+        """`peak_counts` maps a number of peaks to the number of images with that many."""
+        self.ax_freq.clear()
+        self.ax_int.clear()
+        n_images = sum(peak_counts.values())
+        if n_images:
+            values = np.fromiter(peak_counts.keys(), dtype=float, count=len(peak_counts))
+            weights = np.fromiter(peak_counts.values(), dtype=float, count=len(peak_counts))
+            self.ax_freq.hist(values, weights=weights, bins=50, color='blue', alpha=0.7, edgecolor='black')
+        self.ax_freq.set_xlabel("Number of Peaks")
+        self.ax_freq.set_ylabel("Frequency")
+        self.ax_freq.set_title(f"{self.plot_name}: {n_images} images from {n_files} files ({rate:.1f} files/min)")
+        if hist.count:
+            hist.plot(self.ax_int, color='blue', alpha=0.5, log=True)
+            self.ax_int.set_xscale('log')
+            self.ax_int.set_xlim(left=hist.min if hist.min > 0 else hist.edges[0], right=hist.max)
+        self.ax_int.set_xlabel("Intensity of Peaks")
+        self.ax_int.set_ylabel("Occurrences Across Images")
+        self.fig.tight_layout()
+        self.fig.savefig(f"{self.plot_name}_live.png")
+        if self.show:
+            plt.pause(0.001)
+
+def watch(h5_dirs: List[str], plot_name: str, workers: Optional[int] = None, interval: float = 2.0,
+          rescan: float = 30.0, settle: float = SETTLE_SECONDS, refresh: float = 30.0,
+          idle_exit: Optional[float] = None, expected: Optional[int] = None, use_inotify: bool = True,
+          show: bool = False, cache_dir: Optional[str] = None):
+    """
+    Follow campaign output directories and compute the per-image stats of every .h5 file
+    as soon as it is completely written.
+
+    Results go into each directory's stats cache, the same store parse-freq.py and
+    parse-intensities.py read, so once the last file lands their final plots only need
+    cache hits. Files already in the cache (e.g. after a restart) are loaded, not decoded.
+
+    Args:
+        h5_dirs (List[str]): Directories the simulation writes .h5 files to.
+        plot_name (str): Prefix of the live plot, saved as <plot_name>_live.png.
+        workers (int, optional): Worker processes, defaults to the available CPUs.
+        interval (float): Seconds to wait for inotify events between checks.
+        rescan (float): Seconds between directory rescans (every check when polling).
+        settle (float): Seconds a polled file must stay unchanged before it is read.
+        refresh (float): Seconds between plot and status updates.
+        idle_exit (float, optional): Stop after this many seconds without a new file.
+        expected (int, optional): Stop once this many files are processed.
+        use_inotify (bool): Use inotify when inotify_simple is installed.
+        show (bool): Also show the plot in a window.
+        cache_dir (str, optional): Keep cache files here instead of inside the directories.
+    """
+    # cache and inotify lookups go by os.path.dirname of absolute paths
+    h5_dirs = [os.path.abspath(h5_dir) for h5_dir in h5_dirs]
+    tracker = CompletionTracker(h5_dirs, settle, use_inotify)
+    if tracker.notify is None:
+        rescan = interval
+        print("inotify unavailable or disabled, polling" + (" (install inotify_simple)" if INotify is None else ""))
+    caches = {h5_dir: StatsCache.for_dataset(h5_dir, CACHE_KIND, cache_dir=cache_dir) for h5_dir in h5_dirs}
+    # running totals, so memory and refresh time do not grow with the number of files
+    seen = set()
+    peak_counts: Counter = Counter()
+    hist = LogHistogram()
+    attempts: Dict[str, int] = {}
+    plot = LivePlot(plot_name, show)
+    start = last_new = time.time()
+    last_scan = last_refresh = 0.0
+    dirty = False
+
+    def add(path, nonzero, file_hist):
+        # a file rewritten after it was counted keeps its first contribution
+        if path in seen:
+            return
+        seen.add(path)
+        peak_counts.update(np.asarray(nonzero).tolist())
+        hist.merge(file_hist)
+
+    def report():
+        n_images = sum(peak_counts.values())
+        rate = len(seen) / max((time.time() - start) / 60, 1e-9)
+        plot.update(peak_counts, hist, len(seen), rate)
+        mean = f"{sum(n * c for n, c in peak_counts.items()) / n_images:.1f}" if n_images else "-"
+        print(f"{time.strftime('%H:%M:%S')}  {len(seen)} files, {n_images} images, "
+              f"mean peaks {mean}, {hist.count} peak pixels, {rate:.1f} files/min")
+
+    with Pool(processes=workers or available_cpus()) as pool:
+        try:
+            while True:
+                ready = set(tracker.wait_events(interval))
+                now = time.time()
+                if now - last_scan >= rescan:
+                    ready.update(tracker.scan())
+                    last_scan = now
+
+                to_compute = {}  # path -> stat when it was found ready
+                for path in sorted(ready):
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        tracker.forget(path)  # renamed or removed since
+                        continue
+                    cached = caches[os.path.dirname(path)].get(path, st)
+                    if cached is None:
+                        to_compute[path] = st
+                        continue
+                    add(path, cached[0]['nonzero'], cached[1])
+                    tracker.mark_done(path, st)
+                    dirty = True
+
+                for path, stats, error in pool.imap_unordered(_stats, list(to_compute)):
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        tracker.forget(path)  # e.g. a .part replaced or the file removed while it was read
+                        continue
+                    if (st.st_size, st.st_mtime_ns) != (to_compute[path].st_size, to_compute[path].st_mtime_ns):
+                        continue  # rewritten while it was read; the next scan sees it settle again
+                    if error:
+                        # e.g. still open for writing on another node; picked up again by a later scan
+                        attempts[path] = attempts.get(path, 0) + 1
+                        if attempts[path] >= MAX_ATTEMPTS:
+                            print(f"Failed to process {path}: {error}")
+                            tracker.mark_done(path, st)
+                        continue
+                    caches[os.path.dirname(path)].put(path, stats, st)
+                    add(path, stats[0]['nonzero'], stats[1])
+                    tracker.mark_done(path, st)
+                    dirty = True
+                if to_compute:
+                    last_new = time.time()
+                    for cache in caches.values():
+                        cache.commit()
+
+                if dirty and time.time() - last_refresh >= refresh:
+                    report()
+                    last_refresh, dirty = time.time(), False
+                if expected and len(seen) >= expected:
+                    print(f"All {expected} expected files processed.")
+                    break
+                if idle_exit and time.time() - last_new >= idle_exit:
+                    print(f"No new files for {idle_exit:g} s, stopping.")
+                    break
+        except KeyboardInterrupt:
+            print("Stopped.")
+        finally:
+            for cache in caches.values():
+                cache.close()
+    report()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute per-image stats of .h5 files as a campaign writes them, with live histograms.")
+    parser.add_argument("h5_dirs", nargs='+', help="Directories to watch, e.g. the campaign output directory")
+    parser.add_argument("--plot-name", default="watch", help="Live plot is saved as <plot-name>_live.png (default: watch)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: available CPUs)")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between checks for new files")
+    parser.add_argument("--rescan", type=float, default=30.0, help="Seconds between directory rescans when inotify is used")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS, help="Seconds a file must be unchanged before it is read")
+    parser.add_argument("--refresh", type=float, default=30.0, help="Seconds between plot updates")
+    parser.add_argument("--idle-exit", type=float, default=None, help="Stop after this many seconds without new files")
+    parser.add_argument("--expected", type=int, default=None, help="Stop once this many files are processed")
+    parser.add_argument("--poll", action="store_true", help="Do not use inotify, only poll")
+    parser.add_argument("--show", action="store_true", help="Also show the live plot in a window")
+    parser.add_argument("--cache-dir", default=None, help="Keep cache files here instead of inside the watched directories")
+    args = parser.parse_args()
+
+    for h5_dir in args.h5_dirs:
+        if not os.path.isdir(h5_dir):
+            print(f"Not a directory: {h5_dir}")
+            sys.exit(1)
+    watch(args.h5_dirs, args.plot_name, workers=args.workers, interval=args.interval,
+          rescan=args.rescan, settle=args.settle, refresh=args.refresh, idle_exit=args.idle_exit,
+          expected=args.expected, use_inotify=not args.poll, show=args.show, cache_dir=args.cache_dir)
@@ -21,6 +21,12 @@ TXT_OUTDIR="/Users/adamkurth/Documents/vscode/CXFEL_Image_Analysis/CXFEL/unitcel
 MTZ_OUTDIR="/Users/adamkurth/Documents/vscode/CXFEL_Image_Analysis/CXFEL/unitcell_project/run_sfall/mtz/mtz_$SPACEGROUP"
 HKL_OUTDIR="/Users/adamkurth/Documents/vscode/CXFEL_Image_Analysis/CXFEL/unitcell_project/run_sfall/data/data_$SPACEGROUP"
 
+# Populate the PDB directory from the local PDB mirror (rcsbapi/mirror.py) when one is configured
+if [ -n "$PDB_MIRROR" ]; then
+    python3 "$(dirname "$0")/../../rcsbapi/mirror.py" --root "$PDB_MIRROR" export --space-group "$SPACEGROUP" --dest "$PDB_DIR" \
+        || echo "Mirror export failed, using the files already in $PDB_DIR"
+fi
+
 # Ensure the PDB directory exists
 if [ ! -d "$PDB_DIR" ]; then
     echo "Error: PDB directory $PDB_DIR does not exist."
@@ -1,6 +1,16 @@
 import os
 import h5py as h5
-from typing import Any, Dict
+import numpy as np
+from collections import Counter
+from multiprocessing import Pool
+from typing import Any, Dict, Optional, Tuple
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on (respects SLURM/cgroup affinity where available)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
 
 def assign_attributes(file_path: str, **kwargs: Any):
     """Assigns arbitrary attributes to an HDF5 file without individual confirmation."""
@@ -59,11 +69,86 @@ def process_directory(directory: str):
             print(f"Dataset directory {dataset} not found in {directory}.")
  
 
+def _needs_update(f: h5.File, attributes: Dict[str, Any]) -> bool:
+    """True if any attribute is missing or differs from the wanted value."""
+    for key, value in attributes.items():
+        if key not in f.attrs or not np.array_equal(f.attrs[key], value):
+            return True
+    return False
+
+def check_and_assign(task: Tuple[str, Dict[str, Any], bool]) -> Tuple[str, str]:
+    """Reads a file's attributes and rewrites them only if they differ.
+
+    Returns the file path and one of 'unchanged', 'updated', 'would update' (dry run)
+    or an error message starting with 'failed'."""
+    file_path, attributes, dry_run = task
+    try:
+        with h5.File(file_path, 'r') as f:
+            if not _needs_update(f, attributes):
+                return file_path, 'unchanged'
+        if dry_run:
+            return file_path, 'would update'
+        with h5.File(file_path, 'a') as f:
+            for key, value in attributes.items():
+                f.attrs[key] = value
+        return file_path, 'updated'
+    except Exception as e:
+        return file_path, f'failed: {str(e)}'
+
+def bulk_process_directory(directory: str, workers: Optional[int] = None, dry_run: bool = False,
+                           assume_yes: bool = False) -> Dict[str, Counter]:
+    """Assigns attributes to every file of every dataset directory with a worker pool.
+
+    Files whose attributes are already correct are only read, never reopened for writing,
+    and progress is summarised per dataset instead of printed per file. With `dry_run`
+    nothing is written and the summary shows what would change."""
+    dataset_params = get_params()
+    if not dry_run and not assume_yes:
+        user_confirmation = input(f"Proceed with assigning attributes for all files in '{directory}'? (y/n): ")
+        if user_confirmation.lower() != 'y':
+            print("Attribute assignment canceled.")
+            return {}
+
+    tasks, task_datasets = [], []
+    for dataset, params in dataset_params.items():
+        dataset_dir = os.path.join(directory, dataset)
+        if not os.path.exists(dataset_dir):
+            print(f"Dataset directory {dataset} not found in {directory}.")
+            continue
+        for file in sorted(f for f in os.listdir(dataset_dir) if f.endswith('.h5')):
+            attributes = dict(params, peak=not file.startswith("empty"))
+            tasks.append((os.path.join(dataset_dir, file), attributes, dry_run))
+            task_datasets.append(dataset)
+
+    summary = {dataset: Counter() for dataset in dict.fromkeys(task_datasets)}
+    if tasks:
+        workers = workers or available_cpus()
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with Pool(processes=workers) as pool:
+            for dataset, (file_path, status) in zip(task_datasets, pool.imap(check_and_assign, tasks, chunksize=chunksize)):
+                if status.startswith('failed'):
+                    print(f"{file_path}: {status}")
+                    status = 'failed'
+                summary[dataset][status] += 1
+
+    for dataset, counts in summary.items():
+        print(f"Dataset {dataset}: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    if dry_run:
+        print("Dry run, no files were modified.")
+    return summary
+
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="Assigns attributes to HDF5 files within specific dataset directories, with directory-level confirmation.")
     parser.add_argument("directory", help="Path to the specific parent directory to process, e.g., images/water")
+    parser.add_argument("--bulk", action="store_true", help="Use a worker pool and only rewrite files whose attributes differ")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --bulk (default: available CPUs)")
+    parser.add_argument("--dry-run", action="store_true", help="With --bulk, only report how many files would change")
+    parser.add_argument("--yes", action="store_true", help="With --bulk, skip the confirmation prompt")
     args = parser.parse_args()
 
-    process_directory(args.directory)
\ No newline at end of file
+    if args.bulk:
+        bulk_process_directory(args.directory, workers=args.workers, dry_run=args.dry_run, assume_yes=args.yes)
+    else:
+        process_directory(args.directory)
\ No newline at end of file
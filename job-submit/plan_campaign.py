@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Throughput-aware planning for pattern_sim campaigns.
+Usage: python plan_campaign.py record <dir> [<dir> ...]
+       python plan_campaign.py rates
+       python plan_campaign.py plan campaign.json [--dry-run]
+       python plan_campaign.py replan <campaign dir> [--watch SECONDS] [--dry-run]
+"""
+
+import os
+import re
+import sys
+import time
+import sqlite3
+import statistics
+import argparse
+import subprocess
+from collections import defaultdict
+from submit_campaign import (load_config, parse_partitions, assign_tasks, array_spec, n_tasks,
+                             submit, load_manifest, MANIFEST_NAME)
+
+HISTORY_DB = os.path.expanduser('~/.cache/pattern_sim/throughput.sqlite')
+HISTORY_WINDOW = 200   # most recent tasks per partition used for its rate
+REPLAN_GAIN = 0.1      # replan only if the expected makespan drops by at least this fraction
+TASK_LOG = re.compile(r'task (\d+) on (\S+) .*started (\d+)')
+TASK_DONE = re.compile(r'task \d+ finished (\d+)')
+SCRIPT_NUMBER = re.compile(r'--number=(\d+)')
+ACTIVE_STATES = {'PENDING', 'RUNNING', 'REQUEUED', 'RESIZING', 'SUSPENDED', 'COMPLETING', 'CONFIGURING'}
+ERROR_WORDS = re.compile(r'error|killed|cancelled|time limit|oom', re.I)
+
+def h5_outputs(directory):
+    """{output prefix: [mtime, ...]} of the pattern_sim files <prefix>-<n>.h5 in `directory`"""
+    outputs = defaultdict(list)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith('.h5') and '-' in entry.name:
+                outputs[entry.name.rsplit('-', 1)[0]].append(entry.stat().st_mtime)
+    return outputs
+
+def job_states(job_names):
+    """{job name: state} of the latest job with each name according to sacct ({} without sacct)"""
+    if not job_names:
+        return {}
+    try:
+        result = subprocess.run(['sacct', '-n', '-P', '-X', '-o', 'JobID,JobName,State', '--name', ','.join(sorted(job_names))],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+    latest = {}
+    for line in result.stdout.splitlines():
+        fields = line.split('|')
+        if len(fields) < 3 or fields[1] not in job_names or not fields[0].split('_')[0].isdigit():
+            continue
+        job_id = int(fields[0].split('_')[0])
+        if fields[1] not in latest or job_id > latest[fields[1]][0]:
+            latest[fields[1]] = (job_id, fields[2].split()[0])
+    return {name: state for name, (_, state) in latest.items()}
+
+def _script_ended(directory, job, patterns, states):
+    """Whether a master-submit job is over: all its patterns written, a terminal sacct state, or a fatal .err"""
+    script_path = os.path.join(directory, f"{job}.sh")
+    if os.path.exists(script_path):
+        with open(script_path, errors='replace') as f:
+            expected = SCRIPT_NUMBER.search(f.read())
+        if expected and patterns >= int(expected.group(1)):
+            return True
+    if job in states:
+        return states[job] not in ACTIVE_STATES
+    err_path = os.path.join(directory, f"{job}.err")
+    if os.path.exists(err_path):
+        with open(err_path, errors='replace') as f:
+            return bool(ERROR_WORDS.search(f.read()))
+    return False
+
+def scan_logs(directory):
+    """
+    One record per job log (<job>.out) in a campaign directory: job, partition, task,
+    output prefix, start, end, finished and the number of .h5 files written.
+
+    Array tasks of submit_campaign.py log their start and finish times; for logs of the
+    master-submit scripts (<name>_<step>_<partition>.out) the start is estimated from the
+    spacing of the output files and the end is the last write to the logs or outputs.
+    Those count as finished only once the job is known to have ended (see _script_ended),
+    since the last write of a running job is just its latest output.
+    """
+    outputs = h5_outputs(directory)
+    logs = sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.out'))
+    states = None  # sacct is only asked if there are master-submit logs
+    records = []
+    for job in logs:
+        out_path = os.path.join(directory, f"{job}.out")
+        with open(out_path, errors='replace') as f:
+            log = f.read()
+        started, done = TASK_LOG.search(log), TASK_DONE.search(log)
+        if started:
+            task, partition = int(started.group(1)), started.group(2)
+            campaign = job[:-len(f"_{task}")].rsplit('_', 1)[0]
+            prefix = f"{campaign}_{task}"
+            start = float(started.group(3))
+            end = float(done.group(1)) if done else None
+            finished = end is not None
+        else:
+            if states is None:
+                states = job_states({name for name in logs if not name.rsplit('_', 1)[-1].isdigit()})
+            task, partition, prefix = None, job.rsplit('_', 1)[-1], job
+            mtimes = sorted(outputs.get(prefix, []))
+            err_path = os.path.join(directory, f"{job}.err")
+            last_write = max([os.path.getmtime(out_path)] + mtimes +
+                             ([os.path.getmtime(err_path)] if os.path.exists(err_path) else []))
+            if len(mtimes) >= 2:
+                start = mtimes[0] - (mtimes[-1] - mtimes[0]) / (len(mtimes) - 1)
+            else:
+                start = None
+            end = last_write
+            finished = _script_ended(directory, job, len(mtimes), states)
+        records.append({'job': job, 'partition': partition, 'task': task, 'prefix': prefix,
+                        'start': start, 'end': end, 'finished': finished,
+                        'patterns': len(outputs.get(prefix, []))})
+    return records
+
+class History:
+    """
+    Per-task pattern throughput of earlier jobs, kept in a SQLite file shared by campaigns.
+    One row per job and directory, so recording a directory again only updates its rows.
+    """
+
+    def __init__(self, db_path=HISTORY_DB):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        with self.conn:
+            key = [row[1] for row in sorted(self.conn.execute("PRAGMA table_info(jobs)"), key=lambda row: row[5]) if row[5]]
+            if key == ['directory', 'job', 'start']:
+                # older databases keyed on the estimated start, which shifted as outputs landed;
+                # keep the latest row of each job
+                self.conn.execute("ALTER TABLE jobs RENAME TO jobs_old")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                directory TEXT, job TEXT, partition TEXT, patterns INTEGER, start REAL, end REAL,
+                PRIMARY KEY (directory, job))""")
+            if key == ['directory', 'job', 'start']:
+                self.conn.execute("INSERT OR REPLACE INTO jobs SELECT * FROM jobs_old ORDER BY end")
+                self.conn.execute("DROP TABLE jobs_old")
+
+    def record(self, directory):
+        """Add the finished jobs of a campaign directory, returns how many were usable"""
+        directory = os.path.abspath(directory)
+        rows = [(directory, r['job'], r['partition'], r['patterns'], r['start'], r['end'])
+                for r in scan_logs(directory)
+                if r['finished'] and r['start'] is not None and r['patterns'] and r['end'] > r['start']]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def rates(self, window=HISTORY_WINDOW):
+        """
+        {partition: (patterns per hour per job, peak concurrent jobs, jobs)} over the most
+        recent `window` jobs of each partition. Concurrency is the largest number of jobs
+        seen running at once on the partition within one directory.
+        """
+        rates = {}
+        partitions = [row[0] for row in self.conn.execute("SELECT DISTINCT partition FROM jobs")]
+        for partition in partitions:
+            rows = self.conn.execute(
+                "SELECT directory, patterns, start, end FROM jobs WHERE partition = ? ORDER BY end DESC LIMIT ?",
+                (partition, window)).fetchall()
+            patterns = sum(row[1] for row in rows)
+            seconds = sum(row[3] - row[2] for row in rows)
+            by_directory = defaultdict(list)
+            for directory, _, start, end in rows:
+                by_directory[directory] += [(start, 1), (end, -1)]
+            concurrency = 0
+            for events in by_directory.values():
+                running = 0
+                for _, step in sorted(events):
+                    running += step
+                    concurrency = max(concurrency, running)
+            rates[partition] = (patterns / seconds * 3600, concurrency, len(rows))
+        return rates
+
+def partition_weights(partitions, rates, throttle):
+    """
+    Expected patterns per hour of each partition: per-job rate times the jobs it can run
+    at once (the array throttle, or fewer if history never saw that many). A partition
+    without history gets the median of the measured partitions' throughput, so it is not
+    favoured over them; with no history at all the core counts are used.
+    """
+    weights = {partition: rates[partition][0] * min(throttle, max(rates[partition][1], 1))
+               for partition in partitions if partition in rates}
+    if not weights:
+        return dict(partitions)
+    median = statistics.median(weights.values())
+    return {partition: weights.get(partition, median) for partition in partitions}
+
+def balance(task_ids, weights, load=None):
+    """
+    Give each task to the partition that would finish it first, so all shards are
+    expected to end together. `load` is work (in tasks) already queued per partition.
+    Returns {partition: [task ids]} and the expected makespan in task units per weight.
+    """
+    load = dict(load or {})
+    assignment = defaultdict(list)
+    for task_id in task_ids:
+        partition = min(weights, key=lambda p: (load.get(p, 0) + 1) / weights[p])
+        load[partition] = load.get(partition, 0) + 1
+        assignment[partition].append(task_id)
+    makespan = max((load[p] / weights[p] for p in load if p in weights and load[p]), default=0)
+    return dict(assignment), makespan
+
+def print_plan(assignment, weights, per_task):
+    for partition, task_ids in assignment.items():
+        hours = len(task_ids) * per_task / weights[partition]
+        print(f"  {partition:<12}{len(task_ids):>6} tasks{len(task_ids) * per_task:>9} patterns"
+              f"{weights[partition]:>10.1f} patterns/h  ~{hours:.1f} h")
+
+def array_states(job_ids):
+    """{(job id, task id): state} of the queued or running array tasks of the given jobs"""
+    job_ids = [job_id for job_id in job_ids if job_id]
+    if not job_ids:
+        return {}
+    try:
+        result = subprocess.run(['squeue', '-h', '-r', '-j', ','.join(job_ids), '-o', '%i %T'],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Warning: could not query squeue: {e}", file=sys.stderr)
+        return {}
+    states = {}
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and '_' in parts[0]:
+            job_id, task = parts[0].split('_', 1)
+            if task.isdigit():
+                states[(job_id, int(task))] = parts[1]
+    return states
+
+def replan(workdir, history, dry_run=False):
+    """
+    Move the still-pending array tasks of a campaign so that every partition is expected
+    to finish at the same time, given current throughput and the tasks already running.
+    Moved tasks are cancelled and resubmitted; the manifest entry appended last is the
+    one a task now belongs to. Returns the number of pending tasks.
+    """
+    workdir = os.path.abspath(workdir)
+    manifest = load_manifest(workdir)
+    config = manifest['config']
+    history.record(workdir)
+    weights = partition_weights(parse_partitions(config['partitions']), history.rates(), config['array_throttle'])
+
+    states = array_states([s['job_id'] for s in manifest['submissions']])
+    pending, load = defaultdict(list), defaultdict(float)
+    for submission in manifest['submissions']:
+        for task_id in submission['tasks']:
+            state = states.get((submission['job_id'], task_id))
+            if state == 'PENDING':
+                pending[submission['partition']].append((submission['job_id'], task_id))
+            elif state is not None:
+                load[submission['partition']] += 0.5  # a running task is on average half done
+    if not pending:
+        print("No pending tasks to re-plan.")
+        return 0
+
+    current_load = dict(load)
+    for partition, tasks in pending.items():
+        current_load[partition] = current_load.get(partition, 0) + len(tasks)
+    current = max(current_load[p] / weights[p] for p in current_load if p in weights)
+    task_ids = sorted(task_id for tasks in pending.values() for _, task_id in tasks)
+    assignment, makespan = balance(task_ids, weights, load)
+    per_task = config['patterns_per_task']
+    print(f"{len(task_ids)} pending tasks: expected {current * per_task:.1f} h as queued, "
+          f"{makespan * per_task:.1f} h re-planned")
+    if makespan > current * (1 - REPLAN_GAIN):
+        print("Current split is close enough, nothing moved.")
+        return len(task_ids)
+
+    # keep as many pending tasks in place as the new split allows, move only the surplus
+    quota = {partition: len(ids) for partition, ids in assignment.items()}
+    surplus = []
+    for partition, tasks in pending.items():
+        keep = quota.get(partition, 0)
+        quota[partition] = max(keep - len(tasks), 0)
+        surplus += tasks[keep:]
+    moves = defaultdict(list)
+    for _, task_id in surplus:
+        partition = next(p for p, n in quota.items() if n > 0)
+        quota[partition] -= 1
+        moves[partition].append(task_id)
+    by_job = defaultdict(list)
+    for job_id, task_id in surplus:
+        by_job[job_id].append(task_id)
+    for job_id, ids in by_job.items():
+        cmd = ['scancel', f"{job_id}_[{array_spec(ids)}]"]
+        print(' '.join(cmd))
+        if not dry_run:
+            subprocess.run(cmd, check=True)
+    print_plan(assignment, weights, per_task)
+    submit(config, dict(moves), dry_run=dry_run, workdir=workdir)
+    return len(task_ids)
+
+def main():
+    parser = argparse.ArgumentParser(description='Split pattern_sim campaigns by measured partition throughput')
+    sub = parser.add_subparsers(dest='command', required=True)
+    record_parser = sub.add_parser('record', help='Add finished jobs of campaign directories to the history')
+    record_parser.add_argument('directories', nargs='+')
+    sub.add_parser('rates', help='Show the measured throughput per partition')
+    plan_parser = sub.add_parser('plan', help='Submit a campaign split by expected throughput')
+    plan_parser.add_argument('config', nargs='?', help='JSON campaign config, as for submit_campaign.py')
+    plan_parser.add_argument('--dry-run', action='store_true')
+    replan_parser = sub.add_parser('replan', help='Move pending tasks of a running campaign')
+    replan_parser.add_argument('workdir', help=f'Campaign directory (with {MANIFEST_NAME})')
+    replan_parser.add_argument('--watch', type=int, default=None, metavar='SECONDS',
+                               help='Re-plan every SECONDS until no tasks are pending')
+    replan_parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--history', default=HISTORY_DB, help=f'History database (default: {HISTORY_DB})')
+    args = parser.parse_args()
+
+    history = History(args.history)
+    if args.command == 'record':
+        for directory in args.directories:
+            print(f"{directory}: {history.record(directory)} finished jobs recorded")
+    elif args.command == 'rates':
+        for partition, (rate, concurrency, jobs) in sorted(history.rates().items()):
+            print(f"{partition:<12}{rate:>10.1f} patterns/h per job  {concurrency:>4} at once  ({jobs} jobs)")
+    elif args.command == 'plan':
+        config = load_config(args.config)
+        rates = history.rates()
+        weights = partition_weights(parse_partitions(config['partitions']), rates, config['array_throttle'])
+        assignment = assign_tasks(list(range(n_tasks(config))), weights)
+        if rates:
+            print_plan(assignment, weights, config['patterns_per_task'])
+        else:
+            print("No throughput history yet, splitting by core count.")
+        submit(config, assignment, dry_run=args.dry_run)
+    else:
+        while replan(args.workdir, history, args.dry_run) and args.watch:
+            time.sleep(args.watch)
+
+if __name__ == "__main__":
+    main()
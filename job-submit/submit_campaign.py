@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Submit a pattern_sim campaign as one Slurm job array per partition.
+Usage: python submit_campaign.py campaign.json [--dry-run]
+       python submit_campaign.py --example > campaign.json
+"""
+
+import os
+import sys
+import json
+import math
+import argparse
+import subprocess
+from datetime import datetime
+
+# Same pattern_sim settings as master-submit-search.sh
+DEFAULT_CONFIG = {
+    'name': 'campaign',
+    'photon_energy': 7000,
+    'total_patterns': 10000,
+    'patterns_per_task': 100,
+    'array_throttle': 50,        # array tasks running at once per partition (%N)
+    'max_array_index': 1000,     # Slurm MaxArraySize - 1 on the cluster
+    'cpus_per_task': 1,
+    'geom': 'Eiger4M.geom',
+    'crystal': '1IC6.cell',
+    'input': '1IC6.pdb.hkl',
+    'point_group': '4/mmm',
+    'crystal_size_min': 1000,
+    'crystal_size_max': 1000,
+    'spectrum': 'tophat',
+    'sampling': 7,
+    'bandwidth': 0.01,
+    'n_photons': 3e8,
+    'beam_radius': 5e-6,
+    'extra_args': [],            # e.g. ["--really-random"] so array tasks do not repeat orientations
+    'partitions': ['rcgpu7:13', 'publicgpu:15', 'htc:6', 'wildfire:19', 'gpu:20', 'htcgpu:8'],
+}
+
+MANIFEST_NAME = 'campaign.json'
+
+def load_config(path=None, **overrides):
+    """Defaults, updated from a JSON file and then from non-None keyword overrides"""
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        with open(path) as f:
+            config.update(json.load(f))
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
+
+def parse_partitions(partitions):
+    """
+    Partition weights from 'name:cores' strings (or a {name: cores} dict), in order of
+    first appearance. Duplicates are merged, keeping the largest core count.
+    """
+    items = partitions.items() if isinstance(partitions, dict) else (
+        (p.split(':')[0], int(p.split(':')[1]) if ':' in p else 1) for p in partitions)
+    merged = {}
+    for name, cores in items:
+        merged[name] = max(merged.get(name, 0), int(cores))
+    return merged
+
+def job_settings(partition):
+    """Time limit and QOS per partition, as in the shell submitters"""
+    if partition.startswith('htc'):
+        return '4:00:00', 'normal'
+    return '0-60:00', 'wildfire'
+
+def assign_tasks(task_ids, weights):
+    """Split task IDs into contiguous runs per partition, proportional to the weights"""
+    total = sum(weights.values())
+    names = list(weights)
+    # largest remainder method so the shares add up exactly
+    shares = {name: len(task_ids) * weights[name] / total for name in names}
+    counts = {name: int(shares[name]) for name in names}
+    for name in sorted(names, key=lambda n: shares[n] - counts[n], reverse=True)[:len(task_ids) - sum(counts.values())]:
+        counts[name] += 1
+    assignment, start = {}, 0
+    for name in names:
+        if counts[name]:
+            assignment[name] = task_ids[start:start + counts[name]]
+            start += counts[name]
+    return assignment
+
+def array_spec(task_ids, throttle=None):
+    """Compact --array value, e.g. [0, 1, 2, 5] -> '0-2,5%50'"""
+    ranges, ids = [], sorted(task_ids)
+    start = prev = ids[0]
+    for task_id in ids[1:] + [None]:
+        if task_id is not None and task_id == prev + 1:
+            prev = task_id
+            continue
+        ranges.append(f"{start}-{prev}" if prev > start else f"{start}")
+        if task_id is not None:
+            start = prev = task_id
+    return ','.join(ranges) + (f"%{throttle}" if throttle else '')
+
+def n_tasks(config):
+    return math.ceil(config['total_patterns'] / config['patterns_per_task'])
+
+def render_script(config):
+    """
+    The one batch script shared by every array job of the campaign. Each array task
+    simulates its slice of the patterns with output prefix <name>_<task id>; partition,
+    QOS, time limit and array range are given on the sbatch command line.
+    """
+    c = {key: format(value, 'g') if isinstance(value, float) else value for key, value in config.items()}
+    command = ' '.join([
+        'pattern_sim', f"-g {c['geom']}", f"-p {c['crystal']}", '--number=$COUNT', f"-o {c['name']}_$TASK",
+        f"-i {c['input']}", '-r', f"-y {c['point_group']}", f"--min-size={c['crystal_size_min']}",
+        f"--max-size={c['crystal_size_max']}", f"--spectrum={c['spectrum']}", f"-s {c['sampling']}",
+        '--background=0', f"--beam-bandwidth={c['bandwidth']}", f"--photon-energy={c['photon_energy']}",
+        f"--nphotons={c['n_photons']}", f"--beam-radius={c['beam_radius']}", *c['extra_args']])
+    return f"""#!/bin/sh
+
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task={c['cpus_per_task']}
+#SBATCH --output=%x_%a.out
+#SBATCH --error=%x_%a.err
+
+TASK=$SLURM_ARRAY_TASK_ID
+TOTAL={c['total_patterns']}
+PER_TASK={c['patterns_per_task']}
+START=$((TASK * PER_TASK))
+COUNT=$((TOTAL - START < PER_TASK ? TOTAL - START : PER_TASK))
+
+echo "task $TASK on $SLURM_JOB_PARTITION ($(hostname)): $COUNT patterns, started $(date +%s)"
+{command}
+echo "task $TASK finished $(date +%s)"
+"""
+
+def setup_directory(config):
+    """Campaign directory with links to the shared input files, like setup_directory in the shell scripts"""
+    os.makedirs(config['name'], exist_ok=True)
+    for key in ('geom', 'crystal', 'input'):
+        link = os.path.join(config['name'], config[key])
+        if not os.path.lexists(link):
+            os.symlink(os.path.join('..', config[key]), link)
+    return os.path.abspath(config['name'])
+
+def running_jobs(prefix):
+    """Names of this user's queued or running jobs starting with `prefix`"""
+    try:
+        result = subprocess.run(['squeue', '-h', '-u', os.environ.get('USER', ''), '-o', '%j'],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Warning: could not query squeue: {e}", file=sys.stderr)
+        return set()
+    return {name for name in result.stdout.split() if name.startswith(prefix)}
+
+def sbatch_array(script_path, workdir, job_name, partition, task_ids, throttle, dry_run=False):
+    """Submit one array job, returns the job ID (None for a dry run)"""
+    time_limit, qos = job_settings(partition)
+    cmd = ['sbatch', '--parsable', f'--job-name={job_name}', f'--partition={partition}', f'--qos={qos}',
+           f'--time={time_limit}', f'--chdir={workdir}', f'--array={array_spec(task_ids, throttle)}', script_path]
+    print(' '.join(cmd))
+    if dry_run:
+        return None
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"sbatch failed for {partition}: {result.stderr.strip()}")
+    return result.stdout.strip().split(';')[0]
+
+def load_manifest(workdir):
+    with open(os.path.join(workdir, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+def save_manifest(workdir, manifest):
+    path = os.path.join(workdir, MANIFEST_NAME)
+    with open(f"{path}.part", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.part", path)
+
+def submit(config, assignment, dry_run=False, workdir=None):
+    """
+    Submit one array job per partition for the given {partition: [task ids]} and record
+    them in the campaign manifest (<name>/campaign.json), which later submissions append to.
+    """
+    workdir = workdir or setup_directory(config)
+    script_path = os.path.join(workdir, f"{config['name']}_array.sh")
+    with open(script_path, 'w') as f:
+        f.write(render_script(config))
+
+    manifest_path = os.path.join(workdir, MANIFEST_NAME)
+    manifest = load_manifest(workdir) if os.path.exists(manifest_path) else {'config': config, 'submissions': []}
+    for partition, task_ids in assignment.items():
+        if max(task_ids) > config['max_array_index']:
+            raise ValueError(f"Task ID {max(task_ids)} exceeds max_array_index {config['max_array_index']}, "
+                             f"raise patterns_per_task")
+        job_id = sbatch_array(script_path, workdir, f"{config['name']}_{partition}", partition, task_ids,
+                              config['array_throttle'], dry_run)
+        manifest['submissions'].append({'job_id': job_id, 'partition': partition, 'tasks': task_ids,
+                                        'submitted': datetime.now().isoformat(timespec='seconds')})
+    if not dry_run:
+        save_manifest(workdir, manifest)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description='Submit a pattern_sim campaign as Slurm job arrays')
+    parser.add_argument('config', nargs='?', help='JSON campaign config (keys as in --example)')
+    parser.add_argument('--name', help='Campaign name, overrides the config')
+    parser.add_argument('--photon-energy', type=float, help='Photon energy in eV, overrides the config')
+    parser.add_argument('--dry-run', action='store_true', help='Print the sbatch commands without submitting')
+    parser.add_argument('--force', action='store_true', help='Submit even if jobs of this campaign are queued')
+    parser.add_argument('--example', action='store_true', help='Print the default config and exit')
+    args = parser.parse_args()
+
+    if args.example:
+        print(json.dumps(DEFAULT_CONFIG, indent=2))
+        return
+    config = load_config(args.config, name=args.name, photon_energy=args.photon_energy)
+
+    queued = running_jobs(f"{config['name']}_")
+    if queued and not args.force and not args.dry_run:
+        print(f"Jobs of campaign '{config['name']}' are already queued ({', '.join(sorted(queued))}); "
+              f"use --force to submit anyway.")
+        sys.exit(1)
+
+    weights = parse_partitions(config['partitions'])
+    assignment = assign_tasks(list(range(n_tasks(config))), weights)
+    manifest = submit(config, assignment, dry_run=args.dry_run)
+    print(f"{'Would submit' if args.dry_run else 'Submitted'} {n_tasks(config)} tasks "
+          f"({config['total_patterns']} patterns) as {len(assignment)} array jobs "
+          f"on {', '.join(assignment)}; {len(manifest['submissions'])} submissions in the manifest.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Track completion of a pattern_sim campaign and resubmit only the gaps.
+Usage: python track_campaign.py <campaign dir> [--resubmit] [--dry-run] [--verbose]
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+from collections import Counter, defaultdict
+from datetime import datetime
+from submit_campaign import (parse_partitions, assign_tasks, submit, load_manifest, MANIFEST_NAME)
+from plan_campaign import History, h5_outputs, partition_weights, TASK_LOG, TASK_DONE, ACTIVE_STATES, ERROR_WORDS
+
+STATUSES = ['complete', 'running', 'failed', 'missing_output', 'unsubmitted']
+SCRIPT_FIELDS = {
+    'job': re.compile(r'^#SBATCH --job-name[= ]\s*(\S+)', re.M),
+    'partition': re.compile(r'^#SBATCH --partition[= ]\s*(\S+)', re.M),
+    'expected': re.compile(r'--number=(\d+)'),
+    'prefix': re.compile(r'pattern_sim .*?-o (\S+)'),
+}
+
+def script_steps(directory):
+    """Steps written by the master-submit scripts: one <job>.sh per job with its pattern_sim line"""
+    steps = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.sh'):
+            continue
+        with open(os.path.join(directory, name), errors='replace') as f:
+            text = f.read()
+        fields = {key: pattern.search(text) for key, pattern in SCRIPT_FIELDS.items()}
+        if not all(fields.values()) or not fields['expected'].group(1).isdigit():
+            continue  # not a single-job pattern_sim script (e.g. the array script)
+        job = fields['job'].group(1)
+        steps[job] = {'step': job, 'job': job, 'partition': fields['partition'].group(1),
+                      'prefix': fields['prefix'].group(1), 'expected': int(fields['expected'].group(1)),
+                      'script': os.path.join(directory, name)}
+    return steps
+
+def array_steps(manifest):
+    """Steps of a submit_campaign.py campaign: one per array task, owned by its latest submission"""
+    config = manifest['config']
+    steps = {}
+    for submission in manifest['submissions']:
+        for task_id in submission['tasks']:
+            steps[task_id] = {
+                'step': task_id, 'job': f"{config['name']}_{submission['partition']}",
+                'job_id': submission['job_id'], 'partition': submission['partition'],
+                'prefix': f"{config['name']}_{task_id}",
+                'expected': min(config['patterns_per_task'], config['total_patterns'] - task_id * config['patterns_per_task'])}
+    return steps
+
+def _expand_array(spec):
+    """Task IDs of an array spec as sacct/squeue print it, e.g. '[3-5,9%2]' -> [3, 4, 5, 9]"""
+    ids = []
+    for part in spec.strip('[]').split('%')[0].split(','):
+        lo, _, hi = part.partition('-')
+        if lo.isdigit():
+            ids += range(int(lo), int(hi or lo) + 1)
+    return ids
+
+def scheduler_states(job_names, since):
+    """
+    {(job name, task id or None): (job id, state)} of the latest job per step, from sacct
+    when it is available and squeue (queued and running jobs only) otherwise. None if
+    neither could be queried.
+    """
+    try:
+        result = subprocess.run(['sacct', '-n', '-P', '-X', '-o', 'JobID,JobName,State',
+                                 '-S', since.strftime('%Y-%m-%dT%H:%M:%S'), '--name', ','.join(sorted(job_names))],
+                                capture_output=True, text=True, check=True)
+        lines = [line.split('|') for line in result.stdout.splitlines()]
+    except (OSError, subprocess.CalledProcessError):
+        try:
+            result = subprocess.run(['squeue', '-h', '-u', os.environ.get('USER', ''), '-o', '%i|%j|%T'],
+                                    capture_output=True, text=True, check=True)
+            lines = [line.split('|') for line in result.stdout.splitlines()]
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Warning: neither sacct nor squeue could be queried: {e}", file=sys.stderr)
+            return None
+    states = {}
+    for fields in lines:
+        if len(fields) < 3 or fields[1] not in job_names:
+            continue
+        job_id, _, task = fields[0].partition('_')
+        state = fields[2].split()[0]  # 'CANCELLED by 123' -> 'CANCELLED'
+        for task_id in (_expand_array(task) if task else [None]):
+            key = (fields[1], task_id)
+            if key not in states or int(job_id) > int(states[key][0]):
+                states[key] = (job_id, state)
+    return states
+
+def classify(step, outputs, log_dir, states):
+    """Status of one step from its output count, scheduler state and logs"""
+    produced = len(outputs.get(step['prefix'], []))
+    step['produced'] = produced
+    if produced >= step['expected']:
+        return 'complete'
+    task_id = step['step'] if isinstance(step['step'], int) else None
+    _, state = states.get((step['job'], task_id), (None, None))
+    if state in ACTIVE_STATES:
+        return 'running'
+    log = f"{step['job']}_{task_id}" if task_id is not None else step['job']
+    out_path, err_path = (os.path.join(log_dir, f"{log}.{ext}") for ext in ('out', 'err'))
+    if state is not None:
+        return 'missing_output' if state == 'COMPLETED' else 'failed'
+    if not os.path.exists(out_path) and not os.path.exists(err_path):
+        return 'unsubmitted'
+    if os.path.exists(out_path) and task_id is not None:
+        with open(out_path, errors='replace') as f:
+            log_text = f.read()
+        if TASK_LOG.search(log_text) and not TASK_DONE.search(log_text):
+            return 'running'  # started, not finished, and no scheduler record to say otherwise
+    if os.path.exists(err_path):
+        with open(err_path, errors='replace') as f:
+            if ERROR_WORDS.search(f.read()):
+                return 'failed'
+    return 'missing_output'
+
+def campaign_start(directory, manifest, steps):
+    """
+    Lower bound of the sacct query: the first submission recorded in the manifest, or
+    else the oldest job script (written just before its sbatch call) or log. lstat keeps
+    symlinked inputs, which can be years old, out of it.
+    """
+    submitted = [submission['submitted'] for submission in (manifest or {}).get('submissions', [])
+                 if submission.get('submitted')]
+    if submitted:
+        return min(datetime.fromisoformat(timestamp) for timestamp in submitted)
+    paths = [step['script'] for step in steps.values() if 'script' in step] or \
+            [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(('.sh', '.out', '.err'))]
+    return datetime.fromtimestamp(min(os.lstat(path).st_mtime for path in paths))
+
+def track(directory):
+    """
+    All steps of a campaign directory with their status, and whether the scheduler could
+    be queried. Without it, queued steps that have not written logs yet look unsubmitted.
+    """
+    directory = os.path.abspath(directory)
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    manifest = load_manifest(directory) if os.path.exists(manifest_path) else None
+    steps = array_steps(manifest) if manifest else script_steps(directory)
+    if not steps:
+        return manifest, [], True
+    since = campaign_start(directory, manifest, steps)
+    states = scheduler_states({step['job'] for step in steps.values()}, since)
+    outputs = h5_outputs(directory)
+    for step in steps.values():
+        step['status'] = classify(step, outputs, directory, states or {})
+    return manifest, list(steps.values()), states is not None
+
+def print_summary(steps, verbose=False):
+    counts = Counter(step['status'] for step in steps)
+    produced = sum(min(step['produced'], step['expected']) for step in steps)
+    expected = sum(step['expected'] for step in steps)
+    print(f"{len(steps)} steps, {produced}/{expected} patterns ({100 * produced / max(expected, 1):.1f}%): "
+          + ', '.join(f"{counts[status]} {status}" for status in STATUSES if counts[status]))
+    by_partition = defaultdict(Counter)
+    for step in steps:
+        by_partition[step['partition']][step['status']] += 1
+    for partition, partition_counts in sorted(by_partition.items()):
+        print(f"  {partition:<12}" + '  '.join(f"{status} {partition_counts[status]}"
+                                               for status in STATUSES if partition_counts[status]))
+    if verbose:
+        for step in steps:
+            if step['status'] != 'complete':
+                print(f"  {step['step']!s:<24}{step['status']:<16}{step['produced']}/{step['expected']}")
+
+def resubmit(directory, manifest, gaps, dry_run=False):
+    """Resubmit failed, incomplete and unsubmitted steps and nothing else"""
+    if manifest:
+        config = manifest['config']
+        weights = partition_weights(parse_partitions(config['partitions']), History().rates(),
+                                    config['array_throttle'])
+        submit(config, assign_tasks(sorted(step['step'] for step in gaps), weights),
+               dry_run=dry_run, workdir=os.path.abspath(directory))
+        return
+    for step in gaps:
+        cmd = ['sbatch', step['script']]
+        print(' '.join(cmd))
+        if not dry_run:
+            subprocess.run(cmd, cwd=directory, check=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Show which steps of a pattern_sim campaign are done and rerun the rest')
+    parser.add_argument('directory', help='Campaign directory (master-submit scripts or a submit_campaign.py manifest)')
+    parser.add_argument('--resubmit', action='store_true', help='Resubmit failed, incomplete and unsubmitted steps')
+    parser.add_argument('--dry-run', action='store_true', help='Print what would be resubmitted')
+    parser.add_argument('--verbose', action='store_true', help='List every step that is not complete')
+    args = parser.parse_args()
+
+    manifest, steps, scheduler_known = track(args.directory)
+    if not steps:
+        print(f"No pattern_sim steps found in {args.directory}")
+        sys.exit(1)
+    print_summary(steps, args.verbose)
+    gaps = [step for step in steps if step['status'] in ('failed', 'missing_output', 'unsubmitted')]
+    if gaps and (args.resubmit or args.dry_run) and not scheduler_known:
+        print("Not resubmitting: neither sacct nor squeue answered, so queued or running steps "
+              "cannot be told apart from unsubmitted or failed ones.")
+        sys.exit(1)
+    if gaps and (args.resubmit or args.dry_run):
+        print(f"Resubmitting {len(gaps)} steps ({sum(step['expected'] - step['produced'] for step in gaps)} patterns missing)")
+        resubmit(args.directory, manifest, gaps, args.dry_run)
+
+if __name__ == "__main__":
+    main()
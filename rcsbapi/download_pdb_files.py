@@ -1,44 +1,111 @@
-import requests
 import os
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from scrape import get_pdb_ids  # Import the function from scrape.py
+import fetch
+from mirror import DEFAULT_ROOT, PDBMirror
 
 class ProteinDownloader:
     """Class to download PDB files for specified proteins."""
     
-    def __init__(self, base_dir=None):
-        """Initialize ProteinDownloader class."""
-        self.base_dir = base_dir or os.getcwd()
+    def __init__(self, base_dir=None, max_workers=8, mirror=None):
+        """Initialize ProteinDownloader class.
 
-    def is_url_accessible(self, url):
-        """Check if a URL is accessible."""
-        response = requests.head(url)
-        return response.status_code == 200
+        With a PDBMirror, structures are copied from the local mirror and only misses
+        go to the network (and are then added to the mirror)."""
+        self.base_dir = base_dir or os.getcwd()
+        self.max_workers = max_workers
+        self.mirror = mirror
 
     def download_files(self, protein_ids, space_group):
-        """Download PDB files for specified proteins, organized by space group."""
+        """Download PDB files for specified proteins, organized by space group.
+
+        Files are fetched concurrently and existing ones are skipped; returns the
+        per-ID report from fetch.download_files."""
         formatted_space_group = space_group.replace(" ", "")  # remove spaces
         target_dir = os.path.join(self.base_dir, f"{formatted_space_group}/data/ids")
-        os.makedirs(target_dir, exist_ok=True)  # Create directory structure
-        
-        PDB_URL_TEMPLATE = "https://files.rcsb.org/download/{}.pdb"
         
-        for protein_id in protein_ids:
-            print(f"Processing Protein: {protein_id}, Space Group: {formatted_space_group}")
-            pdb_url = PDB_URL_TEMPLATE.format(protein_id)
-            
-            if self.is_url_accessible(pdb_url):
-                response = requests.get(pdb_url)
-                with open(os.path.join(target_dir, f"{protein_id}.pdb"), 'wb') as file:
-                    file.write(response.content)
-            else:
-                print(f"URL not accessible for Protein ID: {protein_id}")
+        print(f"Downloading {len(protein_ids)} proteins for Space Group: {formatted_space_group}")
+        if self.mirror is not None:
+            report = self.mirror.resolve(protein_ids, target_dir, space_group, max_workers=self.max_workers)
+        else:
+            report = fetch.download_files(protein_ids, target_dir, max_workers=self.max_workers)
+        fetch.print_report(report)
+        return report
+
+    def download_batch(self, ids_by_group):
+        """Download the union of several space groups' PDB IDs, each structure only once.
+
+        Unique IDs are fetched into <base_dir>/shared/data/ids and then hard-linked (or
+        symlinked across filesystems) into every <group>/data/ids directory they belong to.
+
+        Args:
+            ids_by_group (dict): Space group -> list of PDB IDs.
+
+        Returns:
+            dict: The per-ID download report for the unique IDs.
+        """
+        store_dir = os.path.join(self.base_dir, "shared/data/ids")
+        unique_ids = list(dict.fromkeys(protein_id for ids in ids_by_group.values() for protein_id in ids))
+        total = sum(len(ids) for ids in ids_by_group.values())
+        print(f"Downloading {len(unique_ids)} unique proteins for {len(ids_by_group)} space groups "
+              f"({total - len(unique_ids)} duplicates across groups skipped)")
+        if self.mirror is not None:
+            report = self.mirror.resolve(unique_ids, store_dir, max_workers=self.max_workers)
+        else:
+            report = fetch.download_files(unique_ids, store_dir, max_workers=self.max_workers)
+        fetch.print_report(report)
+
+        for space_group, protein_ids in ids_by_group.items():
+            target_dir = os.path.join(self.base_dir, f"{space_group.replace(' ', '')}/data/ids")
+            os.makedirs(target_dir, exist_ok=True)
+            for protein_id in protein_ids:
+                if report[protein_id]['status'] == 'failed':
+                    continue
+                link_file(report[protein_id]['path'], os.path.join(target_dir, f"{protein_id}.pdb"))
+                if self.mirror is not None:
+                    self.mirror.tag(protein_id, space_group, commit=False)
+        if self.mirror is not None:
+            self.mirror.conn.commit()
+        return report
+
+def link_file(src, dest):
+    """Hard-link `src` to `dest`, falling back to a symlink across filesystems."""
+    if os.path.lexists(dest):
+        return
+    try:
+        os.link(src, dest)
+    except OSError:
+        os.symlink(os.path.abspath(src), dest)
+
+def search_space_groups(space_groups, str_type, limit, max_workers=8):
+    """Run the RCSB searches for several space groups concurrently.
+
+    Returns:
+        dict: Space group -> list of PDB IDs, in the order given; failed searches are
+              reported and left out.
+    """
+    ids_by_group = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {sg: executor.submit(get_pdb_ids, sg, str_type, limit) for sg in space_groups}
+        for sg, future in futures.items():
+            try:
+                ids_by_group[sg] = future.result()
+            except Exception as e:
+                print(f"Search failed for space group '{sg}': {e}")
+    return ids_by_group
                 
 def main():
     parser = argparse.ArgumentParser(description='Download PDB files based on space group and symmetry.')
-    parser.add_argument('symmetry_shape', type=str, help='Crystal symmetry to list space groups for')
+    parser.add_argument('symmetry_shape', type=str, help='Crystal symmetry to list space groups for (comma-separated for --batch, e.g. hexagonal,trigonal)')
+    parser.add_argument('--batch', action='store_true', help='Non-interactive: download every space group of the symmetry shape(s)')
+    parser.add_argument('--space-groups', type=str, nargs='+', default=None, help='Non-interactive: download only these space groups, e.g. "P 21 21 21" "P 1"')
+    parser.add_argument('--search-workers', type=int, default=8, help='Maximum number of concurrent searches in batch mode (default: 8)')
     parser.add_argument('--limit', type=int, default=50, help='Limit number of PDB files to download')
     parser.add_argument('--base_dir', type=str, default=os.getcwd(), help='Base directory to save PDB files to')    
+    parser.add_argument('--workers', type=int, default=8, help='Maximum number of concurrent downloads (default: 8)')
+    parser.add_argument('--mirror', type=str, default=DEFAULT_ROOT, help='Local PDB mirror to resolve through (default: $PDB_MIRROR or ~/.pdb_mirror)')
+    parser.add_argument('--no-mirror', action='store_true', help='Always download from RCSB, bypassing the local mirror')
     args = parser.parse_args()
     
     space_groups = {
@@ -52,7 +119,22 @@ def main():
         "triclinic": ["P 1", "P -1", "P 1 1 2", "P 1 1 21", "P 1 21 1", "P 21 1 1", "P 1 21 21", "P 21 1 21", "P 21 21 1", "P 1 1 2 1", "P 1 1 21 1", "P 1 21 1 1", "P 21 1 1 1", "P 1 21 21 1", "P 21 1 21 1", "P 21 21 1 1", "P 1 1 2 1 1", "P 1 1 21 1 1", "P 1 21 1 1 1", "P 21 1 1 1 1", "P 1 21 21 1 1", "P 21 1 21 1 1", "P 21 21 1 1 1"],
     } 
     
-    if args.symmetry_shape in space_groups:
+    if args.batch or args.space_groups:
+        shapes = [shape.strip() for shape in args.symmetry_shape.split(',')]
+        unknown = [shape for shape in shapes if shape not in space_groups]
+        if unknown:
+            print(f"Invalid symmetry shape(s) {', '.join(unknown)}. Available options are: {', '.join(space_groups.keys())}")
+            return
+        # the tables overlap (e.g. hexagonal/trigonal), so each group is searched once
+        selected = args.space_groups or [sg for shape in shapes for sg in space_groups[shape]]
+        selected = list(dict.fromkeys(selected))
+        print(f"Retrieving up to {args.limit} PDB IDs for each of {len(selected)} space groups...")
+        ids_by_group = search_space_groups(selected, shapes[0], args.limit, args.search_workers)
+
+        mirror = None if args.no_mirror else PDBMirror(args.mirror)
+        downloader = ProteinDownloader(args.base_dir, max_workers=args.workers, mirror=mirror)
+        downloader.download_batch(ids_by_group)
+    elif args.symmetry_shape in space_groups:
         print(f"Select a space group for symmetry shape '{args.symmetry_shape}':")
         for idx, sg in enumerate(space_groups[args.symmetry_shape], 1):
             print(f"{idx}. {sg}")
@@ -65,7 +147,8 @@ def main():
             
             pdb_ids = get_pdb_ids(selected_space_group, args.symmetry_shape, args.limit)
             
-            downloader = ProteinDownloader(args.base_dir)
+            mirror = None if args.no_mirror else PDBMirror(args.mirror)
+            downloader = ProteinDownloader(args.base_dir, max_workers=args.workers, mirror=mirror)
             downloader.download_files(pdb_ids, selected_space_group)
         else:
             print("Invalid choice. Please run the script again and select a valid number.")
@@ -0,0 +1,83 @@
+import os
+import requests
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+PDB_URL_TEMPLATE = "https://files.rcsb.org/download/{}.pdb"
+
+def make_session(max_workers=8, retries=3, backoff=0.5):
+    """Create a requests session whose connection pool is shared by all download threads.
+
+    Failed connections and 429/5xx responses are retried with exponential backoff.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET']))
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def fetch_file(session, protein_id, target_dir, url_template=PDB_URL_TEMPLATE, timeout=30, overwrite=False):
+    """Download one PDB file with a single GET (no separate HEAD request).
+
+    The file is written to a temporary name and renamed into place, so an interrupted
+    run never leaves a truncated .pdb that would be skipped next time.
+
+    Returns:
+        dict: {'id', 'status' ('downloaded', 'skipped' or 'failed'), 'path', 'error'}
+    """
+    output_file = os.path.join(target_dir, f"{protein_id}.pdb")
+    if not overwrite and os.path.isfile(output_file) and os.path.getsize(output_file) > 0:
+        return {'id': protein_id, 'status': 'skipped', 'path': output_file, 'error': None}
+
+    try:
+        response = session.get(url_template.format(protein_id), timeout=timeout)
+        if response.status_code != 200:
+            return {'id': protein_id, 'status': 'failed', 'path': None,
+                    'error': f"HTTP {response.status_code}"}
+        tmp_file = f"{output_file}.part"
+        with open(tmp_file, 'wb') as file:
+            file.write(response.content)
+        os.replace(tmp_file, output_file)
+        return {'id': protein_id, 'status': 'downloaded', 'path': output_file, 'error': None}
+    except (requests.RequestException, OSError) as e:
+        return {'id': protein_id, 'status': 'failed', 'path': None, 'error': str(e)}
+
+def download_files(protein_ids, target_dir, url_template=PDB_URL_TEMPLATE, max_workers=8, retries=3,
+                   backoff=0.5, timeout=30, overwrite=False):
+    """Download many PDB files concurrently over one pooled session.
+
+    Args:
+        protein_ids (list): PDB IDs to fetch; duplicates are fetched once.
+        target_dir (str): Directory to save <id>.pdb files in (created if needed).
+        url_template (str): URL with one {} placeholder for the ID, e.g. a local test server.
+        max_workers (int): Maximum number of concurrent requests.
+        retries (int): Retries per file for connection errors and 429/5xx responses.
+        backoff (float): Backoff factor between retries, in seconds.
+        timeout (float): Per-request timeout in seconds.
+        overwrite (bool): Download again even if the file already exists.
+
+    Returns:
+        dict: Report per ID, in input order, as returned by `fetch_file`.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    protein_ids = list(dict.fromkeys(protein_ids))
+    with make_session(max_workers, retries, backoff) as session, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda protein_id: fetch_file(session, protein_id, target_dir, url_template, timeout, overwrite),
+            protein_ids)
+        return {result['id']: result for result in results}
+
+def print_report(report):
+    """Print a one-line summary plus the IDs that failed."""
+    counts = Counter(result['status'] for result in report.values())
+    mirrored = f"copied {counts['mirrored']} from the mirror, " if counts['mirrored'] else ""
+    print(f"Downloaded {counts['downloaded']}, {mirrored}skipped {counts['skipped']} already present, "
+          f"failed {counts['failed']} of {len(report)} PDB files.")
+    for result in report.values():
+        if result['status'] == 'failed':
+            print(f"  {result['id']}: {result['error']}")
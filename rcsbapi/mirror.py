@@ -0,0 +1,184 @@
+import os
+import gzip
+import time
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import fetch
+
+DEFAULT_ROOT = os.environ.get('PDB_MIRROR', os.path.expanduser('~/.pdb_mirror'))
+
+def normalize_space_group(space_group):
+    """'P 21 21 21' and 'P212121' refer to the same group; compare without spaces."""
+    return space_group.replace(" ", "")
+
+class PDBMirror:
+    """Local content-addressed store of PDB files.
+
+    Every structure is stored once, gzip-compressed, under objects/<sha[:2]>/<sha>.pdb.gz,
+    where sha is the SHA-256 of the uncompressed file. index.sqlite records for every ID
+    its hash, size and fetch time, and which space groups it was fetched for, so the
+    same structure pulled for several groups or machines costs one copy.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or DEFAULT_ROOT
+        os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.root, 'index.sqlite'))
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                id TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL,
+                stored_size INTEGER NOT NULL, fetched_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS space_groups (
+                id TEXT NOT NULL, space_group TEXT NOT NULL, PRIMARY KEY (id, space_group));
+        ''')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _object_path(self, sha):
+        return os.path.join(self.root, 'objects', sha[:2], f"{sha}.pdb.gz")
+
+    def lookup(self, protein_id):
+        """Return the index row (id, sha256, size, stored_size, fetched_at) or None."""
+        return self.conn.execute('SELECT id, sha256, size, stored_size, fetched_at FROM entries WHERE id = ?',
+                                 (protein_id.lower(),)).fetchone()
+
+    def has(self, protein_id):
+        row = self.lookup(protein_id)
+        return row is not None and os.path.isfile(self._object_path(row[1]))
+
+    def add(self, protein_id, data, space_group=None):
+        """Store the contents of one PDB file (bytes) and index it, returns its hash."""
+        sha = hashlib.sha256(data).hexdigest()
+        object_path = self._object_path(sha)
+        if not os.path.isfile(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(object_path), suffix='.part')
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz:
+                gz.write(data)
+            os.replace(tmp_path, object_path)
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO entries (id, sha256, size, stored_size, fetched_at) '
+                              'VALUES (?, ?, ?, ?, ?)',
+                              (protein_id.lower(), sha, len(data), os.path.getsize(object_path), time.time()))
+            if space_group:
+                self.tag(protein_id, space_group, commit=False)
+        return sha
+
+    def add_file(self, path, protein_id=None, space_group=None):
+        """Import an existing <id>.pdb file."""
+        protein_id = protein_id or os.path.basename(path).split('.')[0]
+        with open(path, 'rb') as file:
+            return self.add(protein_id, file.read(), space_group)
+
+    def tag(self, protein_id, space_group, commit=True):
+        """Record that `protein_id` belongs to `space_group`."""
+        self.conn.execute('INSERT OR IGNORE INTO space_groups (id, space_group) VALUES (?, ?)',
+                          (protein_id.lower(), normalize_space_group(space_group)))
+        if commit:
+            self.conn.commit()
+
+    def ids(self, space_group=None):
+        """All mirrored IDs, or those recorded for one space group."""
+        if space_group is None:
+            rows = self.conn.execute('SELECT id FROM entries ORDER BY id')
+        else:
+            rows = self.conn.execute('SELECT e.id FROM entries e JOIN space_groups s ON e.id = s.id '
+                                     'WHERE s.space_group = ? ORDER BY e.id', (normalize_space_group(space_group),))
+        return [row[0] for row in rows]
+
+    def export(self, protein_id, dest_path):
+        """Decompress a mirrored structure to `dest_path` (written atomically)."""
+        row = self.lookup(protein_id)
+        if row is None:
+            raise KeyError(f"{protein_id} is not in the mirror at {self.root}")
+        tmp_path = f"{dest_path}.part"
+        with gzip.open(self._object_path(row[1]), 'rb') as gz, open(tmp_path, 'wb') as file:
+            file.write(gz.read())
+        os.replace(tmp_path, dest_path)
+        return dest_path
+
+    def resolve(self, protein_ids, target_dir, space_group=None, **download_kwargs):
+        """Materialise <id>.pdb files in `target_dir`, from the mirror where possible.
+
+        IDs the mirror does not have are downloaded with fetch.download_files and added to
+        the mirror. Returns the fetch-style per-ID report, with status 'mirrored' for hits.
+        """
+        os.makedirs(target_dir, exist_ok=True)
+        report, misses = {}, []
+        for protein_id in dict.fromkeys(protein_ids):
+            dest_path = os.path.join(target_dir, f"{protein_id}.pdb")
+            if os.path.isfile(dest_path) and os.path.getsize(dest_path) > 0:
+                if not self.has(protein_id):
+                    self.add_file(dest_path, protein_id)
+                report[protein_id] = {'id': protein_id, 'status': 'skipped', 'path': dest_path, 'error': None}
+            elif self.has(protein_id):
+                self.export(protein_id, dest_path)
+                report[protein_id] = {'id': protein_id, 'status': 'mirrored', 'path': dest_path, 'error': None}
+            else:
+                misses.append(protein_id)
+                continue
+            if space_group:
+                self.tag(protein_id, space_group, commit=False)
+        self.conn.commit()
+
+        if misses:
+            downloaded = fetch.download_files(misses, target_dir, **download_kwargs)
+            for protein_id, result in downloaded.items():
+                if result['status'] != 'failed':
+                    self.add_file(result['path'], protein_id, space_group)
+            report.update(downloaded)
+        return {protein_id: report[protein_id] for protein_id in dict.fromkeys(protein_ids)}
+
+    def stats(self):
+        """Number of IDs, distinct objects, and uncompressed vs stored bytes."""
+        n_ids, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        n_objects, stored = self.conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(stored_size), 0) FROM '
+            '(SELECT sha256, MAX(stored_size) AS stored_size FROM entries GROUP BY sha256)').fetchone()
+        return {'ids': n_ids, 'objects': n_objects, 'bytes': size, 'stored_bytes': stored}
+
+def main():
+    parser = argparse.ArgumentParser(description='Local compressed mirror of PDB files.')
+    parser.add_argument('--root', type=str, default=DEFAULT_ROOT,
+                        help='Mirror directory (default: $PDB_MIRROR or ~/.pdb_mirror)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Write mirrored PDB files into a directory')
+    export_parser.add_argument('--space-group', type=str, default=None, help='Only IDs recorded for this space group')
+    export_parser.add_argument('--dest', type=str, required=True, help='Directory to write <id>.pdb files to')
+    export_parser.add_argument('ids', nargs='*', help='Specific IDs (default: all for the space group)')
+
+    import_parser = subparsers.add_parser('import', help='Add existing .pdb files to the mirror')
+    import_parser.add_argument('--space-group', type=str, default=None, help='Space group the files belong to')
+    import_parser.add_argument('files', nargs='+', help='.pdb files named <id>.pdb')
+
+    subparsers.add_parser('stats', help='Show mirror size and deduplication')
+    args = parser.parse_args()
+
+    with PDBMirror(args.root) as mirror:
+        if args.command == 'export':
+            os.makedirs(args.dest, exist_ok=True)
+            ids = args.ids or mirror.ids(args.space_group)
+            for protein_id in ids:
+                mirror.export(protein_id, os.path.join(args.dest, f"{protein_id}.pdb"))
+            print(f"Exported {len(ids)} PDB files to {args.dest}")
+        elif args.command == 'import':
+            for path in args.files:
+                mirror.add_file(path, space_group=args.space_group)
+            print(f"Imported {len(args.files)} PDB files into {mirror.root}")
+        else:
+            stats = mirror.stats()
+            print(f"{stats['ids']} IDs in {stats['objects']} objects, "
+                  f"{stats['bytes'] / 1e6:.1f} MB stored as {stats['stored_bytes'] / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
-import requests
-import os
 import argparse
+import fetch
+from mirror import DEFAULT_ROOT, PDBMirror
 
 def download_pdb(protein_id, output_dir):
     """
@@ -10,37 +10,53 @@ def download_pdb(protein_id, output_dir):
         protein_id (str): The PDB ID (e.g., '6lzg')
         output_dir (str): Directory to save the PDB file
     """
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Format URL and filename
-    url = f"https://files.rcsb.org/download/{protein_id}.pdb"
-    output_file = os.path.join(output_dir, f"{protein_id}.pdb")
+    download_pdbs([protein_id], output_dir)
+
+def download_pdbs(protein_ids, output_dir, max_workers=8, mirror=None):
+    """
+    Download PDB files for several protein IDs concurrently over one connection pool.
     
-    try:
-        # Check if URL is accessible
-        response = requests.head(url)
-        if response.status_code == 200:
-            # Download the file
-            response = requests.get(url)
-            with open(output_file, 'wb') as f:
-                f.write(response.content)
-            print(f"Successfully downloaded {protein_id} to {output_file}")
+    Args:
+        protein_ids (list): The PDB IDs (e.g., ['6lzg', '253l'])
+        output_dir (str): Directory to save the PDB files
+        max_workers (int): Maximum number of concurrent downloads
+        mirror (PDBMirror): Local mirror to copy from first, misses are downloaded and added
+
+    Returns:
+        dict: Per-ID report with status 'downloaded', 'skipped' or 'failed'
+    """
+    if mirror is not None:
+        report = mirror.resolve(protein_ids, output_dir, max_workers=max_workers)
+    else:
+        report = fetch.download_files(protein_ids, output_dir, max_workers=max_workers)
+    for result in report.values():
+        if result['status'] == 'mirrored':
+            print(f"Copied {result['id']} from the local mirror to {result['path']}")
+        elif result['status'] == 'downloaded':
+            print(f"Successfully downloaded {result['id']} to {result['path']}")
+        elif result['status'] == 'skipped':
+            print(f"Already present: {result['path']}")
         else:
-            print(f"Error: Could not access PDB file for {protein_id}")
-    except Exception as e:
-        print(f"Error downloading {protein_id}: {str(e)}")
+            print(f"Error downloading {result['id']}: {result['error']}")
+    return report
 
 def main():
-    parser = argparse.ArgumentParser(description='Download PDB file for a given protein ID')
-    parser.add_argument('protein_id', type=str, help='Protein ID (e.g., 253L)')
+    parser = argparse.ArgumentParser(description='Download PDB files for the given protein IDs')
+    parser.add_argument('protein_ids', type=str, nargs='+', help='Protein ID(s) (e.g., 253L 6LZG)')
     parser.add_argument('--output_dir', type=str, default='pdb_files', 
                         help='Directory to save PDB files (default: pdb_files)')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Maximum number of concurrent downloads (default: 8)')
+    parser.add_argument('--mirror', type=str, default=DEFAULT_ROOT,
+                        help='Local PDB mirror to resolve through (default: $PDB_MIRROR or ~/.pdb_mirror)')
+    parser.add_argument('--no-mirror', action='store_true',
+                        help='Always download from RCSB, bypassing the local mirror')
     
     args = parser.parse_args()
     
-    # Download the PDB file
-    download_pdb(args.protein_id.lower(), args.output_dir)
+    # Download the PDB files
+    mirror = None if args.no_mirror else PDBMirror(args.mirror)
+    download_pdbs([protein_id.lower() for protein_id in args.protein_ids], args.output_dir, args.workers, mirror)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -21,6 +21,12 @@ TXT_OUTDIR="$(pwd)/$SPACEGROUP/out/out_$SPACEGROUP"
 MTZ_OUTDIR="$(pwd)/$SPACEGROUP/mtz/mtz_$SPACEGROUP"
 HKL_OUTDIR="$(pwd)/$SPACEGROUP/data/data_$SPACEGROUP"
 
+# Populate the PDB directory from the local PDB mirror (mirror.py) when one is configured
+if [ -n "$PDB_MIRROR" ]; then
+    python3 "$(dirname "$0")/mirror.py" --root "$PDB_MIRROR" export --space-group "$SPACEGROUP" --dest "$PDB_DIR" \
+        || echo "Mirror export failed, using the files already in $PDB_DIR"
+fi
+
 # Ensure the PDB directory exists
 if [ ! -d "$PDB_DIR" ]; then
     read -p "PDB directory $PDB_DIR does not exist. Do you want to create it? (y/n): " choice
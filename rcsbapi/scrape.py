@@ -2,16 +2,58 @@ from rcsbsearchapi.search import TextQuery, AttributeQuery, SequenceQuery, SeqMo
 from rcsbsearchapi import rcsb_attributes as attrs
 from rcsbsearchapi.const import STRUCTURE_ATTRIBUTE_SEARCH_SERVICE
 import argparse
+import hashlib
+import json
+import os
+import time
+from itertools import islice
 # From rcsbsearchapi 
 # comment and add as needed, for reference check the quickstart.ipynb in rcsbsearchapi repo 
 
-def get_pdb_ids(space_group, str_type, limit=50):
+CACHE_DIR = os.path.expanduser('~/.cache/rcsb_search')
+CACHE_TTL = 24 * 3600  # seconds a cached search result stays valid
+PAGE_SIZE = 1000       # largest page requested from the search API
+
+def _cache_path(cache_dir, space_group):
+    key = hashlib.sha1(f"space_group_name_H_M={space_group}".encode()).hexdigest()
+    return os.path.join(cache_dir, f"{key}.json")
+
+def _load_cached(cache_dir, space_group, limit, ttl):
+    """Cached IDs for this query if fresh and long enough to satisfy `limit`, else None."""
+    try:
+        with open(_cache_path(cache_dir, space_group)) as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cached['fetched_at'] > ttl:
+        return None
+    if len(cached['ids']) < limit and not cached['complete']:
+        return None
+    return cached['ids'][:limit]
+
+def _store_cached(cache_dir, space_group, pdb_ids, complete):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir, space_group)
+    with open(f"{path}.part", 'w') as file:
+        json.dump({'space_group': space_group, 'fetched_at': time.time(), 'complete': complete, 'ids': pdb_ids}, file)
+    os.replace(f"{path}.part", path)
+
+def get_pdb_ids(space_group, str_type, limit=50, cache_dir=CACHE_DIR, ttl=CACHE_TTL):
+    # Served from the on-disk cache when the same search ran within `ttl` seconds (cache_dir=None disables)
+    if cache_dir:
+        pdb_lim = _load_cached(cache_dir, space_group, limit, ttl)
+        if pdb_lim is not None:
+            print(f"From cache: {space_group} \n", pdb_lim)
+            return pdb_lim
+
     # By default, service is set to "text" for structural attribute search
     q1 = AttributeQuery("symmetry.cell_setting", "exact_match", str_type, STRUCTURE_ATTRIBUTE_SEARCH_SERVICE)
     q2 = AttributeQuery("symmetry.space_group_name_H_M", "exact_match", space_group, STRUCTURE_ATTRIBUTE_SEARCH_SERVICE)
     query = q2  # combining queries use & | operators
-    pdb_ids = list(query())
-    pdb_lim = truncate(pdb_ids, limit)
+    # results are paged lazily, so stop requesting pages once `limit` IDs are in hand
+    pdb_lim = list(islice(query(rows=min(limit, PAGE_SIZE)), limit))
+    if cache_dir:
+        _store_cached(cache_dir, space_group, pdb_lim, complete=len(pdb_lim) < limit)
     print(f"From search: {space_group} \n", pdb_lim)
     return pdb_lim
 
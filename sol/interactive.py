@@ -1,56 +1,132 @@
 #!/usr/bin/env python3
 """
 Efficient interactive session launcher for SOL supercomputer.
-Usage: python interactive.py start [cpu|gpu] <hours>
+Usage: python interactive.py start [cpu|gpu] <hours> [--auto] [--cpus N] [--gpus N]
 """
 
 import subprocess
 import sys
+import os
+import re
+import json
+import time
 import argparse
+from collections import Counter
 from datetime import datetime
 
-def get_partition_info():
-    """Get partition information using minimal processing"""
+CACHE_DIR = os.path.expanduser('~/.cache/sol_interactive')
+CACHE_TTL = 60  # seconds a node snapshot is reused before sinfo is run again
+SINFO_FIELDS = ['PartitionName', 'NodeHost', 'StateLong', 'CPUsState', 'Gres', 'GresUsed', 'TimeLimit', 'Available']
+
+def is_highmem_or_htc(part):
+    """The highmem/htc partitions, which the launcher offers for gpu sessions and never for cpu"""
+    return 'highmem' in part['name'] or 'htc' in part['name']
+
+def offers(part, resource_type):
+    """cpu: every partition but highmem/htc; gpu: highmem/htc and any other with GPUs in its GRES"""
+    if resource_type == 'gpu':
+        return is_highmem_or_htc(part) or part['gpus'] > 0
+    return not is_highmem_or_htc(part)
+
+def _gpu_count(gres):
+    """Number of GPUs in a Slurm GRES string such as 'gpu:a100:4(S:0-1)' or 'gpu:2,gpu:v100:1'"""
+    return sum(int(n) for n in re.findall(r'gpu(?::[^:(,]+)?:(\d+)', gres))
+
+def parse_timelimit(timelimit):
+    """Slurm time limit ('2-00:00:00', '4:00:00', 'infinite') in hours; unparseable values ('n/a', 'NOT_SET') count as unlimited"""
+    if timelimit.lower() in ('infinite', 'unlimited'):
+        return float('inf')
+    days, _, clock = timelimit.rpartition('-')
+    try:
+        parts = [int(p) for p in clock.split(':')]
+        days = int(days or 0)
+    except ValueError:
+        return float('inf')
+    parts = [0] * (3 - len(parts)) + parts if len(parts) < 3 else parts
+    return days * 24 + parts[0] + parts[1] / 60 + parts[2] / 3600
+
+def fetch_node_snapshot():
+    """Per-partition idle/mixed nodes and free CPUs/GPUs from one node-level sinfo call"""
+    cmd = ['sinfo', '-h', '-N', '-O', ','.join(f'{field}:128' for field in SINFO_FIELDS)]
     try:
-        cmd = ['sinfo', '-h', '-o', '%P %a %l %D %T %N']
         result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return result.stdout.strip().split('\n')
     except subprocess.CalledProcessError as e:
-        print(f"Error fetching partition info: {e.stderr}")
+        print(f"Error fetching node info: {e.stderr}")
         sys.exit(1)
 
-def parse_partition_line(line):
-    """Parse a single partition line efficiently"""
+    partitions = {}
+    for line in result.stdout.strip().split('\n'):
+        fields = line.split()
+        if len(fields) != len(SINFO_FIELDS):
+            continue
+        name, node, state, cpus, gres, gres_used, timelimit, avail = fields
+        name = name.rstrip('*')
+        part = partitions.setdefault(name, {
+            'name': name, 'avail': avail, 'timelimit': timelimit, 'nodes': 0,
+            'idle_nodes': 0, 'mixed_nodes': 0, 'free_cpus': 0, 'free_gpus': 0, 'gpus': 0, 'node_free': []})
+        state = state.rstrip('*~#!%$@^-+').lower()
+        _, idle_cpus, _, _ = (int(n) for n in cpus.split('/'))
+        free_gpus = max(_gpu_count(gres) - _gpu_count(gres_used), 0)
+        part['nodes'] += 1
+        part['gpus'] += _gpu_count(gres)
+        if state in ('idle', 'mixed'):
+            part[f'{state}_nodes'] += 1
+            part['free_cpus'] += idle_cpus
+            part['free_gpus'] += free_gpus
+            part['node_free'].append([idle_cpus, free_gpus])
+    return {'fetched_at': time.time(), 'partitions': list(partitions.values())}
+
+def get_node_snapshot(ttl=CACHE_TTL, cache_dir=CACHE_DIR, refresh=False):
+    """Node snapshot from the on-disk cache if younger than `ttl` seconds, otherwise from sinfo"""
+    cache_path = os.path.join(cache_dir, 'snapshot.json')
+    if not refresh:
+        try:
+            with open(cache_path) as f:
+                snapshot = json.load(f)
+            if time.time() - snapshot['fetched_at'] < ttl:
+                return snapshot
+        except (OSError, ValueError, KeyError):
+            pass
+    snapshot = fetch_node_snapshot()
     try:
-        parts = line.split()
-        return {
-            'name': parts[0],
-            'avail': parts[1],
-            'timelimit': parts[2],
-            'nodes': int(parts[3]),
-            'state': parts[4],
-            'nodelist': parts[5] if len(parts) > 5 else ''
-        }
-    except (IndexError, ValueError):
-        return None
-
-def get_available_partitions(resource_type):
-    """Get available partitions based on resource type"""
-    partitions = []
-    partition_data = get_partition_info()
-    
-    for line in partition_data:
-        part = parse_partition_line(line)
-        if not part:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Warning: could not cache node snapshot: {e}")
+    return snapshot
+
+def get_pending_jobs():
+    """Pending job count per partition from one squeue call (empty if squeue is unavailable)"""
+    try:
+        result = subprocess.run(['squeue', '-h', '-t', 'PD', '-o', '%P'], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return Counter()
+    # a job pending on several partitions lists them comma separated
+    return Counter(name for line in result.stdout.split() for name in line.split(','))
+
+def rank_partitions(snapshot, resource_type, hours, cpus=1, gpus=0, pending=None):
+    """
+    Partitions that are up, allow `hours` and offer the resource type, best first.
+
+    A partition where a single node can take the request right now ranks first, so the
+    job should start immediately; ties and partitions that would queue are ordered by
+    pending jobs ahead, then by free resources.
+    """
+    pending = pending or Counter()
+    ranked = []
+    for part in snapshot['partitions']:
+        if part['avail'] != 'up' or parse_timelimit(part['timelimit']) < hours:
             continue
-            
-        # Filter based on resource type and availability
-        is_gpu = 'highmem' in part['name'] or 'htc' in part['name']
-        if ((resource_type == 'gpu' and is_gpu) or 
-            (resource_type == 'cpu' and not is_gpu)) and part['avail'] == 'up':
-            partitions.append(part)
-    
-    return partitions
+        if not offers(part, resource_type):
+            continue
+        fits_now = any(free_cpus >= cpus and free_gpus >= gpus for free_cpus, free_gpus in part['node_free'])
+        part = dict(part, fits_now=fits_now, pending=pending[part['name']])
+        ranked.append(part)
+    ranked.sort(key=lambda p: (not p['fits_now'], p['pending'], -p['free_gpus'], -p['free_cpus']))
+    return ranked
 
 def determine_qos(partition_name):
     """Determine QOS based on partition name"""
@@ -60,7 +136,7 @@ def determine_qos(partition_name):
         return 'public'
     return 'wildfire'
 
-def start_interactive_session(partition, resource_type, hours):
+def start_interactive_session(partition, resource_type, hours, cpus=1, gpus=1, dry_run=False):
     """Start an interactive session with specified parameters"""
     qos = determine_qos(partition['name'])
     
@@ -70,12 +146,12 @@ def start_interactive_session(partition, resource_type, hours):
         '--partition', partition['name'],
         '--qos', qos,
         '--time', f'{hours}:00:00',
-        '--cpus-per-task=1',
+        f'--cpus-per-task={cpus}',
         '--pty',
     ]
     
     if resource_type == 'gpu':
-        cmd.extend(['--gres=gpu:1'])
+        cmd.extend([f'--gres=gpu:{gpus}'])
     
     # Add shell command at the end
     cmd.append('/bin/bash')
@@ -85,6 +161,8 @@ def start_interactive_session(partition, resource_type, hours):
     print(f"Time limit: {hours} hours")
     print(f"Resource type: {resource_type}")
     print("\nCommand:", ' '.join(cmd))
+    if dry_run:
+        return
     
     try:
         subprocess.run(cmd)
@@ -98,37 +176,48 @@ def main():
     parser.add_argument('action', choices=['start'], help='Action to perform')
     parser.add_argument('resource_type', choices=['cpu', 'gpu'], help='Resource type')
     parser.add_argument('hours', type=int, help='Session duration in hours')
+    parser.add_argument('--auto', action='store_true', help='Pick the partition expected to start soonest and launch srun')
+    parser.add_argument('--cpus', type=int, default=1, help='CPUs per task (default: 1)')
+    parser.add_argument('--gpus', type=int, default=1, help='GPUs for a gpu session (default: 1)')
+    parser.add_argument('--ttl', type=int, default=CACHE_TTL, help=f'Reuse a node snapshot up to this many seconds old (default: {CACHE_TTL})')
+    parser.add_argument('--refresh', action='store_true', help='Ignore the cached node snapshot')
+    parser.add_argument('--dry-run', action='store_true', help='Print the srun command instead of running it')
     
     args = parser.parse_args()
+    gpus = args.gpus if args.resource_type == 'gpu' else 0
     
-    # Get available partitions
-    partitions = get_available_partitions(args.resource_type)
+    # Rank partitions by how soon the request can start
+    snapshot = get_node_snapshot(ttl=args.ttl, refresh=args.refresh)
+    partitions = rank_partitions(snapshot, args.resource_type, args.hours, args.cpus, gpus, get_pending_jobs())
     
     if not partitions:
         print(f"No available {args.resource_type} partitions found")
         sys.exit(1)
     
-    # Sort partitions by number of available nodes
-    partitions.sort(key=lambda x: x['nodes'], reverse=True)
-    
     # Display available partitions
-    print("\nAvailable partitions:")
+    age = int(time.time() - snapshot['fetched_at'])
+    print(f"\nAvailable partitions (node snapshot {age}s old):")
     for i, part in enumerate(partitions, 1):
-        print(f"{i}. {part['name']} ({part['nodes']} nodes, {part['timelimit']} time limit)")
+        start = 'starts now' if part['fits_now'] else f"{part['pending']} pending"
+        print(f"{i}. {part['name']} ({part['idle_nodes']} idle / {part['mixed_nodes']} mixed of {part['nodes']} nodes, "
+              f"{part['free_cpus']} free CPUs, {part['free_gpus']} free GPUs, {part['timelimit']} time limit, {start})")
     
     # Let user select partition
-    while True:
-        try:
-            choice = int(input("\nSelect partition number: ")) - 1
-            if 0 <= choice < len(partitions):
-                selected_partition = partitions[choice]
-                break
-            print("Invalid selection. Please try again.")
-        except ValueError:
-            print("Please enter a number.")
+    if args.auto:
+        selected_partition = partitions[0]
+    else:
+        while True:
+            try:
+                choice = int(input("\nSelect partition number: ")) - 1
+                if 0 <= choice < len(partitions):
+                    selected_partition = partitions[choice]
+                    break
+                print("Invalid selection. Please try again.")
+            except ValueError:
+                print("Please enter a number.")
     
     # Start session
-    start_interactive_session(selected_partition, args.resource_type, args.hours)
+    start_interactive_session(selected_partition, args.resource_type, args.hours, args.cpus, args.gpus, args.dry_run)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file